@@ -0,0 +1,106 @@
+from collections import deque
+import hmac
+import logging
+from threading import Lock
+
+import arrow
+
+from notifications import Notification
+
+
+log = logging.getLogger(__name__)
+
+
+def credentials_match(username, password, expected_username, expected_password):
+    # compare both values in full so the response time doesn't reveal which one was wrong
+    username_ok = hmac.compare_digest(username, expected_username)
+    password_ok = hmac.compare_digest(password, expected_password)
+    return username_ok and password_ok
+
+
+class LoginAttemptTracker(object):
+    def __init__(self, coop, max_attempts, window_secs, lockout_secs, summary_interval_secs):
+        self.coop = coop
+        self.max_attempts = max_attempts
+        self.window_secs = window_secs
+        self.lockout_secs = lockout_secs
+        self.summary_interval_secs = summary_interval_secs
+        self.lock = Lock()
+        self.attempts = {}
+        self.locked_until = {}
+        self.pending = {}
+        self.last_summary = arrow.utcnow()
+
+    def _prune(self, ip, now):
+        attempts = self.attempts.get(ip)
+        if attempts is None:
+            return
+        window_start = now.shift(seconds=-self.window_secs)
+        while attempts and attempts[0] < window_start:
+            attempts.popleft()
+        if not attempts:
+            del self.attempts[ip]
+
+    def is_locked_out(self, ip):
+        with self.lock:
+            locked_until = self.locked_until.get(ip)
+            if locked_until is None:
+                return False
+            if arrow.utcnow() >= locked_until:
+                del self.locked_until[ip]
+                return False
+            return True
+
+    def lockout_remaining(self, ip):
+        with self.lock:
+            locked_until = self.locked_until.get(ip)
+            if locked_until is None:
+                return 0
+            return max(0, int((locked_until - arrow.utcnow()).total_seconds()))
+
+    def record_failure(self, ip, username):
+        now = arrow.utcnow()
+        with self.lock:
+            self.attempts.setdefault(ip, deque()).append(now)
+            self._prune(ip, now)
+            pending = self.pending.setdefault(ip, {'first': now, 'count': 0, 'usernames': set(), 'locked_out': False})
+            pending['count'] += 1
+            pending['usernames'].add(username)
+            if len(self.attempts.get(ip, ())) >= self.max_attempts and ip not in self.locked_until:
+                self.locked_until[ip] = now.shift(seconds=self.lockout_secs)
+                pending['locked_out'] = True
+                log.warning('Too many failed login attempts from {}, locked out for {}s'.format(
+                    ip, self.lockout_secs))
+
+    def record_success(self, ip):
+        with self.lock:
+            self.attempts.pop(ip, None)
+
+    def notify_summary(self):
+        now = arrow.utcnow()
+        with self.lock:
+            if not self.pending or now < self.last_summary.shift(seconds=self.summary_interval_secs):
+                return
+            pending = self.pending
+            self.pending = {}
+            self.last_summary = now
+            for ip in self.attempts.keys():
+                self._prune(ip, now)
+            for ip in [ip for ip, locked_until in self.locked_until.items() if now >= locked_until]:
+                del self.locked_until[ip]
+
+        lines = []
+        for ip, attempts in sorted(pending.items()):
+            lines.append('{ip}: {count} attempt(s){locked_out}, usernames: {usernames}'.format(
+                ip=ip,
+                count=attempts['count'],
+                locked_out=' (locked out)' if attempts['locked_out'] else '',
+                usernames=', '.join(sorted(attempts['usernames']))))
+        self.coop.notifier_callback(
+            Notification('WARN',
+                         '{total} failed login attempt(s) since {since}:\n{details}',
+                         total=sum(attempts['count'] for attempts in pending.values()),
+                         since=min(attempts['first'] for attempts in pending.values()).to(
+                             self.coop.config['Main']['TIMEZONE']).format('MMMM DD, hh:mm a'),
+                         details='\n'.join(lines))
+        )
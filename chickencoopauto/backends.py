@@ -0,0 +1,116 @@
+import logging
+import Queue
+
+from notifications import Notification
+from utils import clock, StoppableThread
+
+
+log = logging.getLogger(__name__)
+
+
+class NotificationBackend(StoppableThread):
+    def __init__(self, name, threshold, max_severity='ERROR', queue_size=100):
+        super(NotificationBackend, self).__init__()
+        self.daemon = True
+        self.name = '{} notifications'.format(name)
+        self.min_level = Notification.severity_levels[threshold]
+        self.max_level = Notification.severity_levels[max_severity]
+        self.queue = Queue.Queue(queue_size)
+        self.dropped = 0
+
+    def accepts(self, notification):
+        return self.min_level <= Notification.severity_levels[notification.severity] <= self.max_level
+
+    def submit(self, notification):
+        try:
+            self.queue.put_nowait(notification)
+        except Queue.Full:
+            self.dropped += 1
+            log.error('{} queue is full, dropping: {}'.format(self.name, notification.message))
+
+    def run(self):
+        while not self.is_stopping() or not self.queue.empty():
+            try:
+                notification = self.queue.get(timeout=1)
+            except Queue.Empty:
+                self.tick()
+                continue
+            try:
+                self.deliver(notification)
+            except Exception:
+                log.exception('{} failed to deliver: {}'.format(self.name, notification.message))
+        self.tick(final=True)
+
+    def deliver(self, notification):
+        raise NotImplementedError
+
+    def tick(self, final=False):
+        pass
+
+
+class LogBackend(NotificationBackend):
+    def submit(self, notification):
+        # logging is cheap and should keep its ordering relative to other log lines
+        self.deliver(notification)
+
+    def deliver(self, notification):
+        log_message = '{}: {}'.format(notification.severity, notification.message)
+        if notification.severity == 'INFO':
+            log.info(log_message)
+        elif notification.severity == 'WARN':
+            log.warning(log_message)
+        elif notification.severity == 'ERROR':
+            log.error(log_message)
+
+
+class EmailBackend(NotificationBackend):
+    def __init__(self, name, threshold, dispatcher, emails_to, max_severity='ERROR', queue_size=100):
+        super(EmailBackend, self).__init__(name, threshold, max_severity, queue_size)
+        self.dispatcher = dispatcher
+        self.emails_to = emails_to
+
+    def deliver(self, notification):
+        self.dispatcher.send([self.emails_to], notification.message)
+
+
+class DigestBackend(EmailBackend):
+    def __init__(self, name, threshold, dispatcher, emails_to, interval_secs, timezone, max_severity='MANUAL'):
+        super(DigestBackend, self).__init__(name, threshold, dispatcher, emails_to, max_severity)
+        self.interval_secs = interval_secs
+        self.timezone = timezone
+        self.pending = []
+        self.last_sent = clock.utcnow()
+
+    def deliver(self, notification):
+        self.pending.append((clock.utcnow(), notification))
+        self.tick()
+
+    def tick(self, final=False):
+        now = clock.utcnow()
+        if not self.pending or (not final and now < self.last_sent.shift(seconds=self.interval_secs)):
+            return
+        lines = ['{} {}: {}'.format(created.to(self.timezone).format('MMMM DD, hh:mm a'),
+                                    notification.severity,
+                                    notification.message)
+                 for created, notification in self.pending]
+        self.dispatcher.send(
+            [self.emails_to],
+            '{} event(s) since {}:\n\n{}'.format(len(lines),
+                                                 self.last_sent.to(self.timezone).format('MMMM DD, hh:mm a'),
+                                                 '\n'.join(lines)))
+        self.pending = []
+        self.last_sent = now
+
+
+def create_backends(config, dispatcher, timezone):
+    backends = []
+    if config['LOG']:
+        backends.append(LogBackend('Log', config['LOG_THRESHOLD']))
+    if config['EMAIL']:
+        backends.append(EmailBackend('Email', config['EMAIL_THRESHOLD'], dispatcher, config['EMAILS_TO']))
+    if config['SMS']:
+        backends.append(EmailBackend('SMS', config['SMS_THRESHOLD'], dispatcher, config['SMS_TO']))
+    if config['DIGEST']:
+        backends.append(DigestBackend('Digest', config['DIGEST_THRESHOLD'], dispatcher, config['DIGEST_TO'],
+                                      config['DIGEST_INTERVAL'], timezone, max_severity=config['DIGEST_MAX_SEVERITY']))
+    return backends
@@ -0,0 +1,37 @@
+import json
+import logging
+import os
+
+
+log = logging.getLogger(__name__)
+
+
+def write_json_atomically(path, data, **dump_kwargs):
+    # readers see the old file or the new one, never half of it
+    temp_path = '{}.tmp'.format(path)
+    with open(temp_path, 'w') as json_file:
+        json.dump(data, json_file, **dump_kwargs)
+        # the coop loses power without warning, the rename must not land before the data
+        json_file.flush()
+        os.fsync(json_file.fileno())
+    os.rename(temp_path, path)
+
+
+def save_checkpoint(path, checkpoint):
+    try:
+        write_json_atomically(path, checkpoint, sort_keys=True)
+    except (IOError, OSError) as e:
+        log.error('Unable to save controller state to {}: {}'.format(path, e))
+
+
+def load_checkpoint(path):
+    try:
+        with open(path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    except (IOError, ValueError) as e:
+        log.info('No saved controller state at {}: {}'.format(path, e))
+        return None
+    if not isinstance(checkpoint, dict) or not isinstance(checkpoint.get('saved'), (int, float)):
+        log.warning('Ignoring controller state at {}, it has no save time'.format(path))
+        return None
+    return checkpoint
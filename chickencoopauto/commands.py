@@ -0,0 +1,61 @@
+import logging
+import Queue
+from threading import Event
+from time import time
+
+
+log = logging.getLogger(__name__)
+
+
+class Command(object):
+    def __init__(self, device, func, args, kwargs):
+        self.device = device
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.submitted = time()
+        self.result = None
+        self.error = None
+        self.done = Event()
+
+    def run(self):
+        try:
+            self.result = self.func(*self.args, **self.kwargs)
+        except Exception as e:
+            log.exception('Command for {} failed'.format(self.device))
+            self.error = e
+        finally:
+            self.done.set()
+
+    def wait(self, timeout=None):
+        # True once the control loop has run the command, False if it is still queued after timeout
+        return self.done.wait(timeout)
+
+
+class CommandQueue(object):
+    def __init__(self):
+        # a single consumer, the control loop, so commands for a device never interleave with each other or check()
+        self.queue = Queue.Queue()
+        self.processed = 0
+
+    def submit(self, device, func, *args, **kwargs):
+        command = Command(device, func, args, kwargs)
+        self.queue.put(command)
+        return command
+
+    def process(self, timeout=0):
+        # runs commands as they come in for up to timeout seconds, this is the control loop's idle time
+        deadline = time() + timeout
+        while True:
+            remaining = deadline - time()
+            try:
+                if remaining > 0:
+                    command = self.queue.get(timeout=remaining)
+                else:
+                    command = self.queue.get_nowait()
+            except Queue.Empty:
+                return
+            log.debug('Running command for {}, queued for {:.2f}s'.format(
+                command.device, time() - command.submitted))
+            command.run()
+            self.processed += 1
@@ -1,21 +1,31 @@
 # -*- coding: utf-8 -*-
 from base64 import decodestring
+from datetime import datetime
+from itertools import cycle
+import logging
 from re import sub
 from subprocess import call
+from time import time
 
 from arrow import now
+from dateutil import tz
 from plotly.offline import plot
 from plotly.graph_objs import Data, Figure, Layout, Scatter
 from transitions.core import EventData
 import web
 
+from auth import credentials_match
 from coop import Coop
 from notifications import Notification
 from utils import format_humi, format_temp, get_db
+from webserver import limit_concurrency
 
 
+log = logging.getLogger(__name__)
 render = web.template.render('templates')
 
+PROBE_COLORS = ['orange', 'purple', 'brown', 'teal', 'magenta']
+
 
 def get_username_password(auth):
     if not auth:
@@ -28,19 +38,19 @@ def get_username_password(auth):
 def validate_user(ctx, notify=False):
     if not ctx.env.get('HTTP_AUTHORIZATION'):
         return False
-    username, password = get_username_password(ctx.env.get('HTTP_AUTHORIZATION'))
     coop = Coop()
-    if username == coop.config['Authentication']['USERNAME'] and password == coop.config['Authentication']['PASSWORD']:
+    ip = ctx['ip']
+    if coop.login_attempts.is_locked_out(ip):
+        return False
+    username, password = get_username_password(ctx.env.get('HTTP_AUTHORIZATION'))
+    if credentials_match(username, password,
+                         coop.config['Authentication']['USERNAME'], coop.config['Authentication']['PASSWORD']):
+        coop.login_attempts.record_success(ip)
         return True
     else:
         if notify:
-            coop.notifier_callback(
-                Notification('WARN',
-                             'Failed login attempt: username={username}, password={password}, ip={ip}',
-                             username=username,
-                             password=password,
-                             ip=ctx['ip'])
-            )
+            # reported in the periodic summary, see LoginAttemptTracker.notify_summary
+            coop.login_attempts.record_failure(ip, username)
         return False
 
 
@@ -54,6 +64,12 @@ class Login(object):
     def GET(self):
         if validate_user(web.ctx, notify=True):
             raise web.seeother('/')
+        coop = Coop()
+        lockout_remaining = coop.login_attempts.lockout_remaining(web.ctx['ip'])
+        if lockout_remaining:
+            raise web.HTTPError('429 Too Many Requests',
+                                {'Retry-After': str(lockout_remaining)},
+                                'Too many failed login attempts, try again later')
         else:
             web.header('WWW-Authenticate', 'Basic realm="Authentication"')
             web.ctx.status = '401 Unauthorized'
@@ -62,18 +78,38 @@ class Login(object):
 class HeartbeatStatus(object):
     def GET(self):
         coop = Coop()
-        coop.check()
+        stalled = coop.is_stalled()
         return render.heartbeat(
-            coop.status,
-            coop.rebooting
+            'ERROR' if stalled or coop.last_status is None else coop.last_status,
+            coop.rebooting,
+            stalled,
+            coop.check_age(),
+            coop.stale_components(),
+            coop.notification_filter.sent,
+            coop.notification_filter.suppressed,
+            coop.ambient_temp_humi_sensor.read_counts(),
+            [coop.door_travel_times.summary(motion) for motion in ('opening', 'closing')],
+            [(relay.name.rstrip(': '), relay.duty_cycle.summary())
+             for relay in (coop.water_heater_relay, coop.light_relay, coop.fan_relay, coop.heater_relay)],
+            coop.log_handler.summary() if coop.log_handler is not None else 'not queued',
+            coop.first_decision_secs,
+            coop.checkpoint_restored
         )
 
 
+def _run_command(coop, device, func, *args, **kwargs):
+    # the control loop owns relays and the door, wait for it a bounded time and leave the command queued otherwise
+    command = coop.commands.submit(device, func, *args, **kwargs)
+    if not command.wait(coop.config['Web']['COMMAND_TIMEOUT']):
+        log.warning('{} command still queued after {}s'.format(device, coop.config['Web']['COMMAND_TIMEOUT']))
+    return command
+
+
 class CoopGetStatus(AuthenticatedUser):
     def GET(self):
         super(CoopGetStatus, self).GET()
         coop = Coop()
-        coop.check()
+        _run_command(coop, 'Coop', coop.check)
         return render.index(
             coop.status,
             coop.rebooting,
@@ -99,6 +135,7 @@ class CoopGetStatus(AuthenticatedUser):
             coop.sunset_sunrise_sensor.sunset_display(include_extra=True, display_extra=True, include_day=False),
             coop.door.state,
             coop.door.status(),
+            coop.door.motion,
             coop.water_level_dual_sensor.state,
             coop.water_level_dual_sensor.status(),
             coop.light.state,
@@ -116,22 +153,30 @@ class CoopGetStatus(AuthenticatedUser):
         )
 
 
-def _single_relay_operated_object_set_mode(obj, mode, **kwargs):
-    if mode not in ('auto', 'manual'):
-        raise web.seeother('/')
+def _set_mode(obj, mode, **kwargs):
     obj.set_state(mode)
     obj.check(**kwargs)
-    raise web.seeother('/')
 
 
-def _single_relay_operated_object_set_on_off(obj, state):
-    if state not in ('on', 'off'):
-        raise web.seeother('/')
+def _set_on_off(obj, state):
     if state == 'on':
         obj.turn_on()
     else:
         obj.turn_off()
     obj.set_state('manual-{}'.format(state))
+
+
+def _single_relay_operated_object_set_mode(obj, mode, **kwargs):
+    if mode not in ('auto', 'manual'):
+        raise web.seeother('/')
+    _run_command(Coop(), obj.name, _set_mode, obj, mode, **kwargs)
+    raise web.seeother('/')
+
+
+def _single_relay_operated_object_set_on_off(obj, state):
+    if state not in ('on', 'off'):
+        raise web.seeother('/')
+    _run_command(Coop(), obj.name, _set_on_off, obj, state)
     raise web.seeother('/')
 
 
@@ -198,23 +243,27 @@ class DoorSetMode(AuthenticatedUser):
         _single_relay_operated_object_set_mode(coop.door, mode, switches=coop.door_dual_sensor)
 
 
+def _door_open_close(coop, action):
+    event = EventData(None, None, None, None, None, {'switches': coop.door_dual_sensor})
+    if action == 'open':
+        coop.door.open(event)
+        state = 'open'
+    else:
+        coop.door.close(event)
+        state = 'closed'
+    day_night = coop.sunset_sunrise_sensor.state
+    if day_night == 'invalid':
+        day_night = 'night'
+    coop.door.set_state('manual-{}-{}'.format(state, day_night))
+
+
 class DoorOpenClose(AuthenticatedUser):
     def GET(self, action):
         super(DoorOpenClose, self).GET()
         if action not in ('open', 'close'):
             raise web.seeother('/')
         coop = Coop()
-        event = EventData(None, None, None, None, None, {'switches': coop.door_dual_sensor})
-        if action == 'open':
-            coop.door.open(event)
-            state = 'open'
-        else:
-            coop.door.close(event)
-            state = 'closed'
-        day_night = coop.sunset_sunrise_sensor.state
-        if day_night == 'invalid':
-            day_night = 'night'
-        coop.door.set_state('manual-{}-{}'.format(state, day_night))
+        _run_command(coop, coop.door.name, _door_open_close, coop, action)
         raise web.seeother('/')
 
 
@@ -237,19 +286,29 @@ class Reboot(AuthenticatedUser):
 
 
 class TempHumiGraph(AuthenticatedUser):
+    @limit_concurrency('GRAPH_MAX_CONCURRENT')
     def GET(self):
         super(TempHumiGraph, self).GET()
         get_data = web.input(range_days='7', action='read')
         range_days = get_data.range_days
         coop = Coop()
         db = get_db(coop)
+        history = coop.history if float(range_days) * 24 <= coop.config['Main']['HISTORY_HOURS'] else None
+        timezone = coop.config['Main']['TIMEZONE']
         data = Data([
-            scatter_graph_timeseries(db, 'AMBIENT_TEMP', 'Air Temperature', 'red', range_days=range_days),
-            scatter_graph_timeseries(db, 'WATER_TEMP', 'Water Temperature', 'blue', range_days=range_days),
-            scatter_graph_timeseries(db, 'AMBIENT_HUMI', 'Humidity', 'green', width=1, yaxis2=True, range_days=range_days),
+            scatter_graph_timeseries(db, 'AMBIENT_TEMP', 'Air Temperature', 'red', range_days=range_days,
+                                     history=history, timezone=timezone),
+            scatter_graph_timeseries(db, 'WATER_TEMP', 'Water Temperature', 'blue', range_days=range_days,
+                                     history=history, timezone=timezone),
+            scatter_graph_timeseries(db, 'AMBIENT_HUMI', 'Humidity', 'green', width=1, yaxis2=True,
+                                     range_days=range_days, history=history, timezone=timezone),
         ])
-        min_x = min(min(data[0].x), min(data[1].x), min(data[2].x))
-        max_x = max(max(data[0].x), max(data[1].x), max(data[2].x))
+        for probe, color in zip(coop.probe_sensors, cycle(PROBE_COLORS)):
+            data.append(scatter_graph_timeseries(db, '{}_TEMP'.format(probe.log_type), probe.name.rstrip(': '),
+                                                 color, width=2, range_days=range_days,
+                                                 history=history, timezone=timezone))
+        min_x = min(min(series.x) for series in data if series.x)
+        max_x = max(max(series.x) for series in data if series.x)
         temp_min = coop.config['Water']['HEATER_TEMP_RANGE'][1]
         temp_max = coop.config['AmbientTempHumi']['TEMP_FAN']
         layout = Layout(
@@ -308,14 +367,24 @@ class TempHumiGraph(AuthenticatedUser):
         )
 
 
-def scatter_graph_timeseries(db, log_type, name, color, width=3, yaxis2=False, range_days=7):
-    query = db.select(
-        'coop_log',
-        what='log_value, (created AT TIME ZONE \'UTC\') AT TIME ZONE \'US/Eastern\' as created_local',
-        where='log_type = \'{}\' and created > now() - interval \'{} day\''.format(log_type, range_days),
-        order='created asc'
-    )
-    x, y = zip(*[(i['created_local'], i['log_value']) for i in query])
+def scatter_graph_timeseries(db, log_type, name, color, timezone, width=3, yaxis2=False, range_days=7,
+                             history=None):
+    start = time() - float(range_days) * 86400
+    if history is not None and history.covers(log_type, start):
+        # recent enough to still be in memory
+        local = tz.gettz(timezone)
+        points = [(datetime.fromtimestamp(timestamp, local).replace(tzinfo=None), value)
+                  for timestamp, value in history.range(log_type, start)]
+    else:
+        query = db.select(
+            'coop_log',
+            vars={'timezone': timezone},
+            what='log_value, (created AT TIME ZONE \'UTC\') AT TIME ZONE $timezone as created_local',
+            where='log_type = \'{}\' and created > now() - interval \'{} day\''.format(log_type, range_days),
+            order='created asc'
+        )
+        points = [(i['created_local'], i['log_value']) for i in query]
+    x, y = zip(*points) or ((), ())
     return Scatter(
         x=x,
         y=y,
@@ -1,45 +1,182 @@
 import ConfigParser
+from functools import partial
 import logging
-import smtplib
-from time import sleep
+import os
+from time import time
 
 import Adafruit_DHT as DHT  # noqa: N814
+from dateutil import tz
 import RPi.GPIO as GPIO
 import web
 
+from auth import LoginAttemptTracker
+from backends import create_backends
+from checkpoint import load_checkpoint, save_checkpoint
+from commands import CommandQueue
+from dblog import DBLogWriter
+from gpio import InputSnapshot
+from history import History
 import led
-from notifications import Notification
+from logs import find_queue_handler
+from mailer import EmailDispatcher
+from notifications import Notification, NotificationFilter
+from onewire import ThermBus
 import relays
 import sensors
-from utils import Singleton, StoppableThread
+from telemetry import load_duty_cycles, save_duty_cycles, TravelTimes
+from utils import clock, Singleton, StoppableThread
 
 
 log = logging.getLogger(__name__)
 
+CONFIG_PATH = 'config.ini'
+
+# options added since the first release, a config.ini written before them gets these values
+CONFIG_DEFAULTS = {
+    'Main': {
+        'STALL_THRESHOLD': '120',
+        'TIMEZONE': 'US/Eastern',
+        'SUNRISE_SUNSET_CACHE': 'sunrise_sunset_cache.json',
+        'SUNRISE_SUNSET_CACHE_DAYS': '30',
+        'HISTORY_HOURS': '48',
+        'DUTY_CYCLE_FILE': 'duty_cycles.json',
+        'DUTY_CYCLE_SAVE_INTERVAL': '300',
+        'CONFIG_WATCH_INTERVAL': '10',
+        'CHECKPOINT_FILE': 'controller_state.json',
+        'CHECKPOINT_INTERVAL': '300',
+        'CHECKPOINT_MAX_AGE': '900',
+    },
+    'AmbientTempHumi': {
+        'READ_ATTEMPTS': '5',
+        'FILTER_SIZE': '5',
+        'MAX_TEMP_JUMP': '10.0',
+        'MAX_HUMI_JUMP': '20.0',
+        'FAN_WATTS': '20',
+        'FAN_MIN_ON': '300',
+        'FAN_MIN_OFF': '300',
+        'HEATER_WATTS': '250',
+        'HEATER_MIN_ON': '600',
+        'HEATER_MIN_OFF': '300',
+    },
+    'Light': {
+        'WATTS': '10',
+    },
+    'Water': {
+        'HEATER_WATTS': '100',
+        'HEATER_MIN_ON': '600',
+        'HEATER_MIN_OFF': '300',
+        'SENSOR_ID': '',
+    },
+    'OneWire': {
+        'INTERVAL': '10',
+        'RESOLUTION': '12',
+        'STALE': '60',
+    },
+    'Door': {
+        'TRAVEL_BASELINE': '20',
+        'TRAVEL_DRIFT': '0.25',
+        'TRAVEL_TIMEOUT_FACTOR': '1.5',
+    },
+    'Notifications': {
+        'SMTP_HOST': 'smtp.gmail.com',
+        'SMTP_PORT': '465',
+        'SMTP_SSL': 'True',
+        'SMTP_RETRIES': '5',
+        'DEDUP_WINDOW': '900',
+        'FLAP_WINDOW': '600',
+        'FLAP_THRESHOLD': '4',
+        # unlike config.ini.example, nobody asked for a digest or gave an address for it
+        'DIGEST': 'False',
+        'DIGEST_THRESHOLD': 'INFO',
+        'DIGEST_MAX_SEVERITY': 'MANUAL',
+        'DIGEST_TO': '',
+        'DIGEST_INTERVAL': '3600',
+    },
+    'Authentication': {
+        'MAX_ATTEMPTS': '5',
+        'ATTEMPT_WINDOW': '300',
+        'LOCKOUT': '900',
+        'SUMMARY_INTERVAL': '900',
+    },
+    'Web': {
+        'SERVER': 'threaded',
+        'WORKER_THREADS': '4',
+        'REQUEST_QUEUE_SIZE': '10',
+        'GRAPH_MAX_CONCURRENT': '1',
+        'COMMAND_TIMEOUT': '10',
+    },
+}
+
 
 class Coop(StoppableThread, Singleton):
+    # options read where they are used, a reload applies them without any setter
+    live_config_options = [
+        ('Authentication', 'USERNAME'),
+        ('Authentication', 'PASSWORD'),
+        ('Main', 'CHECK_FREQUENCY'),
+        ('Main', 'STALL_THRESHOLD'),
+        ('Main', 'DUTY_CYCLE_SAVE_INTERVAL'),
+        ('Main', 'CONFIG_WATCH_INTERVAL'),
+        ('Main', 'CHECKPOINT_INTERVAL'),
+        ('Main', 'CHECKPOINT_MAX_AGE'),
+        ('Database', 'USERNAME'),
+        ('Database', 'PASSWORD'),
+        ('Database', 'LOGGING_INTERVAL'),
+        ('Web', 'COMMAND_TIMEOUT'),
+        ('Webcam', 'URL'),
+    ]
+
     def __init__(self):
+        # Singleton hands out the same instance, but __init__ still runs on every Coop(), only reload_config()
+        # reads config.ini again
+        if getattr(self, 'constructed', False):
+            return
         StoppableThread.__init__(self)
         Singleton.__init__(self)
         GPIO.setmode(GPIO.BCM)
         GPIO.setwarnings(False)
         self.config = self._read_config()
+        self.config_mtime = self._config_mtime()
+        self.config_checked = time()
         self.render = web.template.render('templates')
+        self.constructed = True
 
     @staticmethod
     def _read_config():
         parser = ConfigParser.ConfigParser()
-        parser.read('config.ini')
+        if not parser.read(CONFIG_PATH):
+            raise ValueError('Unable to read {}'.format(CONFIG_PATH))
+        for section, options in CONFIG_DEFAULTS.items():
+            if not parser.has_section(section):
+                parser.add_section(section)
+            for option, value in options.items():
+                if not parser.has_option(section, option):
+                    parser.set(section, option, value)
 
         authentication_options = {
             'USERNAME': parser.get('Authentication', 'USERNAME'),
             'PASSWORD': parser.get('Authentication', 'PASSWORD'),
+            'MAX_ATTEMPTS': parser.getint('Authentication', 'MAX_ATTEMPTS'),
+            'ATTEMPT_WINDOW': parser.getint('Authentication', 'ATTEMPT_WINDOW'),
+            'LOCKOUT': parser.getint('Authentication', 'LOCKOUT'),
+            'SUMMARY_INTERVAL': parser.getint('Authentication', 'SUMMARY_INTERVAL'),
         }
 
         main_options = {
             'CHECK_FREQUENCY': parser.getint('Main', 'CHECK_FREQUENCY'),
+            'STALL_THRESHOLD': parser.getint('Main', 'STALL_THRESHOLD'),
             'LAT': parser.getfloat('Main', 'LAT'),
             'LON': parser.getfloat('Main', 'LON'),
+            'TIMEZONE': parser.get('Main', 'TIMEZONE'),
+            'SUNRISE_SUNSET_CACHE': parser.get('Main', 'SUNRISE_SUNSET_CACHE'),
+            'SUNRISE_SUNSET_CACHE_DAYS': parser.getint('Main', 'SUNRISE_SUNSET_CACHE_DAYS'),
+            'HISTORY_HOURS': parser.getint('Main', 'HISTORY_HOURS'),
+            'DUTY_CYCLE_FILE': parser.get('Main', 'DUTY_CYCLE_FILE'),
+            'DUTY_CYCLE_SAVE_INTERVAL': parser.getint('Main', 'DUTY_CYCLE_SAVE_INTERVAL'),
+            'CONFIG_WATCH_INTERVAL': parser.getint('Main', 'CONFIG_WATCH_INTERVAL'),
+            'CHECKPOINT_FILE': parser.get('Main', 'CHECKPOINT_FILE'),
+            'CHECKPOINT_INTERVAL': parser.getint('Main', 'CHECKPOINT_INTERVAL'),
+            'CHECKPOINT_MAX_AGE': parser.getint('Main', 'CHECKPOINT_MAX_AGE'),
         }
 
         status_led_options = {
@@ -60,19 +197,33 @@ class Coop(StoppableThread, Singleton):
                 parser.getfloat('AmbientTempHumi', 'HUMI_MAX'),
             ],
             'TEMP_HUMI_CACHE': parser.getint('AmbientTempHumi', 'TEMP_HUMI_CACHE'),
+            'READ_ATTEMPTS': parser.getint('AmbientTempHumi', 'READ_ATTEMPTS'),
+            'FILTER_SIZE': parser.getint('AmbientTempHumi', 'FILTER_SIZE'),
+            'MAX_TEMP_JUMP': parser.getfloat('AmbientTempHumi', 'MAX_TEMP_JUMP'),
+            'MAX_HUMI_JUMP': parser.getfloat('AmbientTempHumi', 'MAX_HUMI_JUMP'),
             'SENSOR_PORT': parser.getint('AmbientTempHumi', 'SENSOR_PORT'),
             'TEMP_FAN': parser.getfloat('AmbientTempHumi', 'TEMP_FAN'),
             'FAN_PORT': parser.getint('AmbientTempHumi', 'FAN_PORT'),
+            'FAN_WATTS': parser.getfloat('AmbientTempHumi', 'FAN_WATTS'),
+            'FAN_MIN_ON': parser.getint('AmbientTempHumi', 'FAN_MIN_ON'),
+            'FAN_MIN_OFF': parser.getint('AmbientTempHumi', 'FAN_MIN_OFF'),
             'TEMP_HEATER': parser.getfloat('AmbientTempHumi', 'TEMP_HEATER'),
             'HEATER_PORT': parser.getint('AmbientTempHumi', 'HEATER_PORT'),
+            'HEATER_WATTS': parser.getfloat('AmbientTempHumi', 'HEATER_WATTS'),
+            'HEATER_MIN_ON': parser.getint('AmbientTempHumi', 'HEATER_MIN_ON'),
+            'HEATER_MIN_OFF': parser.getint('AmbientTempHumi', 'HEATER_MIN_OFF'),
         }
 
         light_options = {
             'PORT': parser.getint('Light', 'PORT'),
+            'WATTS': parser.getfloat('Light', 'WATTS'),
         }
 
         water_options = {
             'HEATER_PORT': parser.getint('Water', 'HEATER_PORT'),
+            'HEATER_WATTS': parser.getfloat('Water', 'HEATER_WATTS'),
+            'HEATER_MIN_ON': parser.getint('Water', 'HEATER_MIN_ON'),
+            'HEATER_MIN_OFF': parser.getint('Water', 'HEATER_MIN_OFF'),
             'HEATER_TEMP_RANGE': [
                 parser.getfloat('Water', 'HEATER_TEMP_LOW_ERROR'),
                 parser.getfloat('Water', 'HEATER_TEMP_ON'),
@@ -81,8 +232,31 @@ class Coop(StoppableThread, Singleton):
             ],
             'SENSOR_LEVEL_TOP_PORT': parser.getint('Water', 'SENSOR_LEVEL_TOP_PORT'),
             'SENSOR_LEVEL_BOTTOM_PORT': parser.getint('Water', 'SENSOR_LEVEL_BOTTOM_PORT'),
+            # blank picks the first probe on the bus that isn't configured in a [Probe ...] section
+            'SENSOR_ID': parser.get('Water', 'SENSOR_ID'),
+        }
+
+        onewire_options = {
+            'INTERVAL': parser.getint('OneWire', 'INTERVAL'),
+            'RESOLUTION': parser.getint('OneWire', 'RESOLUTION'),
+            'STALE': parser.getint('OneWire', 'STALE'),
         }
 
+        probes_options = []
+        for section in parser.sections():
+            if section.startswith('Probe '):
+                probes_options.append({
+                    'SENSOR_ID': section[len('Probe '):].strip(),
+                    'NAME': parser.get(section, 'NAME'),
+                    'LOG_TYPE': parser.get(section, 'LOG_TYPE'),
+                    'TEMP_RANGE': [
+                        parser.getfloat(section, 'TEMP_MIN_ERROR'),
+                        parser.getfloat(section, 'TEMP_MIN'),
+                        parser.getfloat(section, 'TEMP_MAX'),
+                        parser.getfloat(section, 'TEMP_MAX_ERROR'),
+                    ],
+                })
+
         door_options = {
             'PORT_1': parser.getint('Door', 'PORT_1'),
             'PORT_2': parser.getint('Door', 'PORT_2'),
@@ -91,6 +265,9 @@ class Coop(StoppableThread, Singleton):
             'SENSOR_TIMEOUT': parser.getint('Door', 'SENSOR_TIMEOUT'),
             'EXTRA_MIN_SUNRISE': parser.getint('Door', 'EXTRA_MIN_SUNRISE'),
             'EXTRA_MIN_SUNSET': parser.getint('Door', 'EXTRA_MIN_SUNSET'),
+            'TRAVEL_BASELINE': parser.getint('Door', 'TRAVEL_BASELINE'),
+            'TRAVEL_DRIFT': parser.getfloat('Door', 'TRAVEL_DRIFT'),
+            'TRAVEL_TIMEOUT_FACTOR': parser.getfloat('Door', 'TRAVEL_TIMEOUT_FACTOR'),
         }
 
         other_options = {
@@ -109,6 +286,18 @@ class Coop(StoppableThread, Singleton):
             'SMS': parser.getboolean('Notifications', 'SMS'),
             'SMS_THRESHOLD': parser.get('Notifications', 'SMS_THRESHOLD'),
             'SMS_TO': parser.get('Notifications', 'SMS_TO'),
+            'SMTP_HOST': parser.get('Notifications', 'SMTP_HOST'),
+            'SMTP_PORT': parser.getint('Notifications', 'SMTP_PORT'),
+            'SMTP_SSL': parser.getboolean('Notifications', 'SMTP_SSL'),
+            'SMTP_RETRIES': parser.getint('Notifications', 'SMTP_RETRIES'),
+            'DEDUP_WINDOW': parser.getint('Notifications', 'DEDUP_WINDOW'),
+            'FLAP_WINDOW': parser.getint('Notifications', 'FLAP_WINDOW'),
+            'FLAP_THRESHOLD': parser.getint('Notifications', 'FLAP_THRESHOLD'),
+            'DIGEST': parser.getboolean('Notifications', 'DIGEST'),
+            'DIGEST_THRESHOLD': parser.get('Notifications', 'DIGEST_THRESHOLD'),
+            'DIGEST_MAX_SEVERITY': parser.get('Notifications', 'DIGEST_MAX_SEVERITY'),
+            'DIGEST_TO': parser.get('Notifications', 'DIGEST_TO'),
+            'DIGEST_INTERVAL': parser.getint('Notifications', 'DIGEST_INTERVAL'),
         }
 
         database_options = {
@@ -117,6 +306,14 @@ class Coop(StoppableThread, Singleton):
             'LOGGING_INTERVAL': parser.getint('Database', 'LOGGING_INTERVAL'),
         }
 
+        web_options = {
+            'SERVER': parser.get('Web', 'SERVER'),
+            'WORKER_THREADS': parser.getint('Web', 'WORKER_THREADS'),
+            'REQUEST_QUEUE_SIZE': parser.getint('Web', 'REQUEST_QUEUE_SIZE'),
+            'GRAPH_MAX_CONCURRENT': parser.getint('Web', 'GRAPH_MAX_CONCURRENT'),
+            'COMMAND_TIMEOUT': parser.getint('Web', 'COMMAND_TIMEOUT'),
+        }
+
         webcam_options = {
             'URL': parser.get('Webcam', 'URL'),
         }
@@ -128,23 +325,233 @@ class Coop(StoppableThread, Singleton):
             'AmbientTempHumi': ambient_options,
             'Light': light_options,
             'Water': water_options,
+            'OneWire': onewire_options,
+            'Probes': probes_options,
             'Door': door_options,
             'Other': other_options,
             'Notifications': notifications_options,
             'Database': database_options,
+            'Web': web_options,
             'Webcam': webcam_options,
         }
 
+        errors = Coop._validate_config(config)
+        if errors:
+            raise ValueError('Invalid {}: {}'.format(CONFIG_PATH, '; '.join(errors)))
+
         return config
 
+    @staticmethod
+    def _validate_config(config):
+        errors = []
+
+        ranges = [
+            ('AmbientTempHumi', 'TEMP_RANGE', config['AmbientTempHumi']['TEMP_RANGE']),
+            ('AmbientTempHumi', 'HUMI_RANGE', config['AmbientTempHumi']['HUMI_RANGE']),
+            ('Water', 'HEATER_TEMP_RANGE', config['Water']['HEATER_TEMP_RANGE']),
+        ] + [
+            ('Probe {}'.format(probe['SENSOR_ID']), 'TEMP_RANGE', probe['TEMP_RANGE']) for probe in config['Probes']
+        ]
+        for section, option, values in ranges:
+            if values != sorted(values):
+                errors.append('{} {} must be in increasing order, got {}'.format(section, option, values))
+
+        positive = [
+            ('Main', 'CHECK_FREQUENCY'),
+            ('Main', 'STALL_THRESHOLD'),
+            ('Main', 'HISTORY_HOURS'),
+            ('Main', 'DUTY_CYCLE_SAVE_INTERVAL'),
+            ('Main', 'CHECKPOINT_INTERVAL'),
+            ('AmbientTempHumi', 'READ_ATTEMPTS'),
+            ('AmbientTempHumi', 'FILTER_SIZE'),
+            ('OneWire', 'INTERVAL'),
+            ('Door', 'SENSOR_TIMEOUT'),
+            ('Web', 'WORKER_THREADS'),
+            ('Web', 'GRAPH_MAX_CONCURRENT'),
+            ('Web', 'COMMAND_TIMEOUT'),
+        ]
+        for section, option in positive:
+            if config[section][option] <= 0:
+                errors.append('{} {} must be positive'.format(section, option))
+
+        not_negative = [
+            ('Main', 'CONFIG_WATCH_INTERVAL'),
+            ('Main', 'CHECKPOINT_MAX_AGE'),
+            ('AmbientTempHumi', 'FAN_MIN_ON'),
+            ('AmbientTempHumi', 'FAN_MIN_OFF'),
+            ('AmbientTempHumi', 'HEATER_MIN_ON'),
+            ('AmbientTempHumi', 'HEATER_MIN_OFF'),
+            ('Water', 'HEATER_MIN_ON'),
+            ('Water', 'HEATER_MIN_OFF'),
+        ]
+        for section, option in not_negative:
+            if config[section][option] < 0:
+                errors.append('{} {} must not be negative'.format(section, option))
+
+        for option in ['LOG_THRESHOLD', 'EMAIL_THRESHOLD', 'SMS_THRESHOLD', 'DIGEST_THRESHOLD', 'DIGEST_MAX_SEVERITY']:
+            if config['Notifications'][option] not in Notification.severity_levels:
+                errors.append('Notifications {} must be one of {}'.format(
+                    option, ', '.join(sorted(Notification.severity_levels))))
+
+        if not 9 <= config['OneWire']['RESOLUTION'] <= 12:
+            errors.append('OneWire RESOLUTION must be between 9 and 12 bits')
+        if config['Web']['SERVER'] not in ['threaded', 'simple']:
+            errors.append('Web SERVER must be threaded or simple')
+        if tz.gettz(config['Main']['TIMEZONE']) is None:
+            errors.append('Main TIMEZONE {} is unknown'.format(config['Main']['TIMEZONE']))
+        if config['Water']['SENSOR_ID'] in [probe['SENSOR_ID'] for probe in config['Probes']]:
+            errors.append('Water SENSOR_ID {} is also configured as a probe'.format(config['Water']['SENSOR_ID']))
+
+        return errors
+
+    @staticmethod
+    def _config_mtime():
+        try:
+            return os.path.getmtime(CONFIG_PATH)
+        except OSError:
+            return None
+
+    def _config_setters(self):
+        # (section, options, setter), the setter gets the new section when any of the options changed
+        return [
+            ('AmbientTempHumi', ['TEMP_RANGE'],
+             lambda section: self.ambient_temp_humi_sensor.set_temp_range(section['TEMP_RANGE'])),
+            ('AmbientTempHumi', ['HUMI_RANGE'],
+             lambda section: self.ambient_temp_humi_sensor.set_humi_range(section['HUMI_RANGE'])),
+            ('AmbientTempHumi', ['TEMP_FAN'],
+             lambda section: self.fan.set_temp_range((section['TEMP_FAN'] - 5.0, section['TEMP_FAN']))),
+            ('AmbientTempHumi', ['TEMP_HEATER'],
+             lambda section: self.heater.set_temp_range((section['TEMP_HEATER'], section['TEMP_HEATER'] + 5.0))),
+            ('AmbientTempHumi', ['FAN_MIN_ON', 'FAN_MIN_OFF'],
+             lambda section: self.fan.set_dwell(section['FAN_MIN_ON'], section['FAN_MIN_OFF'])),
+            ('AmbientTempHumi', ['HEATER_MIN_ON', 'HEATER_MIN_OFF'],
+             lambda section: self.heater.set_dwell(section['HEATER_MIN_ON'], section['HEATER_MIN_OFF'])),
+            ('Water', ['HEATER_TEMP_RANGE'],
+             lambda section: self._set_water_temp_range(section['HEATER_TEMP_RANGE'])),
+            ('Water', ['HEATER_MIN_ON', 'HEATER_MIN_OFF'],
+             lambda section: self.water_heater.set_dwell(section['HEATER_MIN_ON'], section['HEATER_MIN_OFF'])),
+            ('Door', ['EXTRA_MIN_SUNRISE'],
+             lambda section: self.sunset_sunrise_sensor.set_extra_min_sunrise(section['EXTRA_MIN_SUNRISE'])),
+            ('Door', ['EXTRA_MIN_SUNSET'],
+             lambda section: self.sunset_sunrise_sensor.set_extra_min_sunset(section['EXTRA_MIN_SUNSET'])),
+        ]
+
+    def _set_water_temp_range(self, temp_range):
+        self.water_heater.set_temp_range(temp_range[1:3])
+        self.water_temp_sensor.set_temp_range(temp_range)
+
+    def _reload_probes(self, probes):
+        # only the thresholds of already running probes can change, adding or removing one needs a restart
+        def identity(probe):
+            return probe['SENSOR_ID'], probe['NAME'], probe['LOG_TYPE']
+
+        if [identity(probe) for probe in probes] != [identity(probe) for probe in self.config['Probes']]:
+            log.warning('Probes changed, restart to apply')
+            return self.config['Probes'], []
+        applied = []
+        for sensor, old, new in zip(self.probe_sensors, self.config['Probes'], probes):
+            if new['TEMP_RANGE'] != old['TEMP_RANGE']:
+                sensor.set_temp_range(new['TEMP_RANGE'])
+                applied.append('Probe {} TEMP_RANGE'.format(new['SENSOR_ID']))
+        return probes, applied
+
+    def reload_config(self):
+        # runs on the control loop, so a check never sees half of the new configuration
+        self.config_mtime = self._config_mtime()
+        try:
+            config = self._read_config()
+        except (ConfigParser.Error, ValueError) as e:
+            log.error('Configuration not reloaded, keeping the current one: {}'.format(e))
+            self.notifier_callback(
+                Notification('WARN',
+                             'Configuration not reloaded: {error}',
+                             error=e)
+            )
+            return False
+
+        changed = set()
+        for section, options in config.items():
+            if section != 'Probes':
+                changed.update((section, option) for option, value in options.items()
+                               if value != self.config[section][option])
+
+        applied = []
+        for section, options, setter in self._config_setters():
+            if any((section, option) in changed for option in options):
+                setter(config[section])
+                applied.extend('{} {}'.format(section, option) for option in options if (section, option) in changed)
+                changed.difference_update((section, option) for option in options)
+        for section, option in sorted(changed):
+            if (section, option) in self.live_config_options:
+                applied.append('{} {}'.format(section, option))
+            else:
+                log.warning('{} {} changed, restart to apply'.format(section, option))
+                config[section][option] = self.config[section][option]
+        config['Probes'], applied_probes = self._reload_probes(config['Probes'])
+        applied.extend(applied_probes)
+
+        self.config = config
+        if applied:
+            log.warn('Configuration reloaded, applied {}'.format(', '.join(applied)))
+        else:
+            log.info('Configuration reloaded, nothing to apply')
+        return True
+
+    def watch_config(self):
+        interval = self.config['Main']['CONFIG_WATCH_INTERVAL']
+        if not interval or time() - self.config_checked < interval:
+            return
+        self.config_checked = time()
+        mtime = self._config_mtime()
+        if mtime is not None and mtime != self.config_mtime:
+            log.info('{} changed, reloading'.format(CONFIG_PATH))
+            self.reload_config()
+
     def initialize_sensors_relays(self):
+        self.booted = clock.time()
+        self.shut_down = False
+        self.db_log = DBLogWriter(self)
+        self.db_log.start()
+        self.email_dispatcher = EmailDispatcher(
+            self.config['Notifications']['SMTP_HOST'],
+            self.config['Notifications']['SMTP_PORT'],
+            self.config['Notifications']['EMAIL_FROM'],
+            self.config['Notifications']['EMAIL_PASSWORD'],
+            max_retries=self.config['Notifications']['SMTP_RETRIES'],
+            use_ssl=self.config['Notifications']['SMTP_SSL']
+        )
+        self.email_dispatcher.start()
+        self.notification_backends = []
+        for backend in create_backends(self.config['Notifications'], self.email_dispatcher,
+                                       self.config['Main']['TIMEZONE']):
+            self.register_notification_backend(backend)
+        self.notification_filter = NotificationFilter(
+            self.config['Notifications']['DEDUP_WINDOW'],
+            self.config['Notifications']['FLAP_WINDOW'],
+            self.config['Notifications']['FLAP_THRESHOLD'],
+            self.config['Main']['TIMEZONE']
+        )
+
+        # at most one reading per series per check, so this holds HISTORY_HOURS at full resolution
+        self.history = History(
+            self.config['Main']['HISTORY_HOURS'] * 3600 // self.config['Main']['CHECK_FREQUENCY']
+        )
+
+        self.commands = CommandQueue()
+        # None unless main.py set up queued logging
+        self.log_handler = find_queue_handler(logging.getLogger('chickencoopauto'))
+        self.gpio_snapshot = InputSnapshot()
+
         self.sunset_sunrise_sensor = sensors.SunriseSunsetSensor(
             self,
             'Sunrise/Sunset Sensor',
             self.config['Main']['LAT'],
             self.config['Main']['LON'],
             extra_min_sunrise=self.config['Door']['EXTRA_MIN_SUNRISE'],
-            extra_min_sunset=self.config['Door']['EXTRA_MIN_SUNSET']
+            extra_min_sunset=self.config['Door']['EXTRA_MIN_SUNSET'],
+            timezone=self.config['Main']['TIMEZONE'],
+            cache_path=self.config['Main']['SUNRISE_SUNSET_CACHE'],
+            cache_days=self.config['Main']['SUNRISE_SUNSET_CACHE_DAYS']
         )
 
         self.ambient_temp_humi_sensor = sensors.AmbientTempHumiSensor(
@@ -155,7 +562,11 @@ class Coop(StoppableThread, Singleton):
             self.config['AmbientTempHumi']['SENSOR_PORT'],
             self.config['AmbientTempHumi']['TEMP_RANGE'],
             self.config['AmbientTempHumi']['HUMI_RANGE'],
-            self.config['AmbientTempHumi']['TEMP_HUMI_CACHE']
+            self.config['AmbientTempHumi']['TEMP_HUMI_CACHE'],
+            read_attempts=self.config['AmbientTempHumi']['READ_ATTEMPTS'],
+            filter_size=self.config['AmbientTempHumi']['FILTER_SIZE'],
+            max_temp_jump=self.config['AmbientTempHumi']['MAX_TEMP_JUMP'],
+            max_humi_jump=self.config['AmbientTempHumi']['MAX_HUMI_JUMP']
         )
 
         self.status_led = led.RGBLED(
@@ -167,30 +578,66 @@ class Coop(StoppableThread, Singleton):
         )
 
         self.relay_module = {
-            1: relays.Relay(self, 1, 'Water Heater Relay', self.config['Water']['HEATER_PORT'], 'off'),
-            2: relays.Relay(self, 2, 'Light Relay', self.config['Light']['PORT'], 'off'),
+            1: relays.Relay(self, 1, 'Water Heater Relay', self.config['Water']['HEATER_PORT'], 'off',
+                            watts=self.config['Water']['HEATER_WATTS']),
+            2: relays.Relay(self, 2, 'Light Relay', self.config['Light']['PORT'], 'off',
+                            watts=self.config['Light']['WATTS']),
             3: relays.Relay(self, 3, 'Door Relay 1', self.config['Door']['PORT_1'], 'off'),
             4: relays.Relay(self, 4, 'Door Relay 2', self.config['Door']['PORT_2'], 'off'),
-            5: relays.Relay(self, 5, 'Fan Relay', self.config['AmbientTempHumi']['FAN_PORT'], 'off'),
-            6: relays.Relay(self, 6, 'Heater Relay', self.config['AmbientTempHumi']['HEATER_PORT'], 'off'),
+            5: relays.Relay(self, 5, 'Fan Relay', self.config['AmbientTempHumi']['FAN_PORT'], 'off',
+                            watts=self.config['AmbientTempHumi']['FAN_WATTS']),
+            6: relays.Relay(self, 6, 'Heater Relay', self.config['AmbientTempHumi']['HEATER_PORT'], 'off',
+                            watts=self.config['AmbientTempHumi']['HEATER_WATTS']),
             7: relays.Relay(self, 7, 'Unused Relay 1', self.config['Other']['UNUSED_PORT_1'], 'off'),
             8: relays.Relay(self, 8, 'Unused Relay 2', self.config['Other']['UNUSED_PORT_2'], 'off'),
         }
+        self.duty_cycles_saved = clock.time()
+        load_duty_cycles(self.config['Main']['DUTY_CYCLE_FILE'], self.duty_cycles())
 
         self.water_heater_relay = self.relay_module[1]
         self.water_heater = relays.WaterHeater(
             self,
             'Water heater',
             self.water_heater_relay,
-            self.config['Water']['HEATER_TEMP_RANGE'][1:3]
+            self.config['Water']['HEATER_TEMP_RANGE'][1:3],
+            min_on_secs=self.config['Water']['HEATER_MIN_ON'],
+            min_off_secs=self.config['Water']['HEATER_MIN_OFF']
         )
 
+        self.onewire_bus = ThermBus(
+            self.config['OneWire']['INTERVAL'],
+            self.config['OneWire']['RESOLUTION']
+        )
+        self.probe_sensors = [
+            sensors.ProbeTempSensor(
+                self,
+                probe['NAME'],
+                probe['LOG_TYPE'],
+                self.onewire_bus,
+                probe['SENSOR_ID'],
+                probe['TEMP_RANGE'],
+                stale_secs=self.config['OneWire']['STALE']
+            )
+            for probe in self.config['Probes']
+        ]
+        water_sensor_id = self.config['Water']['SENSOR_ID']
+        if not water_sensor_id:
+            configured = set(probe['SENSOR_ID'] for probe in self.config['Probes'])
+            unassigned = sorted(set(self.onewire_bus.sensors) - configured)
+            water_sensor_id = unassigned[0] if unassigned else None
         self.water_temp_sensor = sensors.WaterTempSensor(
             self,
             'Water Temp Sensor',
             'WATER',
+            self.onewire_bus,
+            water_sensor_id,
             self.config['Water']['HEATER_TEMP_RANGE'],
+            stale_secs=self.config['OneWire']['STALE']
         )
+        for sensor_id in set(self.onewire_bus.sensors) - set(sensor.sensor_id for sensor in self.temp_probes()):
+            log.warning('1-Wire probe {} is not configured, add a [Probe {}] section to monitor it'.format(
+                sensor_id, sensor_id))
+        self.onewire_bus.start()
 
         self.water_level_dual_sensor = sensors.HalfEmptyWaterLevelsSensor(
             self,
@@ -218,10 +665,17 @@ class Coop(StoppableThread, Singleton):
             self.relay_module[3],
             self.relay_module[4]
         ]
+        self.door_travel_times = TravelTimes(
+            self.config['Door']['SENSOR_TIMEOUT'] / 1000.0,
+            baseline_size=self.config['Door']['TRAVEL_BASELINE'],
+            drift=self.config['Door']['TRAVEL_DRIFT'],
+            timeout_factor=self.config['Door']['TRAVEL_TIMEOUT_FACTOR']
+        )
         self.door = relays.Door(
             self,
             'Door',
-            self.door_relays
+            self.door_relays,
+            travel_times=self.door_travel_times
         )
 
         self.fan_relay = self.relay_module[5]
@@ -229,7 +683,9 @@ class Coop(StoppableThread, Singleton):
             self,
             'Fan',
             self.fan_relay,
-            (self.config['AmbientTempHumi']['TEMP_FAN'] - 5.0, self.config['AmbientTempHumi']['TEMP_FAN'])
+            (self.config['AmbientTempHumi']['TEMP_FAN'] - 5.0, self.config['AmbientTempHumi']['TEMP_FAN']),
+            min_on_secs=self.config['AmbientTempHumi']['FAN_MIN_ON'],
+            min_off_secs=self.config['AmbientTempHumi']['FAN_MIN_OFF']
         )
 
         self.heater_relay = self.relay_module[6]
@@ -237,43 +693,109 @@ class Coop(StoppableThread, Singleton):
             self,
             'Heater',
             self.heater_relay,
-            (self.config['AmbientTempHumi']['TEMP_HEATER'], self.config['AmbientTempHumi']['TEMP_HEATER'] + 5.0)
+            (self.config['AmbientTempHumi']['TEMP_HEATER'], self.config['AmbientTempHumi']['TEMP_HEATER'] + 5.0),
+            min_on_secs=self.config['AmbientTempHumi']['HEATER_MIN_ON'],
+            min_off_secs=self.config['AmbientTempHumi']['HEATER_MIN_OFF']
+        )
+
+        self.login_attempts = LoginAttemptTracker(
+            self,
+            self.config['Authentication']['MAX_ATTEMPTS'],
+            self.config['Authentication']['ATTEMPT_WINDOW'],
+            self.config['Authentication']['LOCKOUT'],
+            self.config['Authentication']['SUMMARY_INTERVAL']
         )
 
         self.rebooting = False
+        self.started = clock.utcnow()
+        self.last_check = None
+        self.last_status = None
+        self.first_decision_secs = None
+        self.checkpoint_restored = self.restore_checkpoint()
+        self.checkpoint_states = self._checkpoint_states()
+        self.checkpoint_saved = clock.time()
         self.initialized = True
 
     def check(self):
+        self.gpio_snapshot.take()
         self.sunset_sunrise_sensor.read_and_check()
-        self.water_temp_sensor.read_and_check()
+        for sensor in self.temp_probes():
+            sensor.read_and_check()
         self.water_level_dual_sensor.read_and_check()
         water_empty = self.water_level_dual_sensor.state in ['empty', 'invalid']
         self.water_heater.check(temp=self.water_temp_sensor.temp, water_empty=water_empty)
-        self.door_dual_sensor.read_and_check()
-        self.door.check(switches=self.door_dual_sensor, sunrise_sunset=self.sunset_sunrise_sensor)
+        self.door.settle_motion()
+        if not self.door.is_moving():
+            # the switches are in between positions while the door moves
+            self.door_dual_sensor.read_and_check()
+            self.door.check(switches=self.door_dual_sensor, sunrise_sunset=self.sunset_sunrise_sensor)
         self.light.check(sunrise_sunset=self.sunset_sunrise_sensor)
         self.fan.check(temp=self.ambient_temp_humi_sensor.temp)
         self.heater.check(temp=self.ambient_temp_humi_sensor.temp)
-        self.status_led.on(self._convert_status_to_color(self.status))
+        status = self.status
+        self.status_led.on(self._convert_status_to_color(status), self._status_led_pattern())
+        self.last_status = status
+        self.last_check = clock.utcnow()
+        if self.first_decision_secs is None and self.has_control_inputs():
+            self.first_decision_secs = clock.time() - self.booted
+            log.warn('First control decision {:.1f}s after startup, controller state {}'.format(
+                self.first_decision_secs, self.checkpoint_restored))
 
     def run(self):
         if not self.initialized:
             raise Exception('Coop sensors and relays not initialized!')
 
         log.warn('Coop initialized')
+        self.started = clock.utcnow()
         while not self.is_stopping():
-            # this takes a while, so don't do it inside coop.check()
-            self.ambient_temp_humi_sensor.read_and_check()
-            self.check()
-            sleep(self.config['Main']['CHECK_FREQUENCY'])
+            self.cycle()
+            self.watch_config()
+            # web requests queue their actions here instead of touching relays and the door directly
+            self.commands.process(self.config['Main']['CHECK_FREQUENCY'])
+            if self.log_handler is not None:
+                self.log_handler.end_cycle()
+
+    def cycle(self):
+        # this takes a while, so don't do it inside coop.check()
+        self.ambient_temp_humi_sensor.read_and_check()
+        self.check()
+        self.login_attempts.notify_summary()
+        for notification in self.notification_filter.flush():
+            self._dispatch_notification(notification)
+        if clock.time() - self.duty_cycles_saved > self.config['Main']['DUTY_CYCLE_SAVE_INTERVAL']:
+            self.save_duty_cycles()
+        if (self._checkpoint_states() != self.checkpoint_states or
+                clock.time() - self.checkpoint_saved > self.config['Main']['CHECKPOINT_INTERVAL']):
+            self.save_checkpoint()
 
     def shutdown(self):
+        # SIGTERM shuts down and main() does it again on its way out, that one would checkpoint the reset relays
+        if self.shut_down:
+            return
+        self.shut_down = True
         self.stop()
         if self.isAlive():
             self.join()
+        self.onewire_bus.stop()
+        # before the relays are reset, they are restored as they are now
+        self.save_checkpoint()
+        self.door.abort_motion()
         for relay in self.relay_module.values():
             relay.reset()
+        self.save_duty_cycles()
         self.status_led.reset()
+        for backend in self.notification_backends:
+            backend.stop()
+        for backend in self.notification_backends:
+            if backend.isAlive():
+                backend.join()
+        self.email_dispatcher.stop()
+        if self.email_dispatcher.isAlive():
+            self.email_dispatcher.join()
+        self.db_log.stop()
+        if self.db_log.isAlive():
+            # a hung connection would hold up the shutdown for good
+            self.db_log.join(self.db_log.shutdown_timeout_secs)
         log.warn('Shutdown')
 
     @staticmethod
@@ -298,11 +820,95 @@ class Coop(StoppableThread, Singleton):
                           self.door_dual_sensor,
                           self.door,
                           self.light,
-                          self.fan]:
+                          self.fan] + self.probe_sensors:
             components_status.append(component.status())
 
         return self.max_status_level(components_status)
 
+    def duty_cycles(self):
+        return dict((relay.name.rstrip(': '), relay.duty_cycle) for relay in self.relay_module.values())
+
+    def save_duty_cycles(self):
+        save_duty_cycles(self.config['Main']['DUTY_CYCLE_FILE'], self.duty_cycles())
+        self.duty_cycles_saved = clock.time()
+
+    def temp_probes(self):
+        return [self.water_temp_sensor] + self.probe_sensors
+
+    def controllers(self):
+        return [self.water_heater, self.light, self.fan, self.heater, self.door]
+
+    def checkpoint_sensors(self):
+        return [self.sunset_sunrise_sensor,
+                self.ambient_temp_humi_sensor,
+                self.water_level_dual_sensor,
+                self.door_dual_sensor] + self.temp_probes()
+
+    def checkpoint(self):
+        return {
+            'saved': clock.time(),
+            'controllers': dict((controller.name, controller.to_dict()) for controller in self.controllers()),
+            'sensors': dict((sensor.name, sensor.to_dict()) for sensor in self.checkpoint_sensors()),
+        }
+
+    def _checkpoint_states(self):
+        # a change in any of these is saved right away, new readings only every CHECKPOINT_INTERVAL
+        return (tuple(component.state for component in self.controllers() + self.checkpoint_sensors()) +
+                tuple(relay.state for relay in self.relay_module.values()))
+
+    def save_checkpoint(self):
+        save_checkpoint(self.config['Main']['CHECKPOINT_FILE'], self.checkpoint())
+        self.checkpoint_states = self._checkpoint_states()
+        self.checkpoint_saved = clock.time()
+
+    def restore_checkpoint(self):
+        saved = load_checkpoint(self.config['Main']['CHECKPOINT_FILE'])
+        if saved is None:
+            return 'not restored'
+        age = clock.time() - saved['saved']
+        fresh = 0 <= age <= self.config['Main']['CHECKPOINT_MAX_AGE']
+        components = [(controller, saved.get('controllers', {}), partial(controller.load, fresh=fresh))
+                      for controller in self.controllers()]
+        if fresh:
+            components += [(sensor, saved.get('sensors', {}), sensor.load) for sensor in self.checkpoint_sensors()]
+        for component, saved_components, load in components:
+            if component.name in saved_components:
+                try:
+                    load(saved_components[component.name])
+                except (KeyError, TypeError, ValueError) as e:
+                    log.warning('Ignoring saved state for {}: {}'.format(component.name, e))
+        if fresh:
+            restored = 'restored from {:.0f}s before'.format(age)
+        else:
+            restored = 'saved {:.0f}s before, only manual modes restored'.format(age)
+        log.warn('Controller state {}'.format(restored))
+        return restored
+
+    def has_control_inputs(self):
+        # every automatic decision has what it needs to be right
+        return (self.ambient_temp_humi_sensor.temp is not None and
+                (self.water_temp_sensor.temp is not None or not self.water_temp_sensor.sensor) and
+                self.sunset_sunrise_sensor.sunrise_ts is not None)
+
+    def check_age(self):
+        # seconds since the last completed check, or since startup if there was none yet
+        last = self.last_check or self.started
+        return (clock.utcnow() - last).total_seconds()
+
+    def is_stalled(self):
+        return self.check_age() > self.config['Main']['STALL_THRESHOLD']
+
+    def stale_components(self):
+        stale = []
+        for sensor in [self.sunset_sunrise_sensor,
+                       self.ambient_temp_humi_sensor,
+                       self.water_temp_sensor,
+                       self.water_level_dual_sensor,
+                       self.door_dual_sensor] + self.probe_sensors:
+            if sensor.is_stale(self.config['Main']['STALL_THRESHOLD']):
+                stale.append(sensor.name.rstrip(': '))
+        return stale
+
     @staticmethod
     def _convert_status_to_color(status):
         return 'red' if status == 'ERROR' else \
@@ -310,62 +916,23 @@ class Coop(StoppableThread, Singleton):
                'white' if status == 'MANUAL' else \
                'green'
 
+    def _status_led_pattern(self):
+        if self.door.status() == 'ERROR':
+            return 'fast_blink'
+        elif self.door.is_moving():
+            return 'breathe'
+        else:
+            return 'solid'
+
     def notifier_callback(self, notification):
-        severity = notification.severity
-        if self.config['Notifications']['LOG']:
-            if Notification.severity_levels[severity] >= \
-                    Notification.severity_levels[self.config['Notifications']['LOG_THRESHOLD']]:
-                self.log_callback(notification)
-        if self.config['Notifications']['EMAIL']:
-            if Notification.severity_levels[severity] >= \
-                    Notification.severity_levels[self.config['Notifications']['EMAIL_THRESHOLD']]:
-                kwargs = {
-                    'gmail_credentials': {
-                        'email': self.config['Notifications']['EMAIL_FROM'],
-                        'password': self.config['Notifications']['EMAIL_PASSWORD'],
-                    },
-                    'emails_to': self.config['Notifications']['EMAILS_TO'],
-                    'message': notification.message
-                }
-                self.email_callback(**kwargs)
-        if self.config['Notifications']['SMS']:
-            if Notification.severity_levels[severity] >= \
-                    Notification.severity_levels[self.config['Notifications']['SMS_THRESHOLD']]:
-                kwargs = {
-                    'gmail_credentials': {
-                        'email': self.config['Notifications']['EMAIL_FROM'],
-                        'password': self.config['Notifications']['EMAIL_PASSWORD'],
-                    },
-                    'emails_to': self.config['Notifications']['SMS_TO'],
-                    'message': notification.message
-                }
-                self.email_callback(**kwargs)
+        if self.notification_filter.accept(notification):
+            self._dispatch_notification(notification)
 
-    @staticmethod
-    def email_callback(**kwargs):
-        gmail_credentials = kwargs['gmail_credentials']
-        emails_to = kwargs['emails_to']
-        gmail = smtplib.SMTP_SSL('smtp.gmail.com', 465)
-        gmail.ehlo()
-        gmail.login(gmail_credentials['email'], gmail_credentials['password'])
-        subject = 'Chicken Coop Alert!'
-        body = kwargs['message']
-        email_text = '''\
-From: {email_from}
-To: {to}
-Subject: {subject}
-
-{body}
-'''.format(email_from=gmail_credentials['email'], to=emails_to, subject=subject, body=body)
-        gmail.sendmail(gmail_credentials['email'], emails_to.split(','), email_text)
-        gmail.quit()
+    def _dispatch_notification(self, notification):
+        for backend in self.notification_backends:
+            if backend.accepts(notification):
+                backend.submit(notification)
 
-    @staticmethod
-    def log_callback(notification):
-        log_message = '{}: {}'.format(notification.severity, notification.message)
-        if notification.severity == 'INFO':
-            log.info(log_message)
-        elif notification.severity == 'WARN':
-            log.warning(log_message)
-        elif notification.severity == 'ERROR':
-            log.error(log_message)
+    def register_notification_backend(self, backend):
+        self.notification_backends.append(backend)
+        backend.start()
@@ -0,0 +1,82 @@
+import logging
+import Queue
+
+from utils import clock, get_db, StoppableThread
+
+
+log = logging.getLogger(__name__)
+
+
+class DBLogWriter(StoppableThread):
+    # the control loop only queues rows, a slow or unreachable database never holds it up
+    batch_size = 100
+    queue_size = 10000
+    retry_secs = 60
+    shutdown_timeout_secs = 15
+
+    def __init__(self, coop):
+        super(DBLogWriter, self).__init__()
+        self.daemon = True
+        self.name = 'DBLogWriter'
+        self.coop = coop
+        self.queue = Queue.Queue(self.queue_size)
+        self.pending = []
+        self.written = 0
+        self.dropped = 0
+        self.failures = 0
+
+    def write(self, log_type, log_value):
+        # created is set here, rows may reach the database long after the reading
+        row = {'log_type': log_type, 'log_value': log_value, 'created': clock.utcnow().naive}
+        try:
+            self.queue.put_nowait(row)
+        except Queue.Full:
+            if not self.dropped:
+                log.error('Database log queue is full, dropping readings until it catches up')
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            stopping = self.is_stopping()
+            self._collect(0 if stopping else 1)
+            if not self.pending:
+                if stopping:
+                    break
+                continue
+            if self._flush():
+                continue
+            if stopping:
+                log.error('Database unavailable at shutdown, {} readings were not logged'.format(
+                    len(self.pending) + self.queue.qsize()))
+                break
+            self._stop_event.wait(self.retry_secs)
+
+    def _collect(self, timeout):
+        while len(self.pending) < self.batch_size:
+            try:
+                if timeout and not self.pending:
+                    row = self.queue.get(timeout=timeout)
+                else:
+                    row = self.queue.get_nowait()
+            except Queue.Empty:
+                return
+            self.pending.append(row)
+
+    def _flush(self):
+        try:
+            get_db(self.coop).multiple_insert('coop_log', self.pending)
+        except Exception as e:
+            self.failures += 1
+            log.warning('Unable to log {} readings to the database, retrying in {}s: {}'.format(
+                len(self.pending), self.retry_secs, e))
+            return False
+        self.written += len(self.pending)
+        self.pending = []
+        if self.dropped:
+            log.warning('Database log caught up, {} readings were dropped'.format(self.dropped))
+            self.dropped = 0
+        return True
+
+    def summary(self):
+        return '{} written, {} queued, {} dropped, {} failed writes'.format(
+            self.written, self.queue.qsize() + len(self.pending), self.dropped, self.failures)
@@ -0,0 +1,80 @@
+from collections import deque
+import logging
+
+import Adafruit_DHT as DHT  # noqa: N814
+
+from utils import clock
+
+
+log = logging.getLogger(__name__)
+
+
+class MedianFilter(object):
+    def __init__(self, size, max_jump, valid_range):
+        self.size = size
+        self.max_jump = max_jump
+        self.valid_range = valid_range
+        self.window = deque(maxlen=size)
+        self.rejected_in_a_row = 0
+
+    @property
+    def median(self):
+        if not self.window:
+            return None
+        values = sorted(self.window)
+        middle = len(values) // 2
+        return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+    def add(self, value):
+        if not self.valid_range[0] <= value <= self.valid_range[1]:
+            return False
+        median = self.median
+        if median is not None and abs(value - median) > self.max_jump:
+            self.rejected_in_a_row += 1
+            if self.rejected_in_a_row < self.size:
+                return False
+            # a whole window of consistent "outliers" is a real change, e.g. after the sensor was down for a while
+            log.info('Accepting {:.1f} after {} rejected readings, resetting the filter'.format(
+                value, self.rejected_in_a_row))
+            self.window.clear()
+        self.rejected_in_a_row = 0
+        self.window.append(value)
+        return True
+
+
+class DHTReader(object):
+    # the DHT22 returns the previous (or no) reading if polled more often than this
+    min_interval_secs = 2.0
+    max_delay_secs = 8.0
+    # retries that would keep the control loop waiting longer than this are left for the next check
+    max_read_secs = 10.0
+
+    def __init__(self, sensor, port, max_attempts):
+        self.sensor = sensor
+        self.port = port
+        self.max_attempts = max_attempts
+        self.last_attempt = 0
+        self.failed_reads_in_a_row = 0
+
+    @property
+    def attempts(self):
+        # a sensor that keeps failing is likely disconnected, don't hold up the control loop retrying it
+        return max(1, self.max_attempts >> self.failed_reads_in_a_row)
+
+    def read(self):
+        delay = self.min_interval_secs
+        started = clock.time()
+        for attempt in range(self.attempts):
+            wait = self.last_attempt + delay - clock.time()
+            if attempt and clock.time() + wait - started > self.max_read_secs:
+                break
+            if wait > 0:
+                clock.sleep(wait)
+            self.last_attempt = clock.time()
+            humi, temp = DHT.read(self.sensor, self.port)
+            if humi is not None and temp is not None:
+                self.failed_reads_in_a_row = 0
+                return humi, temp
+            delay = min(delay * 1.5, self.max_delay_secs)
+        self.failed_reads_in_a_row += 1
+        return None, None
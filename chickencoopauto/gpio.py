@@ -0,0 +1,38 @@
+import logging
+from threading import Lock
+
+import RPi.GPIO as GPIO
+
+from utils import clock
+
+
+log = logging.getLogger(__name__)
+
+
+class InputSnapshot(object):
+    def __init__(self):
+        self.ports = []
+        self.values = {}
+        self.taken = None
+        self.lock = Lock()
+
+    def register(self, port):
+        # inputs are set up once, reads then only need GPIO.input
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(port, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+        if port not in self.ports:
+            self.ports.append(port)
+
+    def take(self):
+        # every sensor evaluated in this cycle sees the same values, e.g. both door switches at the same instant
+        values = dict((port, GPIO.input(port)) for port in self.ports)
+        with self.lock:
+            self.values = values
+            self.taken = clock.utcnow()
+
+    def input(self, port):
+        with self.lock:
+            if port in self.values:
+                return self.values[port]
+        log.debug('GPIO port {} is not in the snapshot, reading it directly'.format(port))
+        return GPIO.input(port)
@@ -0,0 +1,76 @@
+from array import array
+from threading import Lock
+
+from utils import clock
+
+
+class RingBuffer(object):
+    def __init__(self, capacity):
+        # preallocated, so memory use doesn't grow however long the process runs
+        self.capacity = capacity
+        self.timestamps = array('d', [0.0]) * capacity
+        self.values = array('d', [0.0]) * capacity
+        self.start = 0
+        self.count = 0
+        self.lock = Lock()
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, value):
+        with self.lock:
+            if self.count and timestamp < self.timestamps[(self.start + self.count - 1) % self.capacity]:
+                # out of order, keep the buffer sorted so lookups can bisect
+                return
+            if self.count < self.capacity:
+                i = (self.start + self.count) % self.capacity
+                self.count += 1
+            else:
+                i = self.start
+                self.start = (self.start + 1) % self.capacity
+            self.timestamps[i] = timestamp
+            self.values[i] = value
+
+    def _bisect_left(self, timestamp):
+        # index (relative to start) of the first entry at or after timestamp
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamps[(self.start + middle) % self.capacity] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def oldest(self):
+        with self.lock:
+            return self.timestamps[self.start] if self.count else None
+
+    def range(self, start_timestamp, end_timestamp=None):
+        with self.lock:
+            first = self._bisect_left(start_timestamp)
+            last = self.count if end_timestamp is None else self._bisect_left(end_timestamp)
+            indexes = [(self.start + i) % self.capacity for i in range(first, last)]
+            return [(self.timestamps[i], self.values[i]) for i in indexes]
+
+
+class History(object):
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.series = {}
+        self.lock = Lock()
+
+    def record(self, log_type, value, timestamp=None):
+        with self.lock:
+            if log_type not in self.series:
+                self.series[log_type] = RingBuffer(self.capacity)
+            buffer = self.series[log_type]
+        buffer.append(clock.time() if timestamp is None else timestamp, value)
+
+    def covers(self, log_type, start_timestamp):
+        buffer = self.series.get(log_type)
+        return buffer is not None and buffer.oldest() <= start_timestamp
+
+    def range(self, log_type, start_timestamp, end_timestamp=None):
+        buffer = self.series.get(log_type)
+        return buffer.range(start_timestamp, end_timestamp) if buffer is not None else []
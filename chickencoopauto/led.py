@@ -1,12 +1,25 @@
 import logging
+import math
+from threading import Event, Lock
+from time import time
 
 import RPi.GPIO as GPIO
 from transitions import Machine
 
+from utils import StoppableThread
+
 
 log = logging.getLogger(__name__)
 
 
+def square(phase):
+    return 1 if phase < 0.5 else 0
+
+
+def breathe(phase):
+    return (1 - math.cos(2 * math.pi * phase)) / 2
+
+
 class RGBLED(Machine):
     colors = {
         'red': (1, 0, 0),
@@ -16,6 +29,15 @@ class RGBLED(Machine):
         'off': (0, 0, 0),
     }
 
+    # pattern: (period secs, step secs, brightness for the phase in the period), solid needs no thread
+    patterns = {
+        'solid': None,
+        'blink': (1.0, 0.5, square),
+        'fast_blink': (0.25, 0.125, square),
+        'breathe': (4.0, 0.05, breathe),
+    }
+    pwm_frequency = 200
+
     def __init__(self, coop, name, ports):
         # attributes for transitions
         self.coop = coop
@@ -60,23 +82,86 @@ class RGBLED(Machine):
 
         # other attributes
         self.ports = ports
+        self.pattern = 'solid'
+        self.pattern_started = time()
+        self.pattern_changed = Event()
+        self.write_lock = Lock()
+        self.levels = self.colors[self.transition_initial]
+        self.pwms = None
 
         GPIO.setmode(GPIO.BCM)
         for i in range(0, len(self.ports)):
             GPIO.setup(ports[i], GPIO.OUT, initial=self.colors[self.transition_initial][i])
 
-    def on(self, color):
-        if color not in self.colors:
-            log.error('Invalid color "{}" for {}'.format(color, self.name))
+        self.pattern_thread = LEDPatternThread(self)
+        self.pattern_thread.start()
+
+    def on(self, color, pattern='solid'):
+        if color not in self.colors or pattern not in self.patterns:
+            log.error('Invalid color "{}" or pattern "{}" for {}'.format(color, pattern, self.name))
             self.off()
-        else:
-            for i in range(0, len(self.ports)):
-                GPIO.output(self.ports[i], self.colors[color][i])
+        elif color != self.state or pattern != self.pattern:
+            # called every check, only a change touches GPIO
             self.set_state(color)
-            log.info('{} set to {}'.format(self.name, color))
+            self.pattern = pattern
+            self.pattern_started = time()
+            if pattern == 'solid':
+                self.write(color, 1)
+            self.pattern_changed.set()
+            log.info('{} set to {}{}'.format(self.name, color, '' if pattern == 'solid' else ' ({})'.format(pattern)))
 
     def off(self):
         self.on('off')
 
     def reset(self):
+        self.pattern_thread.stop()
+        self.pattern_changed.set()
+        if self.pattern_thread.isAlive():
+            self.pattern_thread.join()
         self.on(self.transition_initial)
+
+    def write(self, color, brightness, pwm=False):
+        levels = tuple(level * brightness for level in self.colors[color])
+        with self.write_lock:
+            if pwm:
+                if self.pwms is None:
+                    self.pwms = [GPIO.PWM(port, self.pwm_frequency) for port in self.ports]
+                    for pwm_port, level in zip(self.pwms, levels):
+                        pwm_port.start(level * 100)
+                else:
+                    for pwm_port, old, new in zip(self.pwms, self.levels, levels):
+                        if new != old:
+                            pwm_port.ChangeDutyCycle(new * 100)
+            else:
+                if self.pwms is not None:
+                    for pwm_port in self.pwms:
+                        pwm_port.stop()
+                    self.pwms = None
+                    self.levels = (None, ) * len(self.ports)
+                for port, old, new in zip(self.ports, self.levels, levels):
+                    if new != old:
+                        GPIO.output(port, int(new))
+            self.levels = levels
+
+
+class LEDPatternThread(StoppableThread):
+    def __init__(self, led):
+        super(LEDPatternThread, self).__init__()
+        self.daemon = True
+        self.led = led
+
+    def run(self):
+        # timed from the wall clock, however long the control loop takes
+        while not self.is_stopping():
+            self.led.pattern_changed.clear()
+            color, pattern, started = self.led.state, self.led.pattern, self.led.pattern_started
+            if pattern == 'solid':
+                # undoes a pattern step that raced with the change to solid
+                self.led.write(color, 1)
+                self.led.pattern_changed.wait()
+                continue
+            period, step, brightness = self.led.patterns[pattern]
+            elapsed = time() - started
+            level = round(brightness((elapsed % period) / period), 2)
+            self.led.write(color, level, pwm=pattern == 'breathe')
+            self.led.pattern_changed.wait(step - elapsed % step)
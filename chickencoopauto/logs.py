@@ -0,0 +1,213 @@
+from collections import deque
+import logging
+from logging.handlers import RotatingFileHandler
+import Queue
+import re
+from threading import Lock
+from time import time
+
+from utils import StoppableThread
+
+
+# numbers are masked, so "temp: 41.2" and "temp: 41.3" count as the same line
+NUMBER = re.compile(r'-?\d+(\.\d+)?')
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, interval_secs, max_level=logging.INFO, max_lines=1000):
+        super(RateLimitFilter, self).__init__()
+        self.interval_secs = interval_secs
+        # warnings and errors always go through
+        self.max_level = max_level
+        self.max_lines = max_lines
+        self.lines = {}
+        self.suppressed = 0
+        self.lock = Lock()
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        line = (record.name, record.levelno, NUMBER.sub('#', record.getMessage()))
+        now = time()
+        with self.lock:
+            logged, suppressed = self.lines.get(line, (None, 0))
+            if logged is not None and now - logged < self.interval_secs:
+                self.lines[line] = (logged, suppressed + 1)
+                self.suppressed += 1
+                return False
+            if len(self.lines) >= self.max_lines:
+                self.lines.clear()
+            self.lines[line] = (now, 0)
+        if suppressed:
+            record.msg = '{} ({} similar suppressed)'.format(record.getMessage(), suppressed)
+            record.args = None
+        return True
+
+
+class QueueHandler(logging.Handler):
+    # cycles kept for the per-cycle logging cost
+    cycles_kept = 100
+
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.listener = None
+        self.records = 0
+        self.dropped = 0
+        self.cost_secs = 0.0
+        self.cycle_cost_secs = 0.0
+        self.cycle_records = 0
+        self.cycles = deque(maxlen=self.cycles_kept)
+        self.stats_lock = Lock()
+
+    def prepare(self, record):
+        # format here, args and tracebacks may not be safe to hand to another thread
+        record.msg = self.format(record)
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Queue.Full:
+            # never block the control loop on logging
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def handle(self, record):
+        start = time()
+        try:
+            return logging.Handler.handle(self, record)
+        finally:
+            cost = time() - start
+            with self.stats_lock:
+                self.records += 1
+                self.cost_secs += cost
+                self.cycle_records += 1
+                self.cycle_cost_secs += cost
+
+    def end_cycle(self):
+        with self.stats_lock:
+            self.cycles.append((self.cycle_records, self.cycle_cost_secs))
+            self.cycle_records = 0
+            self.cycle_cost_secs = 0.0
+
+    def suppressed(self):
+        return sum(log_filter.suppressed for log_filter in self.filters if isinstance(log_filter, RateLimitFilter))
+
+    def summary(self):
+        with self.stats_lock:
+            cycles = list(self.cycles)
+        summary = '{} records, {} suppressed, {} dropped, {} queued'.format(
+            self.records, self.suppressed(), self.dropped, self.queue.qsize())
+        if cycles:
+            summary += ', {:.1f} records and {:.2f} ms per cycle (max {:.2f} ms)'.format(
+                sum(records for records, _ in cycles) / float(len(cycles)),
+                sum(cost for _, cost in cycles) * 1000 / len(cycles),
+                max(cost for _, cost in cycles) * 1000)
+        if self.listener is not None:
+            summary += ', written in {} batches'.format(self.listener.batches)
+        return summary
+
+
+class BatchedRotatingFileHandler(RotatingFileHandler):
+    buffer_size = 64 * 1024
+
+    def __init__(self, filename, **kwargs):
+        self.size = None
+        RotatingFileHandler.__init__(self, filename, **kwargs)
+
+    def _open(self):
+        if self.encoding is None:
+            return open(self.baseFilename, self.mode, self.buffer_size)
+        return RotatingFileHandler._open(self)
+
+    def flush(self):
+        # StreamHandler flushes after every record, the listener flushes once per batch instead
+        pass
+
+    def flush_batch(self):
+        self.acquire()
+        try:
+            if self.stream is not None:
+                self.stream.flush()
+        finally:
+            self.release()
+
+    def shouldRollover(self, record):  # noqa: N802
+        # keep track of the size, seeking to the end as RotatingFileHandler does would flush every record
+        if self.stream is None:
+            self.stream = self._open()
+        if self.maxBytes <= 0:
+            return False
+        if self.size is None:
+            self.stream.seek(0, 2)
+            self.size = self.stream.tell()
+        self.size += len(self.format(record)) + 1
+        return self.size >= self.maxBytes
+
+    def doRollover(self):  # noqa: N802
+        RotatingFileHandler.doRollover(self)
+        self.size = None
+
+    def close(self):
+        self.flush_batch()
+        RotatingFileHandler.close(self)
+
+
+class QueueListener(StoppableThread):
+    def __init__(self, queue_handler, handlers, batch_size=200, flush_secs=5.0):
+        super(QueueListener, self).__init__()
+        self.daemon = True
+        self.queue = queue_handler.queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.flush_secs = flush_secs
+        self.batches = 0
+        queue_handler.listener = self
+
+    def run(self):
+        pending = 0
+        first_pending = None
+        while not self.is_stopping() or not self.queue.empty():
+            try:
+                record = self.queue.get(timeout=0.5)
+            except Queue.Empty:
+                record = None
+            if record is not None:
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+                pending += 1
+                first_pending = first_pending or time()
+            if pending and (pending >= self.batch_size or
+                            time() - first_pending >= self.flush_secs or
+                            self.is_stopping() or
+                            # don't sit on an error if the process is about to die
+                            record is not None and record.levelno >= logging.ERROR):
+                self._flush()
+                pending = 0
+                first_pending = None
+
+    def _flush(self):
+        for handler in self.handlers:
+            if isinstance(handler, BatchedRotatingFileHandler):
+                handler.flush_batch()
+        self.batches += 1
+
+    def stop(self):
+        super(QueueListener, self).stop()
+        if self.isAlive():
+            self.join()
+        for handler in self.handlers:
+            handler.close()
+
+
+def find_queue_handler(logger):
+    for handler in logger.handlers:
+        if isinstance(handler, QueueHandler):
+            return handler
+    return None
@@ -0,0 +1,184 @@
+from collections import deque
+import logging
+import Queue
+import smtplib
+import socket
+from time import time
+
+from utils import StoppableThread
+
+
+log = logging.getLogger(__name__)
+
+
+class Email(object):
+    def __init__(self, recipients, message):
+        # list of comma separated address lists, each one is sent as a separate email
+        self.recipients = recipients
+        self.message = message
+        self.sent = []
+        self.refused = []
+
+
+class EmailDispatcher(StoppableThread):
+    subject = 'Chicken Coop Alert!'
+    initial_backoff_secs = 2
+    max_backoff_secs = 300
+    # close the connection after this long without sending, servers drop idle sessions anyway
+    idle_timeout_secs = 60
+    # how long to keep delivering queued emails after being asked to stop
+    shutdown_timeout_secs = 15
+    # emails that ran out of retries are kept and tried again this often, the oldest are dropped past max_pending
+    retry_secs = 60
+    max_pending = 1000
+
+    def __init__(self, host, port, email_from, password, max_retries=5, use_ssl=True):
+        super(EmailDispatcher, self).__init__()
+        self.daemon = True
+        self.name = 'EmailDispatcher'
+        self.host = host
+        self.port = port
+        self.email_from = email_from
+        self.password = password
+        self.max_retries = max_retries
+        self.use_ssl = use_ssl
+        self.queue = Queue.Queue()
+        self.pending = deque()
+        self.dropped = 0
+        self.smtp = None
+        self.last_used = None
+        self.stop_deadline = None
+
+    def send(self, recipients, message):
+        self.queue.put(Email(recipients, message))
+
+    def stop(self):
+        self.stop_deadline = time() + self.shutdown_timeout_secs
+        super(EmailDispatcher, self).stop()
+
+    def run(self):
+        while not self.is_stopping() or time() < self.stop_deadline:
+            stopping = self.is_stopping()
+            if not self.pending and not self._next(block=not stopping):
+                if stopping:
+                    break
+                if self.smtp is not None and time() - self.last_used > self.idle_timeout_secs:
+                    self._disconnect()
+                continue
+            email = self.pending[0]
+            try:
+                delivered = self._deliver(email)
+            except Exception:
+                # a bug rather than the server, sending it again wouldn't help
+                log.exception('Dropping email to {}: {}'.format(', '.join(email.recipients), email.message))
+                self._disconnect()
+                self.pending.popleft()
+                continue
+            if delivered:
+                self.pending.popleft()
+                continue
+            if stopping:
+                break
+            # everything sent after it waits behind it, in order, until the server recovers
+            self._hold_queued()
+            log.warning('SMTP server unavailable, {} email(s) held, retrying in {}s'.format(
+                len(self.pending), self.retry_secs))
+            self._stop_event.wait(self.retry_secs)
+        unsent = len(self.pending) + self.queue.qsize()
+        if unsent:
+            log.error('SMTP server unavailable at shutdown, {} email(s) were not sent'.format(unsent))
+        self._disconnect()
+
+    def _next(self, block):
+        try:
+            self.pending.append(self.queue.get(timeout=1) if block else self.queue.get_nowait())
+        except Queue.Empty:
+            return False
+        return True
+
+    def _hold_queued(self):
+        while True:
+            try:
+                email = self.queue.get_nowait()
+            except Queue.Empty:
+                return
+            if len(self.pending) >= self.max_pending:
+                dropped = self.pending.popleft()
+                self.dropped += 1
+                log.error('Too many emails held, dropping the oldest one to {}: {}'.format(
+                    ', '.join(dropped.recipients), dropped.message))
+            self.pending.append(email)
+
+    def _deliver(self, email):
+        # True once the email needs nothing more from the server, sent or refused for good
+        backoff = self.initial_backoff_secs
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._connect()
+                for emails_to in email.recipients:
+                    if emails_to not in email.sent and emails_to not in email.refused:
+                        self._send(email, emails_to)
+                self.last_used = time()
+                return True
+            except (smtplib.SMTPException, socket.error) as e:
+                self._disconnect()
+                if self.is_permanent(e):
+                    # a bad password or address, holding the queue for it would stop every alert behind it
+                    log.error('SMTP server refused email, dropping it: {}: {}'.format(e, email.message))
+                    return True
+                log.warning('Failed to send email (attempt {} of {}): {}'.format(attempt + 1, self.max_retries + 1, e))
+                if self.is_stopping() or attempt == self.max_retries:
+                    break
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff_secs)
+        return False
+
+    def _send(self, email, emails_to):
+        try:
+            self.smtp.sendmail(self.email_from, emails_to.split(','), self._format(emails_to, email))
+        except smtplib.SMTPException as e:
+            if not self.is_permanent(e):
+                raise
+            # the other recipients still get theirs
+            log.error('SMTP server refused email to {}, dropping it: {}: {}'.format(emails_to, e, email.message))
+            email.refused.append(emails_to)
+            return
+        email.sent.append(emails_to)
+
+    @staticmethod
+    def is_permanent(error):
+        # 5xx replies come back the same on every retry, 4xx ones and lost connections may not
+        if isinstance(error, smtplib.SMTPRecipientsRefused):
+            return all(code >= 500 for code, _ in error.recipients.values())
+        return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+    def _connect(self):
+        if self.smtp is not None:
+            return
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=30)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=30)
+        smtp.ehlo()
+        if self.password:
+            smtp.login(self.email_from, self.password)
+        self.smtp = smtp
+        self.last_used = time()
+
+    def _disconnect(self):
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+        except (smtplib.SMTPException, socket.error):
+            self.smtp.close()
+        self.smtp = None
+
+    def _format(self, emails_to, email):
+        return '''\
+From: {email_from}
+To: {to}
+Subject: {subject}
+
+{body}
+'''.format(email_from=self.email_from, to=emails_to, subject=self.subject, body=email.message)
@@ -1,3 +1,13 @@
+from collections import deque
+from datetime import timedelta
+import logging
+from threading import Lock
+
+from utils import clock
+
+
+log = logging.getLogger(__name__)
+
 
 class Notification(object):
     severity_levels = {
@@ -10,3 +20,98 @@ class Notification(object):
     def __init__(self, severity, message, **kwargs):
         self.severity = severity
         self.message = message.format(**kwargs)
+        # notifications about the same component are grouped for flap detection
+        self.component = kwargs.get('name')
+
+
+class NotificationFilter(object):
+    # a component flapping for longer than this gets a summary even if it hasn't settled yet
+    max_burst_secs = 60 * 60
+
+    def __init__(self, dedup_secs, flap_window_secs, flap_threshold, timezone):
+        self.dedup_secs = dedup_secs
+        self.flap_window_secs = flap_window_secs
+        self.flap_threshold = flap_threshold
+        self.timezone = timezone
+        self.lock = Lock()
+        self.last_sent = {}
+        self.history = {}
+        self.flapping = {}
+        self.sent = 0
+        self.suppressed = 0
+
+    def accept(self, notification):
+        now = clock.utcnow()
+        with self.lock:
+            # a repeat suppressed here doesn't count towards flapping either
+            key = (notification.severity, notification.message)
+            last_sent = self.last_sent.get(key)
+            if last_sent is not None and (now - last_sent).total_seconds() < self.dedup_secs:
+                self._suppress(notification, 'duplicate')
+                return False
+
+            component = notification.component
+            if component is not None:
+                history = self.history.setdefault(component, deque())
+                history.append(now)
+                self._prune_history(component, now)
+                burst = self.flapping.get(component)
+                if burst is None and len(history) > self.flap_threshold:
+                    log.warning('{} is flapping, holding back its notifications'.format(component))
+                    burst = self.flapping[component] = {'since': now, 'count': 0, 'severity': 'INFO', 'last': None}
+                # errors go out right away, even from a flapping component
+                if burst is not None and notification.severity != 'ERROR':
+                    burst['count'] += 1
+                    burst['last'] = notification
+                    if Notification.severity_levels[notification.severity] > \
+                            Notification.severity_levels[burst['severity']]:
+                        burst['severity'] = notification.severity
+                    self._suppress(notification, 'flapping')
+                    return False
+
+            self.last_sent[key] = now
+            self.sent += 1
+            return True
+
+    def flush(self):
+        now = clock.utcnow()
+        summaries = []
+        with self.lock:
+            for key in [key for key, sent in self.last_sent.items() if (now - sent).total_seconds() >= self.dedup_secs]:
+                del self.last_sent[key]
+            for component in self.history.keys():
+                self._prune_history(component, now)
+            for component, burst in self.flapping.items():
+                settled = component not in self.history
+                if burst['count'] == 0:
+                    if settled:
+                        del self.flapping[component]
+                elif settled or (now - burst['since']).total_seconds() >= self.max_burst_secs:
+                    summaries.append(
+                        Notification(burst['severity'],
+                                     '{name} - {count} notification(s) held back while flapping '
+                                     'since {since}{settled}, latest: {latest}',
+                                     name=component,
+                                     count=burst['count'],
+                                     since=burst['since'].to(self.timezone).format('MMMM DD, hh:mm a'),
+                                     settled=', now settled' if settled else '',
+                                     latest=burst['last'].message)
+                    )
+                    if settled:
+                        del self.flapping[component]
+                    else:
+                        burst.update({'since': now, 'count': 0, 'severity': 'INFO'})
+            self.sent += len(summaries)
+        return summaries
+
+    def _prune_history(self, component, now):
+        history = self.history[component]
+        window_start = now - timedelta(seconds=self.flap_window_secs)
+        while history and history[0] < window_start:
+            history.popleft()
+        if not history:
+            del self.history[component]
+
+    def _suppress(self, notification, reason):
+        self.suppressed += 1
+        log.debug('Suppressed {} notification: {}: {}'.format(reason, notification.severity, notification.message))
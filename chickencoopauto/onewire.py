@@ -0,0 +1,100 @@
+import logging
+import os
+from threading import Lock, Thread
+
+from w1thermsensor import W1ThermSensor
+from w1thermsensor.errors import W1ThermSensorError
+
+from utils import clock, StoppableThread
+
+
+log = logging.getLogger(__name__)
+
+# newer w1_therm kernel drivers can start a conversion on every probe of the bus at once
+BULK_READ_PATH = '/sys/bus/w1/devices/w1_bus_master1/therm_bulk_read'
+
+
+class ThermBus(StoppableThread):
+    def __init__(self, interval_secs, resolution, bulk_read_path=BULK_READ_PATH):
+        if not 9 <= resolution <= 12:
+            raise ValueError('DS18B20 resolution must be between 9 and 12 bits, not {}'.format(resolution))
+        super(ThermBus, self).__init__()
+        self.daemon = True
+        self.name = '1-Wire bus reader'
+        self.interval_secs = interval_secs
+        self.resolution = resolution
+        self.bulk_read_path = bulk_read_path
+        self.lock = Lock()
+        self.readings = {}
+        self.errors = {}
+        try:
+            self.sensors = dict((sensor.id, sensor) for sensor in W1ThermSensor.get_available_sensors())
+        except (W1ThermSensorError, OSError) as e:
+            log.error('Unable to list 1-Wire temperature probes: {}'.format(e))
+            self.sensors = {}
+        log.info('Found {} 1-Wire temperature probe(s): {}'.format(
+            len(self.sensors), ', '.join(sorted(self.sensors)) or 'none'))
+
+    def get_sensor(self, sensor_id):
+        return self.sensors.get(sensor_id)
+
+    @property
+    def conversion_secs(self):
+        # DS18B20 datasheet: 93.75ms at 9 bits, doubling with every extra bit
+        return 0.09375 * 2 ** (self.resolution - 9)
+
+    def run(self):
+        for sensor in self.sensors.values():
+            try:
+                sensor.set_precision(self.resolution)
+            except W1ThermSensorError as e:
+                log.warning('{}: unable to set resolution to {} bits: {}'.format(sensor.id, self.resolution, e))
+        while not self.is_stopping():
+            if self.sensors:
+                self.read_all()
+            self._stop_event.wait(self.interval_secs)
+
+    def read_all(self):
+        if self._bulk_convert():
+            # conversions are done, each read only fetches the scratchpad
+            for sensor in self.sensors.values():
+                self.read(sensor)
+        else:
+            threads = [Thread(target=self.read, args=(sensor,), name='1-Wire {}'.format(sensor.id))
+                       for sensor in self.sensors.values()]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+    def _bulk_convert(self):
+        if len(self.sensors) < 2 or not os.path.exists(self.bulk_read_path):
+            return False
+        try:
+            with open(self.bulk_read_path, 'w') as bulk_read:
+                bulk_read.write('trigger\n')
+            clock.sleep(self.conversion_secs)
+            # -1 while any conversion is still in progress
+            for _ in range(10):
+                with open(self.bulk_read_path) as bulk_read:
+                    if bulk_read.read().strip() != '-1':
+                        return True
+                clock.sleep(self.conversion_secs / 4)
+        except (IOError, OSError) as e:
+            log.warning('1-Wire bulk conversion failed, reading probes one by one: {}'.format(e))
+        return False
+
+    def read(self, sensor):
+        try:
+            temp = sensor.get_temperature(W1ThermSensor.DEGREES_F)
+        except W1ThermSensorError as e:
+            with self.lock:
+                self.errors[sensor.id] = self.errors.get(sensor.id, 0) + 1
+            log.warning('{}: failed to read temperature: {}'.format(sensor.id, e))
+            return
+        with self.lock:
+            self.readings[sensor.id] = (temp, clock.utcnow())
+
+    def latest(self, sensor_id):
+        with self.lock:
+            return self.readings.get(sensor_id, (None, None))
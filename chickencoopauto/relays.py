@@ -1,21 +1,26 @@
 import logging
-from time import sleep
+from threading import RLock
+
 
 import RPi.GPIO as GPIO
 from transitions import Machine
 
 from notifications import Notification
+from telemetry import DutyCycle
+from utils import clock
 
 
 log = logging.getLogger(__name__)
 
 
 class Relay(Machine):
-    def __init__(self, coop, channel, name, port, initial_state):
+    def __init__(self, coop, channel, name, port, initial_state, watts=0):
         self.coop = coop
         self.name = name
         self.channel = channel
         self.port = port
+        self.duty_cycle = DutyCycle(watts)
+        self.changed = 0
         GPIO.setmode(GPIO.BCM)
         GPIO.setup(port, GPIO.OUT, initial=(initial_state == 'on'))
 
@@ -51,11 +56,26 @@ class Relay(Machine):
 
     def set_relay(self, event):
         GPIO.output(self.port, self.state == 'on')
+        if event is not None:
+            self.changed = clock.time()
+        self.duty_cycle.record(self.state == 'on')
+
+    def secs_in_state(self):
+        return clock.time() - self.changed
 
     def reset(self):
         self.set_state(self.transition_initial)
         self.set_relay(None)
 
+    def to_dict(self):
+        return {'state': self.state, 'changed': self.changed}
+
+    def load(self, saved):
+        self.set_state(saved['state'])
+        self.set_relay(None)
+        # dwell times carry on from the last real switch
+        self.changed = saved['changed']
+
     def notify_on(self, event):
         pass
 
@@ -64,10 +84,12 @@ class Relay(Machine):
 
 
 class SingleRelayOperatedObject(Machine):
-    def __init__(self, coop, name, relay):
+    def __init__(self, coop, name, relay, min_on_secs=0, min_off_secs=0):
         self.coop = coop
         self.name = name
         self.relay = relay
+        self.min_on_secs = min_on_secs
+        self.min_off_secs = min_off_secs
 
         self.transition_states = [
             'auto',
@@ -105,14 +127,14 @@ class SingleRelayOperatedObject(Machine):
                 'trigger': 'check',
                 'source': 'auto-off',
                 'dest': 'auto-on',
-                'conditions': [self.is_off, self.is_auto_go_on],
+                'conditions': [self.is_off, self.is_auto_go_on, self.is_dwell_over],
                 'before': self.turn_on,
             },
             {
                 'trigger': 'check',
                 'source': 'auto-on',
                 'dest': 'auto-off',
-                'conditions': [self.is_on, self.is_auto_go_off],
+                'conditions': [self.is_on, self.is_auto_go_off, self.is_dwell_over],
                 'before': self.turn_off,
             },
             {
@@ -155,6 +177,30 @@ class SingleRelayOperatedObject(Machine):
         # must be implemented in subclass
         pass
 
+    def is_dwell_over(self, event=None):
+        # keeps a reading hovering around a threshold from switching the relay every check
+        min_secs = self.min_on_secs if self.is_on() else self.min_off_secs
+        return self.relay.secs_in_state() >= min_secs or self.is_dwell_overridden(event)
+
+    def is_dwell_overridden(self, event=None):
+        # without a reading the relay falls back to off right away
+        return 'temp' in event.kwargs and event.kwargs['temp'] is None
+
+    def set_dwell(self, min_on_secs, min_off_secs):
+        self.min_on_secs = min_on_secs
+        self.min_off_secs = min_off_secs
+
+    def to_dict(self):
+        return {'state': self.state, 'relay': self.relay.to_dict()}
+
+    def load(self, saved, fresh):
+        # a manual override is kept however old, an automatic decision is only resumed from a recent one
+        if fresh or 'manual' in saved['state']:
+            # an unknown state raises before the relay is touched
+            self.get_state(saved['state'])
+            self.relay.load(saved['relay'])
+            self.set_state(saved['state'])
+
     def is_on(self, event=None):
         return self.relay.state == 'on'
 
@@ -217,13 +263,15 @@ class SingleRelayOperatedObject(Machine):
 
 
 class WaterHeater(SingleRelayOperatedObject):
-    def __init__(self, coop, name, relay, temp_range):
+    def __init__(self, coop, name, relay, temp_range, min_on_secs=0, min_off_secs=0):
         self.temp_range = temp_range
         self.temp = None
         super(WaterHeater, self).__init__(
             coop,
             name,
-            relay
+            relay,
+            min_on_secs=min_on_secs,
+            min_off_secs=min_off_secs
         )
 
     def is_auto_go_on(self, event=None):
@@ -240,18 +288,25 @@ class WaterHeater(SingleRelayOperatedObject):
                 temp is None or
                 temp > self.temp_range[1])
 
+    def is_dwell_overridden(self, event=None):
+        # never keep heating an empty tank
+        return (bool(event.kwargs.get('water_empty', None)) or
+                super(WaterHeater, self).is_dwell_overridden(event))
+
     def set_temp_range(self, temp_range):
         self.temp_range = temp_range
 
 
 class Heater(SingleRelayOperatedObject):
-    def __init__(self, coop, name, relay, temp_range):
+    def __init__(self, coop, name, relay, temp_range, min_on_secs=0, min_off_secs=0):
         self.temp_range = temp_range
         self.temp = None
         super(Heater, self).__init__(
             coop,
             name,
-            relay
+            relay,
+            min_on_secs=min_on_secs,
+            min_off_secs=min_off_secs
         )
 
     def is_auto_go_on(self, event=None):
@@ -269,13 +324,15 @@ class Heater(SingleRelayOperatedObject):
 
 
 class Fan(SingleRelayOperatedObject):
-    def __init__(self, coop, name, relay, temp_range):
+    def __init__(self, coop, name, relay, temp_range, min_on_secs=0, min_off_secs=0):
         self.temp_range = temp_range
         self.temp = None
         super(Fan, self).__init__(
             coop,
             name,
-            relay
+            relay,
+            min_on_secs=min_on_secs,
+            min_off_secs=min_off_secs
         )
 
     def is_auto_go_on(self, event=None):
@@ -360,7 +417,7 @@ class MultiRelayOperatedObject(Machine):
 
 
 class Door(MultiRelayOperatedObject):
-    def __init__(self, coop, name, relays, manual_mode=False):
+    def __init__(self, coop, name, relays, manual_mode=False, travel_times=None):
         self.transition_states = [
             'auto',
             'auto-open-day',
@@ -373,6 +430,12 @@ class Door(MultiRelayOperatedObject):
             'manual-invalid'
         ]
         self.transition_initial = 'manual' if manual_mode else 'auto'
+        self.motion = None
+        self.motion_result = None
+        self.motion_timer = None
+        self.finished_switch = None
+        self.motion_lock = RLock()
+        self.travel_times = travel_times
         self.transition_transitions = [
             {
                 'trigger': 'set_auto',
@@ -541,51 +604,119 @@ class Door(MultiRelayOperatedObject):
         if switches.state == 'open':
             log.info('{} was already open'.format(self.name))
             return
-        self.turn_on(1)
-        opened = switches.top_sensor.wait_on()
-        self.turn_off(1)
-        if not opened:
-            switches.top_sensor.failed_to_wait()
-            self.coop.notifier_callback(
-                Notification('ERROR',
-                             '{name} failed to open{at}',
-                             name=self.name,
-                             at=(' at sunrise' if self.is_auto_mode() else ''))
-            )
-            self.set_manual()
-        else:
-            self.coop.notifier_callback(
-                Notification('INFO',
-                             '{name} opened{at}',
-                             name=self.name,
-                             at=(' at sunrise' if self.is_auto_mode() else ''))
-            )
+        self._start_motion('opening', 1, switches.top_sensor)
 
     def close(self, event):
         switches = event.kwargs['switches']
         if switches.state == 'closed':
             log.info('{} was already closed'.format(self.name))
             return
-        self.turn_on(0)
-        closed = switches.bottom_sensor.wait_on()
-        # delay to compensate for switches sometimes trigerring too soon
-        sleep(0.1)
-        self.turn_off(0)
-        if not closed:
-            switches.bottom_sensor.failed_to_wait()
+        self._start_motion('closing', 0, switches.bottom_sensor)
+
+    def is_moving(self):
+        return self.motion is not None
+
+    def to_dict(self):
+        return {'state': self.state}
+
+    def load(self, saved, fresh):
+        # only manual modes come back, in auto check() works out from the switches whether the door has to move
+        if 'manual' in saved['state']:
+            self.set_state(saved['state'])
+
+    def _start_motion(self, motion, relay_num, switch):
+        # the motor runs until the limit switch edge or the deadline, without blocking the caller
+        with self.motion_lock:
+            if self.motion is not None:
+                log.info('{} is already {}'.format(self.name, self.motion))
+                return
+            self.motion = motion
+            self.motion_relay_num = relay_num
+            self.motion_switch = switch
+            self.motion_started = clock.time()
+            self.motion_at = (' at sunrise' if motion == 'opening' else ' at sunset') if self.is_auto_mode() else ''
+            self.turn_on(relay_num)
+            self._unwatch_finished_switch()
+            switch.watch_on(self._motion_edge)
+            timeout = self.travel_times.timeout(motion) if self.travel_times else switch.timeout / 1000.0
+            self.motion_timer = clock.timer(timeout, self._finish_motion, args=(False,))
+        log.info('{} is {}'.format(self.name, motion))
+        if switch.is_on():
+            # reached the switch before the edge detection was armed
+            self._motion_edge(switch.port)
+
+    def _motion_edge(self, port):
+        travel_secs = clock.time() - self.motion_started
+        if self.motion == 'closing':
+            # delay to compensate for switches sometimes trigerring too soon
+            clock.sleep(0.1)
+        self._finish_motion(True, travel_secs)
+
+    def _finish_motion(self, reached, travel_secs=None):
+        # called from the RPi.GPIO edge callback thread, which must not remove its own edge detection,
+        # so that and the notifications and mode changes are left to the control loop, see settle_motion
+        with self.motion_lock:
+            if self.motion is None:
+                return
+            self.motion_timer.cancel()
+            self.turn_off(self.motion_relay_num)
+            self.motion_result = (self.motion, reached, self.motion_switch, self.motion_at, travel_secs)
+            self.finished_switch = self.motion_switch
+            self.motion = None
+
+    def _unwatch_finished_switch(self):
+        with self.motion_lock:
+            switch, self.finished_switch = self.finished_switch, None
+        if switch is not None:
+            switch.unwatch()
+
+    def abort_motion(self):
+        self._finish_motion(False)
+        self._unwatch_finished_switch()
+
+    def settle_motion(self):
+        self._unwatch_finished_switch()
+        with self.motion_lock:
+            result = self.motion_result
+            self.motion_result = None
+        if result is None:
+            return
+        motion, reached, switch, at, travel_secs = result
+        action = 'open' if motion == 'opening' else 'close'
+        if not reached:
+            switch.failed_to_wait()
             self.coop.notifier_callback(
                 Notification('ERROR',
-                             '{name} failed to close{at}',
+                             '{name} failed to {action}{at}',
                              name=self.name,
-                             at=(' at sunset' if self.is_auto_mode() else ''))
+                             action=action,
+                             at=at)
             )
             self.set_manual()
         else:
             self.coop.notifier_callback(
                 Notification('INFO',
-                             '{name} closed{at}',
+                             '{name} {action}{at}',
+                             name=self.name,
+                             action='opened' if motion == 'opening' else 'closed',
+                             at=at)
+            )
+            self.record_travel_time(motion, travel_secs)
+
+    def record_travel_time(self, motion, travel_secs):
+        log.info('{} {} took {:.2f}s'.format(self.name, motion, travel_secs))
+        self.coop.db_log.write('DOOR_{}'.format(motion.upper()), '{:.2f}'.format(travel_secs))
+        if self.travel_times is None:
+            return
+        drift = self.travel_times.record(motion, travel_secs)
+        if drift:
+            self.coop.notifier_callback(
+                Notification('WARN',
+                             '{name} - {motion} now takes {recent:.1f}s, baseline is {baseline:.1f}s',
                              name=self.name,
-                             at=(' at sunset' if self.is_auto_mode() else ''))
+                             motion=motion,
+                             recent=drift[0],
+                             baseline=drift[1])
             )
 
     def is_day(self, event):
@@ -1,18 +1,16 @@
 from __future__ import unicode_literals
-import json
 import logging
 
 import arrow
-import Adafruit_DHT as DHT  # noqa: N814
-import requests
-from requests.exceptions import RequestException
+from dateutil import tz
 import RPi.GPIO as GPIO
-from w1thermsensor import NoSensorFoundError, W1ThermSensor
 
 from transitions import Machine
 
+from dht import DHTReader, MedianFilter
 from notifications import Notification
-from utils import get_db
+from solar import TwilightTable
+from utils import clock
 
 
 log = logging.getLogger(__name__)
@@ -20,11 +18,15 @@ logging.getLogger('web').setLevel(logging.ERROR)
 
 
 class Sensor(Machine):
+    # maximum age in seconds of the last reading before it is considered stale, None uses the coop default
+    stale_after = None
+
     def __init__(self, *args, **kwargs):
         self.state = None
         self.last = None
         self.log_type = kwargs.pop('log_type', None)
         self.name = kwargs.get('name', None)
+        self.unchanged_check = None
         super(Sensor, self).__init__(*args, **kwargs)
 
     def read_sensor(self):
@@ -32,7 +34,31 @@ class Sensor(Machine):
 
     def read_and_check(self):
         self.read_sensor()
-        self.check()
+        self.check_if_changed()
+
+    def check_inputs(self):
+        # everything the check conditions look at besides the state, None checks every time
+        return None
+
+    def check_if_changed(self):
+        # a check that left the state alone does it again until the state or its inputs change
+        inputs = self.check_inputs()
+        if inputs is None or (self.state, inputs) != self.unchanged_check:
+            state = self.state
+            self.check()
+            self.unchanged_check = (state, inputs) if self.state == state else None
+
+    def is_stale(self, max_age):
+        if self.stale_after is not None:
+            max_age = self.stale_after
+        return self.last is None or (clock.utcnow() - self.last).total_seconds() > max_age
+
+    def to_dict(self):
+        return {'state': self.state}
+
+    def load(self, saved):
+        # without this the first check after a restart notifies about a state that was already notified
+        self.set_state(saved['state'])
 
 
 class TempSensor(Sensor):
@@ -46,6 +72,7 @@ class TempSensor(Sensor):
         self.temp_high = temp_range[2]
         self.temp_error_high = temp_range[3]
         self.temp = None
+        self.stale = False
         self.sensor = sensor
         self.port = port
 
@@ -56,6 +83,7 @@ class TempSensor(Sensor):
             'temp_error_low',
             'temp_error_high',
             'temp_invalid',
+            'temp_stale',
         ]
         self.transition_initial = 'temp_invalid'
         self.transition_transitions = [
@@ -66,6 +94,7 @@ class TempSensor(Sensor):
                     'temp_low',
                     'temp_error_low',
                     'temp_invalid',
+                    'temp_stale',
                 ],
                 'dest': 'temp_high',
                 'conditions': self.go_temp_high,
@@ -84,6 +113,7 @@ class TempSensor(Sensor):
                     'temp_high',
                     'temp_error_high',
                     'temp_invalid',
+                    'temp_stale',
                 ],
                 'dest': 'temp_low',
                 'conditions': self.go_temp_low,
@@ -103,6 +133,7 @@ class TempSensor(Sensor):
                     'temp_error_low',
                     'temp_error_high',
                     'temp_invalid',
+                    'temp_stale',
                 ],
                 'dest': 'temp_ok',
                 'conditions': self.go_temp_ok
@@ -115,6 +146,7 @@ class TempSensor(Sensor):
                     'temp_high',
                     'temp_error_low',
                     'temp_invalid',
+                    'temp_stale',
                 ],
                 'dest': 'temp_error_high',
                 'conditions': self.go_temp_error_high,
@@ -128,6 +160,7 @@ class TempSensor(Sensor):
                     'temp_high',
                     'temp_error_high',
                     'temp_invalid',
+                    'temp_stale',
                 ],
                 'dest': 'temp_error_low',
                 'conditions': self.go_temp_error_low,
@@ -139,6 +172,20 @@ class TempSensor(Sensor):
                 'dest': 'temp_invalid',
                 'conditions': self.go_temp_invalid
             },
+            {
+                'trigger': 'check',
+                'source': [
+                    'temp_ok',
+                    'temp_low',
+                    'temp_high',
+                    'temp_error_low',
+                    'temp_error_high',
+                    'temp_invalid',
+                ],
+                'dest': 'temp_stale',
+                'conditions': self.go_temp_stale,
+                'after': self.notify_temp_stale
+            },
         ]
 
         super(TempSensor, self).__init__(
@@ -150,11 +197,17 @@ class TempSensor(Sensor):
             transitions=self.transition_transitions
         )
 
+    def check_inputs(self):
+        return self.temp, self.stale, self.temp_error_low, self.temp_low, self.temp_high, self.temp_error_high
+
     def go_temp_ok(self):
         return self.temp and self.temp_low <= self.temp <= self.temp_high
 
     def go_temp_invalid(self):
-        return self.temp is None
+        return self.temp is None and not self.stale
+
+    def go_temp_stale(self):
+        return self.stale
 
     def go_temp_low(self):
         return self.temp and self.temp_error_low <= self.temp < self.temp_low
@@ -195,6 +248,14 @@ class TempSensor(Sensor):
                          maxi=self.temp_error_high)
         )
 
+    def notify_temp_stale(self):
+        self.coop.notifier_callback(
+            Notification('WARN',
+                         '{name} - no temperature reading for over {secs} seconds',
+                         name=self.name,
+                         secs=self.stale_after)
+        )
+
     def notify_temp_error_low(self):
         self.coop.notifier_callback(
             Notification('ERROR',
@@ -209,7 +270,7 @@ class TempSensor(Sensor):
         warn = False
         manual = False
 
-        if self.state in ['temp_low', 'temp_high', 'temp_invalid']:
+        if self.state in ['temp_low', 'temp_high', 'temp_invalid', 'temp_stale']:
             warn = True
         if 'error' in self.state:
             error = True
@@ -223,53 +284,93 @@ class TempSensor(Sensor):
         else:
             return 'OK'
 
+    def set_temp_range(self, temp_range):
+        # the new thresholds apply from the next reading
+        self.temp_error_low, self.temp_low, self.temp_high, self.temp_error_high = temp_range
+
+    def to_dict(self):
+        saved = super(TempSensor, self).to_dict()
+        saved['temp'] = self.temp
+        saved['last'] = self.last.float_timestamp if self.last is not None else None
+        return saved
+
+    def load(self, saved):
+        super(TempSensor, self).load(saved)
+        if saved['last'] is not None:
+            self.temp = saved['temp']
+            self.last = arrow.get(saved['last'])
+
     def _execute_db_log(self):
-        return self.last_db_log is None or \
-               arrow.utcnow() > self.last_db_log.shift(minutes=self.coop.config['Database']['LOGGING_INTERVAL'])
+        interval_secs = self.coop.config['Database']['LOGGING_INTERVAL'] * 60
+        return self.last_db_log is None or (clock.utcnow() - self.last_db_log).total_seconds() > interval_secs
 
     def db_log_reading(self):
         if self.log_type and self.temp and self._execute_db_log():
-            db = get_db(self.coop)
-            db.insert(
-                'coop_log',
-                log_type='{}_TEMP'.format(self.log_type),
-                log_value='{:.1f}'.format(float(self.temp))
-            )
-            self.last_db_log = arrow.utcnow()
+            self.coop.db_log.write('{}_TEMP'.format(self.log_type), '{:.1f}'.format(float(self.temp)))
+            self.last_db_log = clock.utcnow()
 
 
 class AmbientTempHumiSensor(TempSensor):
-    def __init__(self, coop, name, log_type, sensor, port, temp_range, humi_range, cache_mins):
+    # DHT22 datasheet: -40 to 80 C, 0 to 100 %RH
+    valid_temp_range = (-40.0, 176.0)
+    valid_humi_range = (0.0, 100.0)
+
+    def __init__(self, coop, name, log_type, sensor, port, temp_range, humi_range, cache_mins,
+                 read_attempts=5, filter_size=5, max_temp_jump=10.0, max_humi_jump=20.0):
         self.name = name
         self.log_type = log_type
         self.humi_low = humi_range[0]
         self.humi_high = humi_range[1]
         self.humi = None
         self.cache_mins = cache_mins
+        self.stale_after = cache_mins * 60
+        self.reader = DHTReader(sensor, port, read_attempts)
+        self.temp_filter = MedianFilter(filter_size, max_temp_jump, self.valid_temp_range)
+        self.humi_filter = MedianFilter(filter_size, max_humi_jump, self.valid_humi_range)
+        self.accepted = 0
+        self.rejected = 0
+        self.timed_out = 0
 
         super(AmbientTempHumiSensor, self).__init__(coop, name, log_type, sensor, port, temp_range)
-        self.last = arrow.utcnow()
+        self.last = clock.utcnow()
 
     def read_sensor(self):
-        now = arrow.utcnow()
-        humi, temp = DHT.read_retry(self.sensor, self.port, retries=2, delay_seconds=10)
+        now = clock.utcnow()
+        humi, temp = self.reader.read()
 
-        if temp:
-            self.temp = float(temp) * 1.8 + 32.0
+        temp_ok = humi_ok = False
+        if humi is None or temp is None:
+            self.timed_out += 1
+            log.debug('Ambient sensor read timed out')
+        else:
+            temp = float(temp) * 1.8 + 32.0
+            humi = float(humi)
+            temp_ok = self.temp_filter.add(temp)
+            humi_ok = self.humi_filter.add(humi)
+            if temp_ok and humi_ok:
+                self.accepted += 1
+            else:
+                self.rejected += 1
+                log.warning('Rejected ambient reading: {:.1f} F, {:.1f}%'.format(temp, humi))
+
+        if temp_ok:
+            self.temp = self.temp_filter.median
             self.last = now
+            self.coop.history.record('{}_TEMP'.format(self.log_type), self.temp, now.float_timestamp)
             log.info('Ambient temp: {:.1f}'.format(float(self.temp)))
-        elif now > self.last.shift(minutes=self.cache_mins):
+        elif (now - self.last).total_seconds() > self.cache_mins * 60:
             self.temp = None
             self.state = 'temp_invalid'
             log.debug('Unable to get ambient temperature')
         elif self.temp:
             log.debug('Last ambient temperature: {:.1f}'.format(float(self.temp)))
 
-        if humi:
-            self.humi = humi
+        if humi_ok:
+            self.humi = self.humi_filter.median
             self.last = now
+            self.coop.history.record('{}_HUMI'.format(self.log_type), self.humi, now.float_timestamp)
             log.info('Ambient humidity: {:.1f}%'.format(float(self.humi)))
-        elif now > self.last.shift(minutes=self.cache_mins):
+        elif (now - self.last).total_seconds() > self.cache_mins * 60:
             self.humi = None
             log.debug('Unable to get ambient humidity')
         elif self.humi:
@@ -278,37 +379,45 @@ class AmbientTempHumiSensor(TempSensor):
         self.db_log_reading()
         return self.temp
 
+    def read_counts(self):
+        return self.accepted, self.rejected, self.timed_out
+
+    def set_humi_range(self, humi_range):
+        self.humi_low, self.humi_high = humi_range
+
+    def to_dict(self):
+        saved = super(AmbientTempHumiSensor, self).to_dict()
+        saved['humi'] = self.humi
+        return saved
+
+    def load(self, saved):
+        super(AmbientTempHumiSensor, self).load(saved)
+        if saved['last'] is not None:
+            self.humi = saved['humi']
+            # new readings are filtered against the restored ones rather than accepted blindly
+            for value, median_filter in ((self.temp, self.temp_filter), (self.humi, self.humi_filter)):
+                if value is not None:
+                    median_filter.add(value)
+
     def db_log_reading(self):
         if self.log_type and (self.temp or self.humi) and self._execute_db_log():
-            values = []
             if self.temp:
-                values.append(
-                    {
-                        'log_type': '{}_TEMP'.format(self.log_type),
-                        'log_value': '{:.1f}'.format(float(self.temp)),
-                    }
-                )
+                self.coop.db_log.write('{}_TEMP'.format(self.log_type), '{:.1f}'.format(float(self.temp)))
             if self.humi:
-                values.append(
-                    {
-                        'log_type': '{}_HUMI'.format(self.log_type),
-                        'log_value': '{:.1f}'.format(float(self.humi)),
-                    }
-                )
-            db = get_db(self.coop)
-            db.multiple_insert('coop_log', values)
-            self.last_db_log = arrow.utcnow()
-
-
-class WaterTempSensor(TempSensor):
-    def __init__(self, coop, name, log_type, temp_range):
-        try:
-            w1_sensor = W1ThermSensor()
-        except NoSensorFoundError:
-            log.error('Water temperature sensor not found!')
-            w1_sensor = None
-
-        super(WaterTempSensor, self).__init__(
+                self.coop.db_log.write('{}_HUMI'.format(self.log_type), '{:.1f}'.format(float(self.humi)))
+            self.last_db_log = clock.utcnow()
+
+
+class ProbeTempSensor(TempSensor):
+    def __init__(self, coop, name, log_type, bus, sensor_id, temp_range, stale_secs=60):
+        # readings come from the bus thread, the conversion takes up to 750ms so check() never waits for one
+        self.bus = bus
+        self.sensor_id = sensor_id
+        w1_sensor = bus.get_sensor(sensor_id)
+        if not w1_sensor:
+            log.error('{} ({}) not found!'.format(name, sensor_id))
+
+        super(ProbeTempSensor, self).__init__(
             coop,
             name,
             log_type,
@@ -316,15 +425,36 @@ class WaterTempSensor(TempSensor):
             4,  # must go in GPIO4 !!!
             temp_range
         )
+        self.stale_after = stale_secs
 
     def read_sensor(self):
         if self.sensor:
-            self.temp = self.sensor.get_temperature(W1ThermSensor.DEGREES_F)
-            self.last = arrow.utcnow()
-            log.info('Water temp: {:.1f}'.format(float(self.temp)))
+            temp, last = self.bus.latest(self.sensor_id)
+            if last is None:
+                if self.temp is not None and self.is_stale(self.stale_after):
+                    # nothing read since startup, a restored reading ages out all the same
+                    self.temp = None
+                return None
+            new_reading = last != self.last
+            self.last = last
+            self.stale = self.is_stale(self.stale_after)
+            if self.stale:
+                self.temp = None
+                log.debug('{} reading is stale, last one at {}'.format(self.name, last))
+                return None
+            self.temp = temp
+            if new_reading:
+                self.coop.history.record('{}_TEMP'.format(self.log_type), self.temp, last.float_timestamp)
+            log.info('{} temp: {:.1f}'.format(self.name, float(self.temp)))
             self.db_log_reading()
             return self.temp
 
+    def status(self):
+        status = super(ProbeTempSensor, self).status()
+        return 'ERROR' if not self.sensor else status
+
+
+class WaterTempSensor(ProbeTempSensor):
     def notify_temp_high(self):
         pass
 
@@ -336,7 +466,7 @@ class WaterTempSensor(TempSensor):
         warn = False
         manual = False
 
-        if self.state in ['temp_low', 'temp_error_high', 'temp_invalid']:
+        if self.state in ['temp_low', 'temp_error_high', 'temp_invalid', 'temp_stale']:
             warn = True
         if self.state in ['temp_error_low']:
             error = True
@@ -369,8 +499,7 @@ class SwitchSensor(Sensor):
         self.name = name
         self.port = port
         self.timeout = timeout
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self.port, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+        self.coop.gpio_snapshot.register(self.port)
 
         self.transition_states = [
             'open',
@@ -409,35 +538,25 @@ class SwitchSensor(Sensor):
         )
 
     def read_sensor(self):
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self.port, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        if GPIO.input(self.port):
+        if self.coop.gpio_snapshot.input(self.port):
             self.state = 'closed'
         else:
             self.state = 'open'
         log.info('{} is {}'.format(self.name, self.state))
-        self.last = arrow.utcnow()
+        self.last = clock.utcnow()
         return self.state
 
-    def wait_on(self):
-        return self._wait(detect=GPIO.RISING)
-
-    def wait_off(self):
-        return self._wait(detect=GPIO.FALLING)
-
-    def _wait(self, detect=GPIO.RISING):
-        # if (self.is_closed() and detect == GPIO.RISING) or \
-        #    (self.is_open() and detect == GPIO.FALLING):
-        #     return True
-        log.debug('Waiting...')
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self.port, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        result = GPIO.wait_for_edge(self.port, detect, timeout=self.timeout)
-        if result is None:
-            self.failed_to_wait()
-            return False
-        log.debug('Done!')
-        return True
+    def check_inputs(self):
+        return ()
+
+    def is_on(self):
+        return GPIO.input(self.port)
+
+    def watch_on(self, callback):
+        GPIO.add_event_detect(self.port, GPIO.RISING, callback=callback, bouncetime=200)
+
+    def unwatch(self):
+        GPIO.remove_event_detect(self.port)
 
     def go_open(self):
         return self.state == 'open'
@@ -516,15 +635,19 @@ class HalfEmptyWaterLevelsSensor(Sensor):
     def read_sensor(self):
         self.half_sensor.read_sensor()
         self.empty_sensor.read_sensor()
-        self.last = arrow.utcnow()
+        self.last = clock.utcnow()
         return self.state
 
     def read_and_check(self):
         self.half_sensor.read_and_check()
         self.empty_sensor.read_and_check()
-        self.check()
+        self.last = clock.utcnow()
+        self.check_if_changed()
         return self.state
 
+    def check_inputs(self):
+        return self.half_sensor.state, self.empty_sensor.state
+
     def go_full(self):
         if self.is_full():
             return False
@@ -653,15 +776,19 @@ class DoorDualSensor(Sensor):
     def read_sensor(self):
         self.top_sensor.read_sensor()
         self.bottom_sensor.read_sensor()
-        self.last = arrow.utcnow()
+        self.last = clock.utcnow()
         return self.state
 
     def read_and_check(self):
         self.top_sensor.read_and_check()
         self.bottom_sensor.read_and_check()
-        self.check()
+        self.last = clock.utcnow()
+        self.check_if_changed()
         return self.state
 
+    def check_inputs(self):
+        return self.top_sensor.state, self.bottom_sensor.state
+
     def go_open(self):
         return self.top_sensor.state == 'closed' and self.bottom_sensor.state == 'open'
 
@@ -699,7 +826,11 @@ class DoorDualSensor(Sensor):
 
 
 class SunriseSunsetSensor(Sensor):
-    def __init__(self, coop, name, lat, lon, extra_min_sunrise=0, extra_min_sunset=0):
+    # refreshed once a day
+    stale_after = 2 * 24 * 60 * 60
+
+    def __init__(self, coop, name, lat, lon, extra_min_sunrise=0, extra_min_sunset=0, timezone='US/Eastern',
+                 cache_path=None, cache_days=30):
         self.coop = coop
         self.name = name
         self.last = None
@@ -709,6 +840,13 @@ class SunriseSunsetSensor(Sensor):
         self.lon = lon
         self.extra_min_sunrise = extra_min_sunrise
         self.extra_min_sunset = extra_min_sunset
+        self.tz = tz.gettz(timezone)
+        # adjusted sunrise/sunset and start of the next local day, as UTC epoch seconds
+        self.sunrise_ts = None
+        self.sunset_ts = None
+        self.refresh_ts = None
+        self.twilight_table = TwilightTable(lat, lon, clock.utcnow().to(self.tz).date(),
+                                            cache_path=cache_path, cache_days=cache_days)
 
         self.transition_states = [
             'day',
@@ -749,52 +887,41 @@ class SunriseSunsetSensor(Sensor):
         )
 
     def read_sensor(self):
-        now = arrow.utcnow()
-
-        if self.last is None or now.to('US/Eastern').day > self.sunset.to('US/Eastern').day:
-            try:
-                url = 'https://api.sunrise-sunset.org/json?lat={lat}&lng={lon}&date={today}&formatted=0'.format(
-                    lat=self.lat,
-                    lon=self.lon,
-                    today=now.to('US/Eastern').format('YYYY-MM-DD'),
-                )
-                response = requests.get(url)
-                response.raise_for_status()
-                data = json.loads(response.text)
-                if data['status'] == 'OK':
-                    self.sunrise = arrow.get(data['results']['civil_twilight_begin'])
-                    self.sunset = arrow.get(data['results']['civil_twilight_end'])
-                    self.last = now
-                    log.info('SunriseSunset refreshed at {}. Today is {}, sunrise is at {}, sunset is at {}'.format(
-                        self.last.to('US/Eastern').format('MMMM DD, YYYY HH:mm:ss'),
-                        now.to('US/Eastern').format('MMMM DD, YYYY'),
-                        self.sunrise.to('US/Eastern').format('MMMM DD, YYYY HH:mm:ss'),
-                        self.sunset.to('US/Eastern').format('MMMM DD, YYYY HH:mm:ss')))
-                else:
-                    self.notify_invalid()
-                    log.error('SunriseSunset FAILED to refresh at {}'.format(now.to('US/Eastern').format(
-                        'MMMM DD, YYYY HH:mm:ss')))
-            except (RequestException, ValueError):
+        if self.last is None or clock.time() >= self.refresh_ts:
+            now = clock.utcnow()
+            today = now.to(self.tz).date()
+            twilight = self.twilight_table.get(today)
+            # keep the table and its cache file covering the days ahead
+            self.twilight_table.start_prefetch(today)
+            if twilight is not None:
+                self.sunrise = arrow.get(twilight[0])
+                self.sunset = arrow.get(twilight[1])
+                self.refresh_ts = self.sunset.to(self.tz).floor('day').shift(days=1).timestamp
+                self._update_thresholds()
+                self.last = now
+                log.info('SunriseSunset refreshed at {}. Today is {}, sunrise is at {}, sunset is at {}'.format(
+                    self.last.to(self.tz).format('MMMM DD, YYYY HH:mm:ss'),
+                    now.to(self.tz).format('MMMM DD, YYYY'),
+                    self.sunrise.to(self.tz).format('MMMM DD, YYYY HH:mm:ss'),
+                    self.sunset.to(self.tz).format('MMMM DD, YYYY HH:mm:ss')))
+            else:
                 self.notify_invalid()
-                log.error('SunriseSunset FAILED to refresh at {}'.format(now.to('US/Eastern').format(
+                log.error('SunriseSunset FAILED to refresh at {}'.format(now.to(self.tz).format(
                     'MMMM DD, YYYY HH:mm:ss')))
-        return now
+        return self.last
 
     def go_day(self):
         if self.last:
-            now = arrow.utcnow()
-            if now.to('US/Eastern').day < self.sunrise.to('US/Eastern').day:
-                # past sunset, already have sunrise/sunset info for next day
-                return False
-            else:
-                after_sunrise = now.to('US/Eastern') > \
-                                self.sunrise.to('US/Eastern').shift(minutes=self.extra_min_sunrise)
-                before_sunset = now.to('US/Eastern') < \
-                                self.sunset.to('US/Eastern').shift(minutes=self.extra_min_sunset)
-                return after_sunrise and before_sunset
+            now = clock.time()
+            return self.sunrise_ts < now < self.sunset_ts
         else:
             return None
 
+    def _update_thresholds(self):
+        if self.sunrise is not None:
+            self.sunrise_ts = self.sunrise.timestamp + self.extra_min_sunrise * 60
+            self.sunset_ts = self.sunset.timestamp + self.extra_min_sunset * 60
+
     def go_night(self):
         _go_day = self.go_day()
         if _go_day is None:
@@ -830,15 +957,14 @@ class SunriseSunsetSensor(Sensor):
 
     def get_sunrise(self):
         if self.sunrise is not None:
-            return self.sunrise.shift(minutes=self.extra_min_sunrise).to('US/Eastern')
+            return self.sunrise.shift(minutes=self.extra_min_sunrise).to(self.tz)
 
-    @staticmethod
-    def _time_display(suntime, extra, include_extra=False, display_extra=True, include_day=False):
+    def _time_display(self, suntime, extra, include_extra=False, display_extra=True, include_day=False):
         if suntime is not None:
             time_format = 'MMMM DD, hh:mm a' if include_day else 'hh:mm a'
             result = suntime.shift(
                 minutes=extra if include_extra else 0
-            ).to('US/Eastern').format(time_format)
+            ).to(self.tz).format(time_format)
             if display_extra and extra != 0:
                 result += ' [{:+}min]'.format(extra)
             return result
@@ -848,16 +974,18 @@ class SunriseSunsetSensor(Sensor):
 
     def get_sunset(self):
         if self.sunset is not None:
-            return self.sunset.shift(minutes=self.extra_min_sunset).to('US/Eastern')
+            return self.sunset.shift(minutes=self.extra_min_sunset).to(self.tz)
 
     def sunset_display(self, include_extra=False, display_extra=True, include_day=False):
         return self._time_display(self.sunset, self.extra_min_sunset, include_extra, display_extra, include_day)
 
     def set_extra_min_sunrise(self, extra_min):
         self.extra_min_sunrise = extra_min
+        self._update_thresholds()
 
     def set_extra_min_sunset(self, extra_min):
         self.extra_min_sunset = extra_min
+        self._update_thresholds()
 
     def status(self):
         error = False
@@ -0,0 +1,132 @@
+from calendar import timegm
+from datetime import datetime, timedelta
+import json
+import logging
+from math import acos, asin, cos, degrees, radians, sin, tan
+from threading import Thread
+
+from checkpoint import write_json_atomically
+
+
+log = logging.getLogger(__name__)
+
+# sun center 6 degrees below the horizon
+CIVIL_TWILIGHT_ZENITH = 96.0
+
+
+def _julian_day(epoch_secs):
+    return epoch_secs / 86400.0 + 2440587.5
+
+
+def _sun_declination_and_equation_of_time(julian_day):
+    # NOAA solar calculator (Meeus), accurate to well under a minute for dates around now
+    t = (julian_day - 2451545.0) / 36525.0
+    mean_long = (280.46646 + t * (36000.76983 + t * 0.0003032)) % 360.0
+    mean_anomaly = radians(357.52911 + t * (35999.05029 - 0.0001537 * t))
+    eccentricity = 0.016708634 - t * (0.000042037 + 0.0000001267 * t)
+    center = sin(mean_anomaly) * (1.914602 - t * (0.004817 + 0.000014 * t)) + \
+        sin(2 * mean_anomaly) * (0.019993 - 0.000101 * t) + \
+        sin(3 * mean_anomaly) * 0.000289
+    omega = radians(125.04 - 1934.136 * t)
+    apparent_long = radians(mean_long + center - 0.00569 - 0.00478 * sin(omega))
+    mean_obliquity = 23.0 + (26.0 + (21.448 - t * (46.815 + t * (0.00059 - t * 0.001813))) / 60.0) / 60.0
+    obliquity = radians(mean_obliquity + 0.00256 * cos(omega))
+
+    declination = asin(sin(obliquity) * sin(apparent_long))
+
+    y = tan(obliquity / 2) ** 2
+    mean_long = radians(mean_long)
+    equation_of_time = 4 * degrees(
+        y * sin(2 * mean_long) -
+        2 * eccentricity * sin(mean_anomaly) +
+        4 * eccentricity * y * sin(mean_anomaly) * cos(2 * mean_long) -
+        0.5 * y * y * sin(4 * mean_long) -
+        1.25 * eccentricity * eccentricity * sin(2 * mean_anomaly)
+    )
+    return declination, equation_of_time
+
+
+def _event_minutes(day_start, lat, lon, rising, zenith):
+    # minutes after day_start (UTC midnight), iterated so the sun position is taken at the event itself
+    minutes = 720.0 - 4.0 * lon
+    for _ in range(3):
+        declination, equation_of_time = _sun_declination_and_equation_of_time(
+            _julian_day(day_start + minutes * 60.0))
+        cos_hour_angle = cos(radians(zenith)) / (cos(radians(lat)) * cos(declination)) - \
+            tan(radians(lat)) * tan(declination)
+        if not -1.0 <= cos_hour_angle <= 1.0:
+            # sun never reaches this zenith angle on this day (polar day/night)
+            return None
+        hour_angle = degrees(acos(cos_hour_angle))
+        if rising:
+            minutes = 720.0 - 4.0 * (lon + hour_angle) - equation_of_time
+        else:
+            minutes = 720.0 - 4.0 * (lon - hour_angle) - equation_of_time
+    return minutes
+
+
+def civil_twilight(date, lat, lon):
+    # begin and end of civil twilight as UTC epoch seconds, None if there is none that day
+    day_start = timegm(date.timetuple()[:3] + (0, 0, 0))
+    begin = _event_minutes(day_start, lat, lon, True, CIVIL_TWILIGHT_ZENITH)
+    end = _event_minutes(day_start, lat, lon, False, CIVIL_TWILIGHT_ZENITH)
+    if begin is None or end is None:
+        return None
+    return int(round(day_start + begin * 60)), int(round(day_start + end * 60))
+
+
+class TwilightTable(object):
+    def __init__(self, lat, lon, start_date, days=366, cache_path=None, cache_days=30):
+        self.lat = lat
+        self.lon = lon
+        self.cache_path = cache_path
+        self.cache_days = cache_days
+        self.table = {}
+        self.days = days
+        self.prefetch_thread = None
+        if self.cache_path:
+            self._load_cache()
+        self.start_prefetch(start_date)
+
+    def start_prefetch(self, start_date):
+        # computing a whole year takes a while on a Pi, so do it in the background
+        if self.prefetch_thread is not None and self.prefetch_thread.is_alive():
+            return
+        self.prefetch_thread = Thread(target=self.prefetch, args=(start_date, self.days), name='TwilightPrefetch')
+        self.prefetch_thread.daemon = True
+        self.prefetch_thread.start()
+
+    def get(self, date):
+        if date not in self.table:
+            self.table[date] = civil_twilight(date, self.lat, self.lon)
+        return self.table[date]
+
+    def prefetch(self, start_date, days):
+        for i in range(days):
+            self.get(start_date + timedelta(days=i))
+        if self.cache_path:
+            self._save_cache(start_date)
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path) as cache_file:
+                cache = json.load(cache_file)
+        except (IOError, ValueError) as e:
+            log.info('No usable twilight cache at {}: {}'.format(self.cache_path, e))
+            return
+        if cache.get('lat') != self.lat or cache.get('lon') != self.lon:
+            log.info('Twilight cache at {} is for a different location, ignoring it'.format(self.cache_path))
+            return
+        for day, twilight in cache['days'].items():
+            self.table[datetime.strptime(day, '%Y-%m-%d').date()] = tuple(twilight) if twilight else None
+        log.info('Loaded {} day(s) from twilight cache {}'.format(len(cache['days']), self.cache_path))
+
+    def _save_cache(self, start_date):
+        days = {}
+        for i in range(self.cache_days):
+            date = start_date + timedelta(days=i)
+            days[date.isoformat()] = self.get(date)
+        try:
+            write_json_atomically(self.cache_path, {'lat': self.lat, 'lon': self.lon, 'days': days})
+        except (IOError, OSError) as e:
+            log.error('Unable to write twilight cache {}: {}'.format(self.cache_path, e))
@@ -0,0 +1,203 @@
+from array import array
+from collections import deque
+import json
+import logging
+from threading import Lock
+
+from checkpoint import write_json_atomically
+from utils import clock
+
+
+log = logging.getLogger(__name__)
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+
+class TravelTimes(object):
+    bucket_secs = 0.1
+    # travel times compared against the baseline, more than one so a single slow cycle doesn't warn
+    recent_size = 3
+    # samples needed before the histogram is trusted to set the timeout
+    min_samples = 10
+    min_timeout_secs = 2.0
+
+    def __init__(self, max_secs, baseline_size=20, drift=0.25, timeout_factor=1.5):
+        self.max_secs = max_secs
+        self.drift = drift
+        self.timeout_factor = timeout_factor
+        self.bucket_count = int(max_secs / self.bucket_secs) + 1
+        self.histograms = {}
+        self.samples = {}
+        self.baseline_size = baseline_size
+
+    def _histogram(self, motion):
+        if motion not in self.histograms:
+            self.histograms[motion] = array('L', [0]) * self.bucket_count
+            self.samples[motion] = deque(maxlen=self.baseline_size + self.recent_size)
+        return self.histograms[motion]
+
+    def record(self, motion, secs):
+        # returns (recent, baseline) when the recent travel times drifted away from the baseline, otherwise None
+        histogram = self._histogram(motion)
+        histogram[min(int(secs / self.bucket_secs), self.bucket_count - 1)] += 1
+        samples = self.samples[motion]
+        samples.append(secs)
+        if len(samples) < self.recent_size + self.min_samples // 2:
+            return None
+        samples = list(samples)
+        baseline = median(samples[:-self.recent_size])
+        recent = median(samples[-self.recent_size:])
+        if abs(recent - baseline) > baseline * self.drift:
+            return recent, baseline
+        return None
+
+    def count(self, motion):
+        return sum(self.histograms.get(motion, ()))
+
+    def percentile(self, motion, percent):
+        histogram = self.histograms.get(motion)
+        total = self.count(motion)
+        if not total:
+            return None
+        seen = 0
+        for i, bucket in enumerate(histogram):
+            seen += bucket
+            if seen * 100.0 >= total * percent:
+                return (i + 1) * self.bucket_secs
+        return self.max_secs
+
+    def timeout(self, motion):
+        # generous margin over the slowest travel times seen, never longer than the configured maximum
+        if self.count(motion) < self.min_samples:
+            return self.max_secs
+        p99 = self.percentile(motion, 99)
+        return min(self.max_secs, max(self.min_timeout_secs, p99 * self.timeout_factor))
+
+    def summary(self, motion):
+        if not self.count(motion):
+            return '{} no data'.format(motion)
+        return '{} n={} median {:.1f}s p99 {:.1f}s timeout {:.1f}s'.format(
+            motion, self.count(motion), self.percentile(motion, 50), self.percentile(motion, 99), self.timeout(motion))
+
+
+class DutyCycle(object):
+    # hourly buckets, enough for "today" and "yesterday" at any time of the day
+    hours = 48
+
+    def __init__(self, watts=0):
+        self.watts = watts
+        self.hour_stamps = array('l', [-1]) * self.hours
+        self.hour_on_secs = array('d', [0.0]) * self.hours
+        self.hour_switches = array('L', [0]) * self.hours
+        self.total_on_secs = 0.0
+        self.total_switches = 0
+        self.on_since = None
+        self.lock = Lock()
+
+    def _slot(self, hour):
+        i = hour % self.hours
+        if self.hour_stamps[i] != hour:
+            self.hour_stamps[i] = hour
+            self.hour_on_secs[i] = 0.0
+            self.hour_switches[i] = 0
+        return i
+
+    def _add_on_time(self, start, end):
+        while start < end:
+            hour = int(start // 3600)
+            chunk_end = min(end, (hour + 1) * 3600)
+            self.hour_on_secs[self._slot(hour)] += chunk_end - start
+            self.total_on_secs += chunk_end - start
+            start = chunk_end
+
+    def _flush(self, now):
+        # account for the on period in progress, so reports and saved totals are up to date
+        if self.on_since is not None:
+            self._add_on_time(self.on_since, now)
+            self.on_since = now
+
+    def record(self, on, now=None):
+        now = clock.time() if now is None else now
+        with self.lock:
+            if on == (self.on_since is not None):
+                return
+            self._flush(now)
+            self.on_since = now if on else None
+            self.hour_switches[self._slot(int(now // 3600))] += 1
+            self.total_switches += 1
+
+    def _since(self, values, hours_back, now):
+        first_hour = int(now // 3600) - hours_back + 1
+        return sum(value for stamp, value in zip(self.hour_stamps, values) if stamp >= first_hour)
+
+    def on_secs(self, hours_back=24, now=None):
+        now = clock.time() if now is None else now
+        with self.lock:
+            self._flush(now)
+            return self._since(self.hour_on_secs, hours_back, now)
+
+    def switches(self, hours_back=24, now=None):
+        now = clock.time() if now is None else now
+        with self.lock:
+            return self._since(self.hour_switches, hours_back, now)
+
+    def energy_kwh(self, on_secs):
+        return on_secs / 3600.0 * self.watts / 1000.0
+
+    def summary(self, now=None):
+        on_secs = self.on_secs(24, now)
+        return 'on {:.0f}% of the last hour, {:.1f}h and {} switches in the last 24h, ' \
+               '{:.2f} kWh ({:.1f} kWh total)'.format(self.on_secs(1, now) / 36.0,
+                                                      on_secs / 3600.0,
+                                                      self.switches(24, now),
+                                                      self.energy_kwh(on_secs),
+                                                      self.energy_kwh(self.total_on_secs))
+
+    def to_dict(self, now=None):
+        now = clock.time() if now is None else now
+        with self.lock:
+            self._flush(now)
+            return {
+                'hour_stamps': list(self.hour_stamps),
+                'hour_on_secs': list(self.hour_on_secs),
+                'hour_switches': list(self.hour_switches),
+                'total_on_secs': self.total_on_secs,
+                'total_switches': self.total_switches,
+            }
+
+    def load(self, saved):
+        if not len(saved['hour_stamps']) == len(saved['hour_on_secs']) == len(saved['hour_switches']) == self.hours:
+            raise ValueError('expected {} hourly buckets'.format(self.hours))
+        with self.lock:
+            self.hour_stamps = array('l', saved['hour_stamps'])
+            self.hour_on_secs = array('d', saved['hour_on_secs'])
+            self.hour_switches = array('L', saved['hour_switches'])
+            self.total_on_secs = saved['total_on_secs']
+            self.total_switches = saved['total_switches']
+
+
+def save_duty_cycles(path, duty_cycles):
+    saved = dict((name, duty_cycle.to_dict()) for name, duty_cycle in duty_cycles.items())
+    try:
+        write_json_atomically(path, saved)
+    except (IOError, OSError) as e:
+        log.error('Unable to save duty cycles to {}: {}'.format(path, e))
+
+
+def load_duty_cycles(path, duty_cycles):
+    try:
+        with open(path) as state_file:
+            saved = json.load(state_file)
+    except (IOError, ValueError) as e:
+        log.info('No saved duty cycles at {}: {}'.format(path, e))
+        return
+    for name, duty_cycle in duty_cycles.items():
+        if name in saved:
+            try:
+                duty_cycle.load(saved[name])
+            except (KeyError, TypeError, ValueError, OverflowError) as e:
+                log.warning('Ignoring saved duty cycle for {}: {}'.format(name, e))
@@ -1,6 +1,8 @@
 import logging
-from threading import Event, Thread
+from threading import Event, Thread, Timer
+from time import sleep, time
 
+import arrow
 from web.db import database
 
 
@@ -28,6 +30,39 @@ class StoppableThread(Thread):
         return self._stop_event.is_set()
 
 
+class Clock(object):
+    def time(self):
+        return time()
+
+    def utcnow(self):
+        return arrow.utcnow()
+
+    def sleep(self, secs):
+        sleep(secs)
+
+    def timer(self, secs, func, args=()):
+        timer = Timer(secs, func, args=args)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+
+class ClockProxy(object):
+    # the control logic reads the time through `clock`, so a simulation can swap in a virtual one
+    def __init__(self, source):
+        self.source = source
+
+    def __getattr__(self, name):
+        return getattr(self.source, name)
+
+
+clock = ClockProxy(Clock())
+
+
+def set_clock(source):
+    clock.source = source
+
+
 def format_temp(temp):
     return u'{:.1f} \N{DEGREE SIGN}F'.format(temp) if isinstance(temp, float) else '???'
 
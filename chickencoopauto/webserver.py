@@ -0,0 +1,87 @@
+from functools import wraps
+import logging
+import Queue
+import socket
+import sys
+from threading import BoundedSemaphore, Lock
+
+import web
+from web import wsgiserver
+from web.httpserver import LogMiddleware, StaticMiddleware
+
+from coop import Coop
+
+
+log = logging.getLogger(__name__)
+
+_route_semaphores = {}
+_route_semaphores_lock = Lock()
+
+
+class BoundedThreadPool(wsgiserver.ThreadPool):
+    def __init__(self, server, threads, queue_size):
+        super(BoundedThreadPool, self).__init__(server, min=threads, max=threads)
+        self._queue = Queue.Queue(queue_size)
+        self.get = self._queue.get
+
+    def put(self, obj):
+        if obj is wsgiserver._SHUTDOWNREQUEST:
+            self._queue.put(obj)
+            return
+        try:
+            self._queue.put_nowait(obj)
+        except Queue.Full:
+            log.warning('Request queue full, rejecting request from {}'.format(obj.remote_addr))
+            try:
+                obj.socket.sendall('HTTP/1.1 503 Service Unavailable\r\n'
+                                   'Retry-After: 5\r\n'
+                                   'Content-Length: 0\r\n'
+                                   'Connection: close\r\n\r\n')
+            except socket.error:
+                pass
+            obj.close()
+
+
+def serve(app, config):
+    if config['SERVER'] == 'simple':
+        app.run()
+        return
+
+    server_address = web.validip(web.listget(sys.argv, 1, ''))
+    server = wsgiserver.CherryPyWSGIServer(
+        server_address,
+        LogMiddleware(StaticMiddleware(app.wsgifunc())),
+        numthreads=config['WORKER_THREADS'],
+        server_name='localhost',
+        request_queue_size=config['REQUEST_QUEUE_SIZE']
+    )
+    server.requests = BoundedThreadPool(server, config['WORKER_THREADS'], config['REQUEST_QUEUE_SIZE'])
+    log.info('Web server listening on {}:{} with {} worker threads'.format(
+        server_address[0], server_address[1], config['WORKER_THREADS']))
+    try:
+        server.start()
+    except (KeyboardInterrupt, SystemExit):
+        server.stop()
+
+
+def _get_route_semaphore(config_key):
+    with _route_semaphores_lock:
+        if config_key not in _route_semaphores:
+            _route_semaphores[config_key] = BoundedSemaphore(Coop().config['Web'][config_key])
+        return _route_semaphores[config_key]
+
+
+def limit_concurrency(config_key):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            semaphore = _get_route_semaphore(config_key)
+            if not semaphore.acquire(False):
+                log.info('Too many concurrent requests for {}, rejecting'.format(web.ctx.path))
+                raise web.HTTPError('503 Service Unavailable', {'Retry-After': '10'}, 'Busy, please try again later')
+            try:
+                return func(*args, **kwargs)
+            finally:
+                semaphore.release()
+        return wrapper
+    return decorator
@@ -1,17 +1,18 @@
 import logging
-from logging.handlers import RotatingFileHandler
+import Queue
 import signal
 import sys
-import thread
 
 from web import application
 
 from chickencoopauto.coop import Coop
+from chickencoopauto.logs import BatchedRotatingFileHandler, QueueHandler, QueueListener, RateLimitFilter
+from chickencoopauto.webserver import serve
 
 
 log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-log_filehandler = RotatingFileHandler('/var/log/chickencoop/coop.log', maxBytes=1024**2, backupCount=100)
+log_filehandler = BatchedRotatingFileHandler('/var/log/chickencoop/coop.log', maxBytes=1024**2, backupCount=100)
 log_filehandler.setFormatter(log_formatter)
 log_filehandler.setLevel(logging.DEBUG)
 
@@ -21,9 +22,13 @@ log_consolehandler.setLevel(logging.DEBUG)
 
 logging.getLogger('web').setLevel(logging.ERROR)
 
+# records are only queued on the calling thread, the listener formats and writes them in batches
+log_queuehandler = QueueHandler(Queue.Queue(10000))
+log_queuehandler.addFilter(RateLimitFilter(60))
+log_listener = QueueListener(log_queuehandler, [log_filehandler, log_consolehandler])
+
 log = logging.getLogger('chickencoopauto')
-log.addHandler(log_filehandler)
-log.addHandler(log_consolehandler)
+log.addHandler(log_queuehandler)
 log.setLevel(logging.DEBUG)
 
 urls = (
@@ -49,20 +54,30 @@ def sigterm_handler(_, __):
     log.info('SIGTERM, shutting down')
     coop = Coop()
     coop.shutdown()
+    log_listener.stop()
     sys.exit(0)
 
 
+def sighup_handler(_, __):
+    log.info('SIGHUP, reloading configuration')
+    coop = Coop()
+    coop.commands.submit('Configuration', coop.reload_config)
+
+
 if __name__ == '__main__':
+    log_listener.start()
     signal.signal(signal.SIGTERM, sigterm_handler)
     coop = Coop()
     coop.initialize_sensors_relays()
+    signal.signal(signal.SIGHUP, sighup_handler)
 
     app = application(urls, globals())
 
     try:
         coop.start()
-        thread.start_new_thread(app.run(), ())
+        serve(app, coop.config['Web'])
         while coop.isAlive():
             coop.join(60)
     finally:
         coop.shutdown()
+        log_listener.stop()
@@ -0,0 +1,58 @@
+import argparse
+import os
+import sys
+import timeit
+
+import arrow
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chickencoopauto.sensors import SunriseSunsetSensor  # noqa: E402
+
+
+class _Coop(object):
+    def notifier_callback(self, notification):
+        pass
+
+
+def legacy_go_day(sensor):
+    # day/night check as it was done before the sensor kept epoch thresholds
+    if sensor.last:
+        now = arrow.utcnow()
+        if now.to('US/Eastern').date() < sensor.sunrise.to('US/Eastern').date():
+            return False
+        else:
+            after_sunrise = now.to('US/Eastern') > \
+                sensor.sunrise.to('US/Eastern').shift(minutes=sensor.extra_min_sunrise)
+            before_sunset = now.to('US/Eastern') < \
+                sensor.sunset.to('US/Eastern').shift(minutes=sensor.extra_min_sunset)
+            return after_sunrise and before_sunset
+    else:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmark of the sunrise/sunset day/night check')
+    parser.add_argument('-n', '--number', type=int, default=10000, help='calls per measurement')
+    parser.add_argument('--lat', type=float, default=42.36)
+    parser.add_argument('--lon', type=float, default=-71.06)
+    args = parser.parse_args()
+
+    sensor = SunriseSunsetSensor(_Coop(), 'Sunrise/Sunset Sensor', args.lat, args.lon,
+                                 extra_min_sunrise=10, extra_min_sunset=-10)
+    sensor.read_sensor()
+    assert legacy_go_day(sensor) == sensor.go_day()
+
+    results = [
+        ('before: arrow timezone conversions', lambda: legacy_go_day(sensor)),
+        ('after: epoch comparisons', sensor.go_day),
+        ('after: go_night', sensor.go_night),
+        ('after: read_sensor (no refresh due)', sensor.read_sensor),
+    ]
+    for name, func in results:
+        best = min(timeit.repeat(func, number=args.number, repeat=3))
+        print('{:40s} {:8.2f} us/call'.format(name, best / args.number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
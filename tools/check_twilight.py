@@ -0,0 +1,111 @@
+import argparse
+import ConfigParser
+import csv
+import json
+import os
+import sys
+from datetime import timedelta
+
+import arrow
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chickencoopauto.solar import civil_twilight  # noqa: E402
+
+
+API_URL = 'https://api.sunrise-sunset.org/json?lat={lat}&lng={lon}&date={date}&formatted=0'
+REFERENCE_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'twilight_reference.csv')
+
+
+def recorded_location(path):
+    # from a '# location: lat,lon' header line
+    with open(path) as csv_file:
+        for line in csv_file:
+            if line.startswith('# location:'):
+                lat, lon = line.split(':', 1)[1].split(',')
+                return float(lat), float(lon)
+    return None, None
+
+
+def recorded_results(path):
+    # CSV rows: date,civil_twilight_begin,civil_twilight_end as returned by api.sunrise-sunset.org
+    with open(path) as csv_file:
+        for row in csv.reader(csv_file):
+            if row and not row[0].startswith('#'):
+                yield arrow.get(row[0]).date(), arrow.get(row[1]).timestamp, arrow.get(row[2]).timestamp
+
+
+def fetched_results(lat, lon, start, days):
+    for i in range(days):
+        date = start + timedelta(days=i)
+        response = requests.get(API_URL.format(lat=lat, lon=lon, date=date.isoformat()), timeout=30)
+        response.raise_for_status()
+        data = json.loads(response.text)
+        if data['status'] == 'OK':
+            yield (date,
+                   arrow.get(data['results']['civil_twilight_begin']).timestamp,
+                   arrow.get(data['results']['civil_twilight_end']).timestamp)
+
+
+def recording(results, path, lat, lon):
+    with open(path, 'w') as csv_file:
+        csv_file.write('# Civil twilight recorded from api.sunrise-sunset.org on {}\n'.format(
+            arrow.utcnow().format('YYYY-MM-DD')))
+        csv_file.write('# location: {},{}\n'.format(lat, lon))
+        writer = csv.writer(csv_file, lineterminator='\n')
+        for date, begin, end in results:
+            writer.writerow([date.isoformat(), arrow.get(begin).isoformat(), arrow.get(end).isoformat()])
+            yield date, begin, end
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare computed civil twilight times with recorded or fetched '
+                                                 'sunrise-sunset API results')
+    parser.add_argument('--config', default='config.ini', help='read LAT/LON/TIMEZONE from this file when fetching')
+    parser.add_argument('--lat', type=float)
+    parser.add_argument('--lon', type=float)
+    parser.add_argument('--csv', default=REFERENCE_CSV,
+                        help='recorded results, at the location in their header (default: %(default)s)')
+    parser.add_argument('--fetch', action='store_true', help='fetch results from the API instead')
+    parser.add_argument('--record', help='with --fetch, also save the results to this CSV file')
+    parser.add_argument('--days', type=int, default=30, help='days to fetch from the API, starting today')
+    parser.add_argument('--tolerance', type=int, default=60, help='maximum allowed difference in seconds')
+    args = parser.parse_args()
+    if args.record and not args.fetch:
+        parser.error('--record needs --fetch')
+
+    lat, lon = args.lat, args.lon
+    timezone = 'UTC'
+    if args.fetch and (lat is None or lon is None):
+        config = ConfigParser.ConfigParser()
+        config.read(args.config)
+        lat, lon = config.getfloat('Main', 'LAT'), config.getfloat('Main', 'LON')
+        timezone = config.get('Main', 'TIMEZONE')
+    elif not args.fetch and (lat is None or lon is None):
+        lat, lon = recorded_location(args.csv)
+        if lat is None:
+            parser.error('{} has no location header, pass --lat and --lon'.format(args.csv))
+
+    if args.fetch:
+        results = fetched_results(lat, lon, arrow.utcnow().to(timezone).date(), args.days)
+        if args.record:
+            results = recording(results, args.record, lat, lon)
+    else:
+        results = recorded_results(args.csv)
+
+    worst = 0
+    count = 0
+    for date, begin, end in results:
+        computed_begin, computed_end = civil_twilight(date, lat, lon)
+        diff_begin, diff_end = computed_begin - begin, computed_end - end
+        worst = max(worst, abs(diff_begin), abs(diff_end))
+        count += 1
+        print('{}  begin {:+4d}s  end {:+4d}s'.format(date.isoformat(), diff_begin, diff_end))
+
+    print('{} day(s) checked, largest difference {}s'.format(count, worst))
+    return 0 if count and worst <= args.tolerance else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
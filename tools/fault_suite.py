@@ -0,0 +1,123 @@
+import argparse
+import errno
+import logging
+import socket
+import sys
+from time import time
+
+import psycopg2
+
+from faults import Fault, FaultSimulation
+from w1thermsensor.errors import NoSensorFoundError
+
+
+SCENARIOS = [
+    ('baseline', None, None),
+    ('db slow', 'db', lambda: Fault(latency=0.2)),
+    ('db down', 'db', lambda: Fault(error=psycopg2.OperationalError('could not connect to server'))),
+    ('db hung', 'db', lambda: Fault(hang=True)),
+    ('smtp slow', 'smtp', lambda: Fault(latency=0.2)),
+    ('smtp down', 'smtp', lambda: Fault(error=socket.error(errno.ECONNREFUSED, 'Connection refused'))),
+    ('smtp hung', 'smtp', lambda: Fault(hang=True)),
+    ('dht slow', 'dht', lambda: Fault(latency=1.0)),
+    ('dht dead', 'dht', lambda: Fault(error=IOError('DHT22 not responding'))),
+    ('probe missing', 'probe', lambda: Fault(error=NoSensorFoundError('Sensor not found'))),
+    ('probe hung', 'probe', lambda: Fault(hang=True)),
+]
+
+
+class LatencyRecorder(object):
+    def __init__(self, sim):
+        self.sim = sim
+        self.started = sim.clock.time()
+        self.max_cycle_secs = 0.0
+        self.door_latencies = []
+        self.door_events = len(sim.world.door_events)
+
+    def on_cycle(self, sim, cycle_secs):
+        # what the loop would see: the time it computed plus the time it spent waiting
+        self.max_cycle_secs = max(self.max_cycle_secs, sim.clock.time() - sim.cycle_started + cycle_secs)
+        sunrise_sunset = sim.coop.sunset_sunrise_sensor
+        for motion, started, travel in sim.world.door_events[self.door_events:]:
+            due = sunrise_sunset.sunrise_ts if motion == 'opening' else sunrise_sunset.sunset_ts
+            # a door that should have moved before the run started isn't late
+            if due >= self.started:
+                self.door_latencies.append(started - due)
+        self.door_events = len(sim.world.door_events)
+
+
+def run_scenario(args, target, make_fault):
+    sim = FaultSimulation(args.start, seed=args.seed, dht_failure=0.0, config_overrides={
+        ('Notifications', 'EMAIL'): True,
+    })
+    recorder = LatencyRecorder(sim)
+    try:
+        sim.run(args.warmup * 3600, recorder.on_cycle)
+        if target is not None:
+            sim.faults.inject(target, make_fault())
+        sim.run(args.days * 86400, recorder.on_cycle)
+        # everything that queued up while it was down should get through once it recovers
+        sim.faults.clear()
+        sim.run(args.recovery * 3600, recorder.on_cycle)
+    finally:
+        sim.shutdown()
+    return sim, recorder
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inject database, SMTP and sensor faults into the simulated '
+                                                 'coop and check the control loop keeps to its latency bounds')
+    parser.add_argument('--days', type=float, default=1, help='days to run with each fault')
+    parser.add_argument('--warmup', type=float, default=1, help='hours to run before injecting the fault')
+    parser.add_argument('--recovery', type=float, default=1, help='hours to run after clearing the fault')
+    parser.add_argument('--start', default='2024-03-01', help='first simulated day (UTC)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--max-cycle', type=float, default=10.0, help='upper bound for a cycle, in seconds')
+    parser.add_argument('--max-door-latency', type=float, default=15.0,
+                        help='upper bound between sunrise/sunset and the door starting to move, in seconds')
+    parser.add_argument('scenarios', nargs='*', help='scenarios to run, all of them by default')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    scenarios = [scenario for scenario in SCENARIOS if not args.scenarios or scenario[0] in args.scenarios]
+    if not scenarios:
+        parser.error('no such scenario, expected some of: {}'.format(', '.join(name for name, _, _ in SCENARIOS)))
+
+    print('{:14s} {:>9s} {:>13s} {:>7s} {:>8s} {:>8s} {:>7s} {:>7s}  {}'.format(
+        'scenario', 'max cycle', 'door latency', 'calls', 'db rows', 'dropped', 'emails', 'wall', 'result'))
+    failed = []
+    for name, target, make_fault in scenarios:
+        started = time()
+        sim, recorder = run_scenario(args, target, make_fault)
+        door_latency = max(recorder.door_latencies) if recorder.door_latencies else None
+        problems = []
+        if recorder.max_cycle_secs > args.max_cycle:
+            problems.append('cycle')
+        if target is not None and not sim.faults.triggered[target]:
+            # nothing in the coop went through the fault, the scenario tested nothing
+            problems.append('not triggered')
+        if door_latency is None or door_latency > args.max_door_latency:
+            problems.append('door')
+        dispatcher = sim.coop.email_dispatcher
+        # held while the server was down, they must all have gone out once it came back
+        if dispatcher.pending or dispatcher.queue.qsize() or dispatcher.dropped:
+            problems.append('email')
+        if problems:
+            failed.append(name)
+        print('{:14s} {:8.2f}s {:>13s} {:7d} {:8d} {:8d} {:7d} {:6.1f}s  {}'.format(
+            name, recorder.max_cycle_secs,
+            '{:.1f}s ({})'.format(door_latency, len(recorder.door_latencies)) if door_latency is not None else 'none',
+            sim.faults.calls[target] if target else 0, sum(sim.db.rows.values()), sim.coop.db_log.dropped,
+            sim.faults.emails, time() - started, 'FAIL ({})'.format(', '.join(problems)) if problems else 'ok'))
+        sys.stdout.flush()
+
+    if failed:
+        print('Bounds exceeded in: {}'.format(', '.join(failed)))
+        sys.exit(1)
+    print('Cycles within {:g}s, door moves within {:g}s of sunrise/sunset and no email lost under every fault'.format(
+        args.max_cycle, args.max_door_latency))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+from collections import Counter
+from functools import partial
+import smtplib
+from threading import Event, Thread
+from time import sleep
+from types import ModuleType
+
+from simulation import Adafruit_DHT, Simulation, W1ThermSensor
+from chickencoopauto import dblog, mailer
+
+
+class Fault(object):
+    # every call waits latency seconds, then blocks until released if hang, then raises error
+    def __init__(self, latency=0.0, error=None, hang=False):
+        self.latency = latency
+        self.error = error
+        self.hang = hang
+        self.released = Event()
+
+    def apply(self, sleep=sleep):
+        if self.latency:
+            sleep(self.latency)
+        if self.hang:
+            self.released.wait()
+        if self.error is not None:
+            raise self.error
+
+    def release(self):
+        self.released.set()
+
+
+class FaultyDB(object):
+    def __init__(self, injector, db):
+        self.injector = injector
+        self.db = db
+
+    def multiple_insert(self, table, values):
+        self.injector.call('db')
+        self.db.multiple_insert(table, values)
+
+
+class FaultySMTP(object):
+    # stands in for smtplib.SMTP and SMTP_SSL, connecting and sending both go through the smtp fault
+    def __init__(self, injector, host, port, timeout=None):
+        self.injector = injector
+        injector.call('smtp')
+
+    def ehlo(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        self.injector.call('smtp')
+        self.injector.emails += 1
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FaultInjector(object):
+    # dht faults run on the control loop and sleep on the virtual clock, the others run on the coop's own threads
+    targets = ('db', 'smtp', 'dht', 'probe')
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.faults = {}
+        self.calls = Counter()
+        # calls that hit an injected fault
+        self.triggered = Counter()
+        self.emails = 0
+        self.restore = []
+        self._install()
+
+    def inject(self, target, fault):
+        if target not in self.targets:
+            raise ValueError('Unknown fault target {}, expected one of {}'.format(target, ', '.join(self.targets)))
+        if target == 'dht' and fault.hang:
+            # the driver bit-bangs the read with its own timeouts, and nothing would ever release the loop
+            raise ValueError('The DHT22 read cannot hang')
+        self.clear(target)
+        self.faults[target] = fault
+
+    def clear(self, target=None):
+        for name in [target] if target else list(self.faults):
+            fault = self.faults.pop(name, None)
+            if fault is not None:
+                fault.release()
+
+    def call(self, target, sleep=sleep):
+        self.calls[target] += 1
+        fault = self.faults.get(target)
+        if fault is not None:
+            self.triggered[target] += 1
+            fault.apply(sleep)
+
+    def _patch(self, owner, name, value):
+        self.restore.append((owner, name, getattr(owner, name)))
+        setattr(owner, name, value)
+
+    def _install(self):
+        get_db = dblog.get_db
+        self._patch(dblog, 'get_db', lambda coop: FaultyDB(self, get_db(coop)))
+
+        smtp = ModuleType('smtplib')
+        for name in ('SMTPException', 'SMTPResponseException', 'SMTPRecipientsRefused'):
+            setattr(smtp, name, getattr(smtplib, name))
+        smtp.SMTP = smtp.SMTP_SSL = partial(FaultySMTP, self)
+        self._patch(mailer, 'smtplib', smtp)
+
+        read_dht = Adafruit_DHT.source
+
+        def dht_source():
+            try:
+                self.call('dht', self.sim.clock.sleep)
+            except Exception:
+                # the driver reports a failed read as None, None
+                return None, None
+            return read_dht()
+        self._patch(Adafruit_DHT, 'source', dht_source)
+
+        self._patch(W1ThermSensor, 'sources', dict(
+            (sensor_id, partial(self._read_probe, source)) for sensor_id, source in W1ThermSensor.sources.items()))
+
+    def _read_probe(self, source):
+        self.call('probe')
+        return source()
+
+    def uninstall(self):
+        self.clear()
+        while self.restore:
+            owner, name, value = self.restore.pop()
+            setattr(owner, name, value)
+
+
+class FaultSimulation(Simulation):
+    def __init__(self, *args, **kwargs):
+        super(FaultSimulation, self).__init__(*args, **kwargs)
+        self.faults = FaultInjector(self)
+        self.probe_reader = None
+        # the dispatcher waits on the wall clock, while a simulated day takes a few seconds
+        dispatcher = self.coop.email_dispatcher
+        dispatcher.initial_backoff_secs = dispatcher.retry_secs = 0.01
+        dispatcher.max_backoff_secs = 0.1
+
+    def read_probes(self):
+        # as on the coop's bus thread, a hung probe only leaves its reading to go stale
+        if self.probe_reader is None or not self.probe_reader.is_alive():
+            self.probe_reader = Thread(target=super(FaultSimulation, self).read_probes, name='1-Wire reader')
+            self.probe_reader.daemon = True
+            self.probe_reader.start()
+
+    def shutdown(self):
+        # the coop flushes its queues on the way out, through the patched clients so that they are counted
+        self.faults.clear()
+        super(FaultSimulation, self).shutdown()
+        self.faults.uninstall()
@@ -0,0 +1,75 @@
+import argparse
+import logging
+import os
+import re
+import sys
+from time import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chickencoopauto.backends import EmailBackend  # noqa: E402
+from chickencoopauto.mailer import EmailDispatcher  # noqa: E402
+from chickencoopauto.notifications import Notification  # noqa: E402
+from smtpsink import SMTPSink  # noqa: E402
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure notification delivery through a local SMTP sink')
+    parser.add_argument('-n', '--count', type=int, default=500, help='notifications to send')
+    parser.add_argument('--sms', action='store_true', help='also send every notification to an SMS address')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for delivery')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    sink = SMTPSink()
+    sink.start()
+    dispatcher = EmailDispatcher(sink.host, sink.port, 'coop@example.com', '', use_ssl=False)
+    dispatcher.start()
+    backends = [EmailBackend('Email', 'INFO', dispatcher, 'a@example.com,b@example.com', queue_size=args.count)]
+    if args.sms:
+        backends.append(EmailBackend('SMS', 'INFO', dispatcher, 'number@example.com', queue_size=args.count))
+    for backend in backends:
+        backend.start()
+
+    submitted = {}
+    start = time()
+    for i in range(args.count):
+        notification = Notification('WARN', 'Benchmark notification #{i}', i=i)
+        submitted[i] = time()
+        for backend in backends:
+            backend.submit(notification)
+    submit_secs = time() - start
+
+    expected = args.count * len(backends)
+    delivered = sink.wait_for(expected, args.timeout)
+    total_secs = time() - start
+
+    latencies = []
+    for received, _, _, data in sink.messages:
+        match = re.search(r'#(\d+)', data)
+        if match:
+            latencies.append(received - submitted[int(match.group(1))])
+
+    for backend in backends:
+        backend.stop()
+    dispatcher.stop()
+    sink.stop()
+
+    print('messages:        {} of {} delivered{}'.format(
+        len(sink.messages), expected, '' if delivered else ' (timed out)'))
+    print('submit time:     {:.1f} us per notification'.format(submit_secs / args.count * 1e6))
+    print('throughput:      {:.1f} messages/s'.format(len(sink.messages) / total_secs))
+    if latencies:
+        print('latency p50:     {:.1f} ms'.format(percentile(latencies, 50) * 1000))
+        print('latency p95:     {:.1f} ms'.format(percentile(latencies, 95) * 1000))
+        print('latency max:     {:.1f} ms'.format(max(latencies) * 1000))
+    return 0 if delivered else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,169 @@
+import argparse
+import calendar
+import ConfigParser
+import csv
+from itertools import chain
+import logging
+import sys
+from time import time
+
+import arrow
+import psycopg2
+
+from simulation import GPIO, Simulation, World
+from chickencoopauto.backends import NotificationBackend
+
+
+REPLAYED_TYPES = ('AMBIENT_TEMP', 'AMBIENT_HUMI', 'WATER_TEMP', 'DOOR_OPENING', 'DOOR_CLOSING')
+
+QUERY = '''
+    SELECT log_type, log_value, created FROM coop_log
+    WHERE log_type IN %(log_types)s AND created >= %(start)s AND created < %(end)s
+    ORDER BY created
+'''
+
+
+def stream_rows(connection, log_types, start, end, batch_size):
+    # a named cursor keeps the result set on the server, only batch_size rows are fetched at a time
+    cursor = connection.cursor(name='coop_replay')
+    cursor.itersize = batch_size
+    cursor.execute(QUERY, {'log_types': tuple(log_types), 'start': start, 'end': end})
+    try:
+        for log_type, log_value, created in cursor:
+            try:
+                value = float(log_value)
+            except ValueError:
+                continue
+            yield log_type, value, calendar.timegm(created.utctimetuple()) + created.microsecond / 1e6
+    finally:
+        cursor.close()
+
+
+class ReplayWorld(World):
+    # readings come from coop_log instead of the weather model, each one held until the next is logged
+    def __init__(self, *args, **kwargs):
+        super(ReplayWorld, self).__init__(*args, **kwargs)
+        self.ambient_temp = None
+        self.ambient_humi = None
+        self.water_temp = None
+
+    def apply(self, log_type, value):
+        if log_type == 'AMBIENT_TEMP':
+            self.ambient_temp = value
+        elif log_type == 'AMBIENT_HUMI':
+            self.ambient_humi = value
+        elif log_type == 'WATER_TEMP':
+            self.water_temp = value
+        elif log_type in ('DOOR_OPENING', 'DOOR_CLOSING'):
+            self.door_travel_secs = value
+
+    def read_dht(self):
+        if self.ambient_temp is None or self.ambient_humi is None:
+            return None, None
+        return self.ambient_humi, (self.ambient_temp - 32.0) / 1.8
+
+    def read_water_probe(self):
+        return self.water_temp
+
+    def step(self, secs):
+        self.step_water_level(self.clock.time(), secs)
+
+
+class TimelineBackend(NotificationBackend):
+    def __init__(self, timeline):
+        super(TimelineBackend, self).__init__('Timeline', 'INFO')
+        self.timeline = timeline
+
+    def submit(self, notification):
+        self.timeline.write('notification', notification.severity, notification.message)
+
+    def deliver(self, notification):
+        pass
+
+
+class Timeline(object):
+    def __init__(self, sim, output):
+        self.sim = sim
+        self.writer = csv.writer(output)
+        self.writer.writerow(['time', 'kind', 'name', 'value'])
+        self.relay_names = dict((relay.port, relay.name.rstrip(': ')) for relay in sim.coop.relay_module.values())
+        self.levels = {}
+        self.rows = 0
+        GPIO.output_listeners.append(self.relay_output)
+        sim.coop.register_notification_backend(TimelineBackend(self))
+
+    def relay_output(self, port, level):
+        if port in self.relay_names and self.levels.get(port) != level:
+            self.levels[port] = level
+            self.write('relay', self.relay_names[port], 'on' if level else 'off')
+
+    def write(self, kind, name, value):
+        self.writer.writerow([self.sim.local(self.sim.clock.time()).format('YYYY-MM-DD HH:mm:ss'), kind, name,
+                              value.encode('utf-8') if isinstance(value, unicode) else value])
+        self.rows += 1
+
+
+def replay(sim, rows):
+    replayed = 0
+    for log_type, value, timestamp in rows:
+        if timestamp > sim.clock.time():
+            sim.run(timestamp - sim.clock.time())
+        sim.world.apply(log_type, value)
+        replayed += 1
+    return replayed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay coop_log readings through the control logic and print '
+                                                 'the resulting relay and notification timeline as CSV')
+    parser.add_argument('--config', default='config.ini',
+                        help='thresholds to replay with, and the database credentials')
+    parser.add_argument('--start', default='2000-01-01', help='first day to replay (UTC)')
+    parser.add_argument('--end', default=arrow.utcnow().format('YYYY-MM-DD'), help='day after the last one (UTC)')
+    parser.add_argument('--host', help='PostgreSQL host, the local socket by default')
+    parser.add_argument('--port', type=int, default=5432)
+    parser.add_argument('--dbname', default='coop')
+    parser.add_argument('--batch-size', type=int, default=5000, help='rows fetched per round trip')
+    parser.add_argument('-o', '--output', help='timeline CSV file, stdout by default')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    config = ConfigParser.ConfigParser()
+    if not config.read(args.config):
+        parser.error('unable to read {}'.format(args.config))
+
+    connection = psycopg2.connect(host=args.host, port=args.port, dbname=args.dbname,
+                                  user=config.get('Database', 'USERNAME'),
+                                  password=config.get('Database', 'PASSWORD'))
+    output = open(args.output, 'wb') if args.output else sys.stdout
+    try:
+        rows = stream_rows(connection, REPLAYED_TYPES, arrow.get(args.start).naive, arrow.get(args.end).naive,
+                           args.batch_size)
+        first = next(rows, None)
+        if first is None:
+            sys.stderr.write('No readings between {} and {}\n'.format(args.start, args.end))
+            return
+        sim = Simulation(first[2], lat=config.getfloat('Main', 'LAT'), lon=config.getfloat('Main', 'LON'),
+                         timezone=config.get('Main', 'TIMEZONE'), base_config=args.config,
+                         world_class=ReplayWorld, dht_failure=0.0)
+        timeline = Timeline(sim, output)
+        started = time()
+        try:
+            replayed = replay(sim, chain([first], rows))
+        finally:
+            sim.shutdown()
+    finally:
+        connection.close()
+        if output is not sys.stdout:
+            output.close()
+
+    elapsed = time() - started
+    sys.stderr.write('Replayed {} readings over {:.1f} days, {} cycles in {:.1f}s, {} timeline rows\n'.format(
+        replayed, (sim.clock.time() - first[2]) / 86400, sim.cycles, elapsed, timeline.rows))
+    sys.stderr.write('Notifications: {}\n'.format(', '.join(
+        '{} {}'.format(count, severity) for severity, count in sim.notifications.severities.most_common())))
+
+
+if __name__ == '__main__':
+    main()
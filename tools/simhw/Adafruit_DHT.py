@@ -0,0 +1,21 @@
+# stand-in for Adafruit_DHT, readings come from the simulated world
+DHT11 = 11
+DHT22 = 22
+AM2302 = 22
+
+# callable returning (humidity %, temperature C), or (None, None) for a failed read
+source = None
+
+
+def read(sensor, pin):
+    if source is None:
+        return None, None
+    return source()
+
+
+def read_retry(sensor, pin, retries=15, delay_seconds=2):
+    for _ in range(retries):
+        humidity, temperature = read(sensor, pin)
+        if humidity is not None and temperature is not None:
+            return humidity, temperature
+    return None, None
@@ -0,0 +1,91 @@
+# in-memory stand-in for RPi.GPIO, used by the simulation tools
+BCM = 11
+BOARD = 10
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+RISING = 31
+FALLING = 32
+BOTH = 33
+
+levels = {}
+edge_callbacks = {}
+# ports whose edge callback is running, RPi.GPIO frees the callback under its own feet if one removes itself
+in_callback = set()
+# called with (port, level) on every output, the simulated world reacts to relays through these
+output_listeners = []
+
+
+def setmode(mode):
+    pass
+
+
+def setwarnings(flag):
+    pass
+
+
+def setup(port, direction, initial=LOW, pull_up_down=PUD_OFF):
+    levels.setdefault(port, int(bool(initial)))
+
+
+def output(port, value):
+    levels[port] = int(bool(value))
+    for listener in output_listeners:
+        listener(port, levels[port])
+
+
+def input(port):  # noqa: A001
+    return levels.get(port, LOW)
+
+
+def add_event_detect(port, edge, callback=None, bouncetime=None):
+    edge_callbacks[port] = (edge, callback)
+
+
+def remove_event_detect(port):
+    if port in in_callback:
+        raise RuntimeError('remove_event_detect({}) called from its own edge callback'.format(port))
+    edge_callbacks.pop(port, None)
+
+
+def cleanup(*ports):
+    pass
+
+
+def set_input(port, value):
+    # simulation side: drive an input and fire the edge callback as the kernel would
+    old = levels.get(port, LOW)
+    new = int(bool(value))
+    levels[port] = new
+    if port in edge_callbacks and old != new:
+        edge, callback = edge_callbacks[port]
+        if edge == BOTH or (edge == RISING) == bool(new):
+            if callback is not None:
+                in_callback.add(port)
+                try:
+                    callback(port)
+                finally:
+                    in_callback.discard(port)
+
+
+class PWM(object):
+    def __init__(self, port, frequency):
+        self.port = port
+        self.frequency = frequency
+        self.duty_cycle = 0
+
+    def start(self, duty_cycle):
+        self.duty_cycle = duty_cycle
+
+    def ChangeDutyCycle(self, duty_cycle):  # noqa: N802
+        self.duty_cycle = duty_cycle
+
+    def ChangeFrequency(self, frequency):  # noqa: N802
+        self.frequency = frequency
+
+    def stop(self):
+        pass
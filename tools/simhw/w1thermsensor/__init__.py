@@ -0,0 +1,28 @@
+# stand-in for w1thermsensor, probes and their readings come from the simulated world
+from w1thermsensor.errors import SensorNotReadyError
+
+
+class W1ThermSensor(object):
+    THERM_SENSOR_DS18B20 = 0x28
+    DEGREES_C = 0x01
+    DEGREES_F = 0x02
+
+    # sensor id: callable returning the temperature in F, or None for a failed read
+    sources = {}
+
+    def __init__(self, sensor_type=THERM_SENSOR_DS18B20, sensor_id=None):
+        self.type = sensor_type
+        self.id = sensor_id
+
+    @classmethod
+    def get_available_sensors(cls, types=None):
+        return [cls(sensor_id=sensor_id) for sensor_id in sorted(cls.sources)]
+
+    def get_temperature(self, unit=DEGREES_C):
+        temp = self.sources[self.id]()
+        if temp is None:
+            raise SensorNotReadyError('Sensor {} is not yet ready to read temperature'.format(self.id))
+        return temp if unit == self.DEGREES_F else (temp - 32.0) / 1.8
+
+    def set_precision(self, precision, persist=False):
+        pass
@@ -0,0 +1,10 @@
+class W1ThermSensorError(Exception):
+    pass
+
+
+class NoSensorFoundError(W1ThermSensorError):
+    pass
+
+
+class SensorNotReadyError(W1ThermSensorError):
+    pass
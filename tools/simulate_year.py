@@ -0,0 +1,95 @@
+import argparse
+from collections import defaultdict
+import logging
+from time import time
+
+import arrow
+
+from simulation import Simulation
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2] if values else None
+
+
+def clock_time(minutes):
+    return '{:02d}:{:02d}'.format(int(minutes) // 60, int(minutes) % 60) if minutes is not None else '--:--'
+
+
+def report_door(sim):
+    print('Door (local times)')
+    print('{:8s} {:>6s} {:>8s} {:>7s} {:>8s} {:>11s}'.format('month', 'opened', 'at', 'closed', 'at', 'travel'))
+    months = defaultdict(lambda: defaultdict(list))
+    for motion, started, travel in sim.world.door_events:
+        local = sim.local(started)
+        months[local.format('YYYY-MM')][motion].append(local.hour * 60 + local.minute)
+        months[local.format('YYYY-MM')]['travel'].append(travel)
+    for month in sorted(months):
+        motions = months[month]
+        print('{:8s} {:6d} {:>8s} {:7d} {:>8s} {:10.1f}s'.format(
+            month, len(motions['opening']), clock_time(median(motions['opening'])),
+            len(motions['closing']), clock_time(median(motions['closing'])), median(motions['travel'])))
+
+
+def report_relays(sim):
+    print('Relays')
+    for name, duty_cycle in sorted(sim.coop.duty_cycles().items()):
+        if duty_cycle.total_switches:
+            print('  {:20s} on {:8.1f}h  {:6d} switches  {:7.1f} kWh'.format(
+                name, duty_cycle.total_on_secs / 3600, duty_cycle.total_switches,
+                duty_cycle.energy_kwh(duty_cycle.total_on_secs)))
+
+
+def report_notifications(sim, top):
+    backend = sim.notifications
+    print('Notifications: {}'.format(', '.join(
+        '{} {}'.format(count, severity) for severity, count in backend.severities.most_common())))
+    for (severity, message), count in backend.messages.most_common(top):
+        print('  {:6d} {:5s} {}'.format(count, severity, message))
+    print('Database rows: {}'.format(', '.join(
+        '{} {}'.format(count, log_type) for log_type, count in sorted(sim.db.rows.items()))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the control logic over simulated days on a virtual clock')
+    parser.add_argument('--days', type=float, default=365)
+    parser.add_argument('--start', default=arrow.utcnow().floor('year').format('YYYY-MM-DD'),
+                        help='first simulated day (UTC)')
+    parser.add_argument('--lat', type=float, default=42.36)
+    parser.add_argument('--lon', type=float, default=-71.06)
+    parser.add_argument('--timezone', default='US/Eastern')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--dht-failure', type=float, default=0.05, help='fraction of failed DHT22 reads')
+    parser.add_argument('--door-travel', type=float, default=8.0, help='door travel time in seconds')
+    parser.add_argument('--quiet-step', type=float, default=60.0,
+                        help='seconds between checks while nothing is close to switching, 0 checks every cycle')
+    parser.add_argument('--top', type=int, default=15, help='most frequent notifications to list')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    sim = Simulation(args.start, lat=args.lat, lon=args.lon, timezone=args.timezone, seed=args.seed,
+                     dht_failure=args.dht_failure, door_travel_secs=args.door_travel,
+                     quiet_step=args.quiet_step or None)
+    started = time()
+    try:
+        sim.run(args.days * 86400)
+    finally:
+        sim.shutdown()
+    elapsed = time() - started
+
+    summary = ('Simulated {:g} days, {} cycles ({} quiet) in {:.1f}s: {:.0f} cycles/s, {:.1f} us per cycle '
+               '(max {:.1f} ms), {:.0f}x real time')
+    print(summary.format(args.days, sim.cycles, sim.quiet_cycles, elapsed, sim.cycles / elapsed,
+                         sim.cycle_secs / sim.cycles * 1e6, sim.max_cycle_secs * 1000, args.days * 86400 / elapsed))
+    print('')
+    report_door(sim)
+    print('')
+    report_relays(sim)
+    print('')
+    report_notifications(sim, args.top)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,423 @@
+import ConfigParser
+from collections import Counter, namedtuple
+import heapq
+import math
+import os
+import random
+import sys
+import tempfile
+from time import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TOOLS_DIR)
+sys.path.insert(0, REPO_DIR)
+# the fake RPi.GPIO, Adafruit_DHT and w1thermsensor shadow the real ones
+sys.path.insert(0, os.path.join(TOOLS_DIR, 'simhw'))
+
+import Adafruit_DHT  # noqa: E402
+import arrow  # noqa: E402
+import RPi.GPIO as GPIO  # noqa: E402
+from w1thermsensor import W1ThermSensor  # noqa: E402
+
+from chickencoopauto import dblog  # noqa: E402
+from chickencoopauto.backends import NotificationBackend  # noqa: E402
+from chickencoopauto.coop import Coop, CONFIG_PATH  # noqa: E402
+from chickencoopauto.logs import NUMBER  # noqa: E402
+from chickencoopauto.utils import Clock, set_clock, Singleton  # noqa: E402
+
+
+WATER_PROBE_ID = '28-000000000001'
+
+# what a controller's auto conditions get from a check
+CheckEvent = namedtuple('CheckEvent', 'kwargs')
+
+
+class VirtualTimer(object):
+    def __init__(self, due, func, args):
+        self.due = due
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class VirtualClock(Clock):
+    # time only moves when the simulation advances it, timers fire on the simulation's thread
+    def __init__(self, start):
+        self.now = float(start)
+        self.timers = []
+        self.scheduled = 0
+        self.utcnow_cache = (None, None)
+
+    def time(self):
+        return self.now
+
+    def utcnow(self):
+        # sensors ask several times per cycle, and an Arrow is immutable
+        if self.utcnow_cache[0] != self.now:
+            self.utcnow_cache = (self.now, arrow.Arrow.utcfromtimestamp(self.now))
+        return self.utcnow_cache[1]
+
+    def sleep(self, secs):
+        self.advance(secs)
+
+    def timer(self, secs, func, args=()):
+        timer = VirtualTimer(self.now + secs, func, args)
+        self.scheduled += 1
+        heapq.heappush(self.timers, (timer.due, self.scheduled, timer))
+        return timer
+
+    def advance(self, secs):
+        target = self.now + secs
+        while self.timers and self.timers[0][0] <= target:
+            due, _, timer = heapq.heappop(self.timers)
+            self.now = max(self.now, due)
+            if not timer.cancelled:
+                timer.func(*timer.args)
+        self.now = max(self.now, target)
+
+
+class SimDB(object):
+    # counts the rows the coop would log, instead of writing them to PostgreSQL
+    def __init__(self):
+        self.rows = Counter()
+
+    def insert(self, table, **values):
+        self.rows[values.get('log_type', table)] += 1
+
+    def multiple_insert(self, table, values):
+        for row in values:
+            self.insert(table, **row)
+
+
+class CountingBackend(NotificationBackend):
+    def __init__(self):
+        super(CountingBackend, self).__init__('Simulation', 'INFO')
+        self.severities = Counter()
+        self.messages = Counter()
+
+    def submit(self, notification):
+        self.severities[notification.severity] += 1
+        # times and readings masked, so the same notification on different days counts once
+        self.messages[(notification.severity, NUMBER.sub('#', notification.message))] += 1
+
+    def deliver(self, notification):
+        pass
+
+
+class Weather(object):
+    def __init__(self, lon, seed=0, mean_temp=50.0, annual_swing=22.0, daily_swing=9.0, noise=5.0,
+                 coldest_day=20, front_hours=48.0):
+        self.lon = lon
+        self.random = random.Random(seed)
+        self.mean_temp = mean_temp
+        self.annual_swing = annual_swing
+        self.daily_swing = daily_swing
+        self.noise = noise
+        self.coldest_day = coldest_day
+        self.front_secs = front_hours * 3600
+        # slowly wandering offsets for warm and cold fronts
+        self.temp_offset = 0.0
+        self.humi_offset = 0.0
+        self.temp = None
+        self.humi = None
+
+    def step(self, timestamp, secs):
+        decay = math.exp(-secs / self.front_secs)
+        spread = math.sqrt(1 - decay ** 2)
+        self.temp_offset = self.temp_offset * decay + self.random.gauss(0, self.noise) * spread
+        self.humi_offset = self.humi_offset * decay + self.random.gauss(0, 10.0) * spread
+        day = (timestamp / 86400.0) % 365.25
+        # local solar time, warmest at 3pm
+        hour = (timestamp / 3600.0 + self.lon / 15.0) % 24
+        daily = math.cos(2 * math.pi * (hour - 15) / 24)
+        self.temp = (self.mean_temp -
+                     self.annual_swing * math.cos(2 * math.pi * (day - self.coldest_day) / 365.25) +
+                     self.daily_swing * daily +
+                     self.temp_offset)
+        self.humi = min(100.0, max(15.0, 65.0 - 15.0 * daily + self.humi_offset))
+
+
+class World(object):
+    def __init__(self, config, clock, weather, seed=0, door_travel_secs=8.0, water_days=10.0, refill_days=7,
+                 dht_failure=0.05):
+        self.clock = clock
+        self.weather = weather
+        self.random = random.Random(seed + 1)
+        self.door_travel_secs = door_travel_secs
+        self.water_secs = water_days * 86400
+        self.refill_secs = refill_days * 86400
+        self.dht_failure = dht_failure
+        self.coop = None
+        # faults, see set_fault
+        self.faults = {}
+
+        self.open_port = config['Door']['PORT_2']
+        self.close_port = config['Door']['PORT_1']
+        self.top_switch_port = config['Door']['OPEN_SENSOR_PORT']
+        self.bottom_switch_port = config['Door']['CLOSED_SENSOR_PORT']
+        self.half_switch_port = config['Water']['SENSOR_LEVEL_TOP_PORT']
+        self.empty_switch_port = config['Water']['SENSOR_LEVEL_BOTTOM_PORT']
+
+        self.door_motion = None
+        self.door_arrival = None
+        self.door_events = []
+        self.water_temp = 45.0
+        self.water_level = 1.0
+        self.refilled = clock.time()
+        self.weather.step(clock.time(), 0)
+
+        GPIO.levels.clear()
+        GPIO.edge_callbacks.clear()
+        GPIO.levels[self.bottom_switch_port] = 1
+        GPIO.levels[self.half_switch_port] = 1
+        GPIO.levels[self.empty_switch_port] = 1
+        GPIO.output_listeners[:] = [self.on_output]
+        Adafruit_DHT.source = self.read_dht
+        W1ThermSensor.sources = {WATER_PROBE_ID: self.read_water_probe}
+
+    def attach(self, coop):
+        self.coop = coop
+
+    def set_fault(self, name, value=True):
+        # door_stuck, dht_dead, probe_dead, water_leak
+        if value:
+            self.faults[name] = value
+        else:
+            self.faults.pop(name, None)
+
+    @property
+    def coop_temp(self):
+        heater_on = self.coop is not None and self.coop.heater_relay.state == 'on'
+        fan_on = self.coop is not None and self.coop.fan_relay.state == 'on'
+        return self.weather.temp + 4.0 + (10.0 if heater_on else 0.0) - (2.0 if fan_on else 0.0)
+
+    def read_dht(self):
+        if self.faults.get('dht_dead') or self.random.random() < self.dht_failure:
+            return None, None
+        return self.weather.humi, (self.coop_temp - 32.0) / 1.8
+
+    def read_water_probe(self):
+        if self.faults.get('probe_dead'):
+            return None
+        return round(self.water_temp + self.random.gauss(0, 0.1), 1)
+
+    def on_output(self, port, level):
+        if port not in (self.open_port, self.close_port):
+            return
+        if level and self.door_motion is None:
+            self.door_motion = 'opening' if port == self.open_port else 'closing'
+            # the switch the door leaves opens right away
+            GPIO.set_input(self.bottom_switch_port if port == self.open_port else self.top_switch_port, 0)
+            if not self.faults.get('door_stuck'):
+                travel = self.door_travel_secs * max(0.5, self.random.gauss(1.0, 0.03))
+                self.door_arrival = self.clock.timer(travel, self.door_arrived,
+                                                     args=(self.door_motion, self.clock.time()))
+        elif not level and self.door_motion is not None:
+            # motor stopped, halfway if it hadn't arrived yet
+            if self.door_arrival is not None:
+                self.door_arrival.cancel()
+            self.door_motion = None
+            self.door_arrival = None
+
+    def door_arrived(self, motion, started):
+        self.door_arrival = None
+        self.door_events.append((motion, started, self.clock.time() - started))
+        GPIO.set_input(self.top_switch_port if motion == 'opening' else self.bottom_switch_port, 1)
+
+    def step(self, secs):
+        now = self.clock.time()
+        self.weather.step(now, secs)
+        heater_on = self.coop.water_heater_relay.state == 'on'
+        # the tank follows the outside temperature over a few hours, the heater adds about 10F an hour
+        self.water_temp += (self.weather.temp - self.water_temp) * (1 - math.exp(-secs / (3 * 3600.0)))
+        if heater_on and self.water_level > 0:
+            self.water_temp += 10.0 * secs / 3600
+        self.water_temp = max(32.0, self.water_temp)
+        self.step_water_level(now, secs)
+
+    def step_water_level(self, now, secs):
+        drain = secs / self.water_secs * (20 if self.faults.get('water_leak') else 1)
+        self.water_level = max(0.0, self.water_level - drain)
+        if now - self.refilled >= self.refill_secs:
+            self.water_level = 1.0
+            self.refilled = now
+        GPIO.set_input(self.half_switch_port, self.water_level > 0.5)
+        GPIO.set_input(self.empty_switch_port, self.water_level > 0.1)
+
+
+def write_config(path, overrides, base_config=None):
+    parser = ConfigParser.RawConfigParser()
+    parser.optionxform = str
+    parser.read(base_config or os.path.join(REPO_DIR, 'config.ini.example'))
+    for section in parser.sections():
+        # the simulated bus only has the water probe
+        if section.startswith('Probe '):
+            parser.remove_section(section)
+    for (section, option), value in overrides.items():
+        if not parser.has_section(section):
+            parser.add_section(section)
+        parser.set(section, option, value)
+    with open(path, 'w') as config_file:
+        parser.write(config_file)
+
+
+class Simulation(object):
+    def __init__(self, start, lat=42.36, lon=-71.06, timezone='US/Eastern', seed=0, workdir=None,
+                 base_config=None, config_overrides=None, world_class=World, quiet_step=None, quiet_temp=0.5,
+                 **world_kwargs):
+        self.clock = VirtualClock(arrow.get(start).float_timestamp)
+        set_clock(self.clock)
+        self.timezone = timezone
+        self.workdir = workdir or tempfile.mkdtemp(prefix='coopsim-')
+        overrides = {
+            ('Main', 'LAT'): lat,
+            ('Main', 'LON'): lon,
+            ('Main', 'TIMEZONE'): timezone,
+            ('Main', 'HISTORY_HOURS'): 1,
+            # never touch the files of a real installation when simulating from its config.ini
+            ('Main', 'SUNRISE_SUNSET_CACHE'): 'sunrise_sunset_cache.json',
+            ('Main', 'DUTY_CYCLE_FILE'): 'duty_cycles.json',
+            ('Main', 'CHECKPOINT_FILE'): 'controller_state.json',
+            ('Main', 'DUTY_CYCLE_SAVE_INTERVAL'): 86400,
+            ('Main', 'CONFIG_WATCH_INTERVAL'): 0,
+            # config.ini.example shares some ports, the simulated world tells the relays apart by port
+            ('AmbientTempHumi', 'FAN_PORT'): 20,
+            ('AmbientTempHumi', 'HEATER_PORT'): 16,
+            ('Other', 'UNUSED_PORT_1'): 5,
+            ('Other', 'UNUSED_PORT_2'): 6,
+            ('Water', 'SENSOR_ID'): WATER_PROBE_ID,
+            ('Notifications', 'LOG'): False,
+            ('Notifications', 'EMAIL'): False,
+            ('Notifications', 'SMS'): False,
+            ('Notifications', 'DIGEST'): False,
+        }
+        overrides.update(config_overrides or {})
+        base_config = os.path.abspath(base_config) if base_config else None
+        os.chdir(self.workdir)
+        write_config(CONFIG_PATH, overrides, base_config)
+
+        self.db = SimDB()
+        dblog.get_db = lambda coop: self.db
+
+        # Coop() is one instance for the life of the process, every simulation starts from a new one
+        Singleton._Singleton__instance = None
+        self.coop = Coop()
+        self.world = world_class(self.coop.config, self.clock, Weather(lon, seed=seed), seed=seed, **world_kwargs)
+        self.coop.initialize_sensors_relays()
+        # the simulation reads the probes on the virtual clock instead
+        self.coop.onewire_bus.stop()
+        self.notifications = CountingBackend()
+        self.coop.register_notification_backend(self.notifications)
+        self.world.attach(self.coop)
+
+        self.cycles = 0
+        self.cycle_secs = 0.0
+        self.max_cycle_secs = 0.0
+        self.cycle_started = None
+        self.next_probe_read = self.clock.time()
+        # longest wait between cycles while nothing is within quiet_temp degrees or two quiet steps of switching,
+        # None runs every cycle CHECK_FREQUENCY apart
+        self.quiet_step = quiet_step
+        self.quiet_temp = quiet_temp
+        self.quiet_cycles = 0
+
+    def run(self, secs, on_cycle=None):
+        end = self.clock.time() + secs
+        step = self.coop.config['Main']['CHECK_FREQUENCY']
+        while self.clock.time() < end:
+            if self.clock.time() >= self.next_probe_read:
+                self.read_probes()
+                self.next_probe_read = max(self.next_probe_read, self.clock.time()) + \
+                    self.coop.onewire_bus.interval_secs
+            # virtual time also moves during a cycle, whenever the coop sleeps
+            self.cycle_started = self.clock.time()
+            started = time()
+            self.coop.cycle()
+            cycle_secs = time() - started
+            self.cycle_secs += cycle_secs
+            self.max_cycle_secs = max(self.max_cycle_secs, cycle_secs)
+            self.cycles += 1
+            if on_cycle is not None:
+                on_cycle(self, cycle_secs)
+            secs = step
+            if self.quiet_step:
+                secs = max(step, min(self.quiet_step, self.quiet_secs()) // step * step)
+                if secs > step:
+                    self.quiet_cycles += 1
+            # the world keeps its own pace, so quiet steps don't change the weather
+            for _ in range(int(secs // step)):
+                self.world.step(step)
+                self.clock.advance(step)
+
+    def quiet_secs(self):
+        # how long the next cycle can wait without missing anything the coop would do, 0 if it can't
+        coop = self.coop
+        now = self.clock.time()
+        if self.world.faults or self.world.door_motion is not None or coop.door.is_moving():
+            return 0
+        sun = coop.sunset_sunrise_sensor
+        if sun.last is None or any(abs(now - ts) < 2 * self.quiet_step for ts in (sun.sunrise_ts, sun.sunset_ts)):
+            return 0
+        door = coop.door
+        if not door.state.endswith(('-day', '-night')) or \
+                ('open' in door.state) != (coop.door_dual_sensor.state == 'open') or \
+                ('day' in door.state) != (sun.state == 'day'):
+            return 0
+
+        ambient = coop.ambient_temp_humi_sensor
+        water_temp = coop.water_temp_sensor
+        for sensor in [ambient, coop.water_level_dual_sensor, coop.door_dual_sensor] + coop.temp_probes():
+            # the last check left the state alone and nothing it looks at changed since
+            if sensor.unchanged_check != (sensor.state, sensor.check_inputs()):
+                return 0
+        for sensor in [ambient] + coop.temp_probes():
+            if sensor.temp is None or self.near(sensor.temp, (sensor.temp_error_low, sensor.temp_low,
+                                                              sensor.temp_high, sensor.temp_error_high)):
+                return 0
+        # a filtered reading still catching up, after the heater switched say
+        if abs(ambient.temp - self.world.coop_temp) >= self.quiet_temp or \
+                abs(water_temp.temp - self.world.water_temp) >= self.quiet_temp:
+            return 0
+
+        secs = self.quiet_step
+        water_empty = coop.water_level_dual_sensor.state in ['empty', 'invalid']
+        for controller, kwargs in ((coop.water_heater, {'temp': water_temp.temp, 'water_empty': water_empty}),
+                                   (coop.fan, {'temp': ambient.temp}),
+                                   (coop.heater, {'temp': ambient.temp}),
+                                   (coop.light, {'sunrise_sunset': sun})):
+            event = CheckEvent(kwargs)
+            if controller.state == 'auto-on':
+                switching = controller.is_auto_go_off(event)
+            elif controller.state == 'auto-off':
+                switching = controller.is_auto_go_on(event)
+            elif controller.state in ('manual-on', 'manual-off'):
+                continue
+            else:
+                return 0
+            if switching:
+                # nothing happens before the dwell is over
+                if controller.is_dwell_overridden(event):
+                    return 0
+                min_secs = controller.min_on_secs if controller.is_on() else controller.min_off_secs
+                secs = min(secs, min_secs - controller.relay.secs_in_state())
+            elif hasattr(controller, 'temp_range') and self.near(kwargs['temp'], controller.temp_range):
+                return 0
+        return max(0, secs)
+
+    def near(self, temp, thresholds):
+        return any(abs(temp - threshold) < self.quiet_temp for threshold in thresholds)
+
+    def read_probes(self):
+        bus = self.coop.onewire_bus
+        for sensor in bus.sensors.values():
+            bus.read(sensor)
+
+    def local(self, timestamp):
+        return arrow.Arrow.utcfromtimestamp(timestamp).to(self.timezone)
+
+    def shutdown(self):
+        self.coop.shutdown()
+        set_clock(Clock())
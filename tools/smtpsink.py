@@ -0,0 +1,38 @@
+import asyncore
+import smtpd
+from threading import Condition, Thread
+from time import time
+
+
+class SMTPSink(smtpd.SMTPServer):
+    """In-process SMTP server that keeps every message it receives, for local testing."""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        smtpd.SMTPServer.__init__(self, (host, port), None)
+        self.host = host
+        self.port = self.socket.getsockname()[1]
+        self.messages = []
+        self.received = Condition()
+        self.thread = None
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        with self.received:
+            self.messages.append((time(), mailfrom, rcpttos, data))
+            self.received.notify_all()
+
+    def start(self):
+        self.thread = Thread(target=asyncore.loop, kwargs={'timeout': 0.1, 'use_poll': True})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def wait_for(self, count, timeout):
+        deadline = time() + timeout
+        with self.received:
+            while len(self.messages) < count and time() < deadline:
+                self.received.wait(deadline - time())
+            return len(self.messages) >= count